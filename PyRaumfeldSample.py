@@ -45,7 +45,7 @@ def dataHasBeenUpdated():
 
 raumfeld.setLogging(logging.WARN);
 raumfeld.registerChangeCallback(dataHasBeenUpdated)
-raumfeld.init() # or with the host IP: raumfeld.init("192.168.0.10")
+raumfeld.init().result() # or with the host IP: raumfeld.init("192.168.0.10")
 print(("Host URL: " +raumfeld.hostBaseURL))
 
 
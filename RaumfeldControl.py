@@ -5,36 +5,140 @@ Created on 25.01.2015
 @author: patrick
 '''
 
+import argparse
+import gzip
+import hashlib
 import json
 import logging
+import math
 import raumfeld
 import threading
-from bottle import route, run
-from urllib.parse import quote, unquote
+import time
+from bottle import HTTPError, ServerAdapter, request, response, route, run
+from raumfeld.wsgiserver import WSGIServer
+from urllib.parse import parse_qs, quote, unquote
+
+changeFeed = raumfeld.getChangeFeed()
+
+class TopologyJsonCache(object):
+    """JSON bodies of the topology listings, serialized once per topology version
+
+    The ETag is a hash of the body, so it stays valid across restarts of the server. The
+    compressed body is another representation and has its own ETag
+    """
+
+    class Entry(object):
+        __slots__ = ('body', 'etag', 'gzipped', 'gzip_etag')
+
+        def __init__(self, body):
+            self.body = body
+            digest = hashlib.sha1(body).hexdigest()[:20]
+            self.etag = '"{0}"'.format(digest)
+            self.gzip_etag = '"{0}-gz"'.format(digest)
+            self.gzipped = None  # compressed on the first request which accepts it
+
+    def __init__(self):
+        self._version = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """Returns the Entry of key; build(topology) returns the data if it is not cached yet"""
+        topology = raumfeld.getTopology()
+        with self._lock:
+            if topology.version != self._version:
+                self._version = topology.version
+                self._entries = {}
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self.Entry(json.dumps(build(topology)).encode('utf-8'))
+            with self._lock:
+                if topology.version == self._version:
+                    entry = self._entries.setdefault(key, entry)
+        return entry
+
+jsonCache = TopologyJsonCache()
+GZIP_MIN_SIZE = 512  # smaller bodies are sent uncompressed
+
+def __acceptsGzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip; "gzip;q=0" refuses it"""
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, _, parameters = coding.partition(';')
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            key, _, value = parameter.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+def __sendCachedJson(key, build):
+    """Serve the cached body of key: 304 if the client has it, compressed if enabled and accepted"""
+    entry = jsonCache.get(key, build)
+    compress = args.gzip and len(entry.body) >= GZIP_MIN_SIZE and \
+        __acceptsGzip(request.get_header('Accept-Encoding', ''))
+    etag = entry.gzip_etag if compress else entry.etag
+    response.set_header('ETag', etag)
+    response.set_header('Vary', 'Accept-Encoding')
+    # If-None-Match uses the weak comparison
+    if_none_match = [tag.strip() for tag in request.get_header('If-None-Match', '').split(',')]
+    if etag in [tag[2:] if tag.startswith('W/') else tag for tag in if_none_match] or \
+            '*' in if_none_match:
+        response.status = 304
+        return b''
+    if compress:
+        if entry.gzipped is None:
+            entry.gzipped = gzip.compress(entry.body, 6)
+        response.set_header('Content-Encoding', 'gzip')
+        return entry.gzipped
+    return entry.body
+
+def __listing(elements):
+    """Returns the data of a listing of zones or rooms: their names and UDNs"""
+    returndata = {}
+    returndata["data"] = []
+    returndata["success"] = False
+    for element in elements:
+        e = {}
+        e['name'] = element.Name
+        e['udn'] = element.UDN
+        returndata["data"].append(e)
+        returndata["success"] = True
+    return returndata
+
+def __playPause(zone):
+    """Plays the zone if it is stopped or paused, pauses it otherwise"""
+    TState = str(zone.transport_info['CurrentTransportState'])
+    if str(TState) == "STOPPED" or str(TState) == "PAUSED_PLAYBACK":
+            zone.mute = False
+            zone.play()
+    else:
+            zone.pause()
 
-updateAvailableEvent = threading.Event()
+def __separate(room):
+    """Separates the room from its zone; returns whether the host reported the change in time"""
+    version = changeFeed.version
+    raumfeld.connectRoomToZone(room.UDN)
+    return changeFeed.wait(version, 10) != version
 
 def __getSingleZone(name_udn):
-    """Tries to find the first occurring Zone with the specified name or UDN"""
-    zone = None
+    """Tries to find the Zone with the specified UDN or the best matching name"""
     if (name_udn.startswith("uuid:")):
-        zone = raumfeld.getZoneByUDN(name_udn)
-    else:
-        zones = raumfeld.getZonesByName(name_udn.decode('utf-8'))
-        if (len(zones) > 0):
-            zone = zones[0]
-    return zone
+        return raumfeld.getZoneByUDN(name_udn)
+    return raumfeld.getZoneByName(name_udn)
 
 def __getSingleRoom(name_udn):
-    """Tries to find the first occurring Room with the specified name or UDN"""
-    room = None
+    """Tries to find the Room with the specified UDN or the best matching name"""
     if (name_udn.startswith("uuid:")):
-        room = raumfeld.getRoomByUDN(name_udn)
-    else:
-        rooms = raumfeld.getRoomsByName(name_udn.decode('utf-8'))
-        if (len(rooms) > 0):
-            room = rooms[0]
-    return room
+        return raumfeld.getRoomByUDN(name_udn)
+    return raumfeld.getRoomByName(name_udn)
 
 
 @route('/')
@@ -46,7 +150,10 @@ def index():
     returndata += '<li>/zones - list zones</li>'
     returndata += '<li>/unassignedRooms - list unassigned rooms</li>'
     returndata += '<li>/waitForChanges - returns the request when something changed in the zone structure</li>'
+    returndata += '<li>/waitForChanges?since=&lt;cursor&gt; - returns the changes after the version of the &lt;cursor&gt; at once or as soon as there are some, in JSON format</li>'
+    returndata += '<li>/events - stream of the changes as Server-Sent Events</li>'
     returndata += '<li>/update - updates the internal device and zone data</li>'
+    returndata += '<li>POST /batch - runs a JSON list of zone and room operations, see below</li>'
     returndata += '</ul>'
     returndata += '<b>Zone actions:</b>'
     returndata += '<ul>'
@@ -71,6 +178,12 @@ def index():
     returndata += '<li>/room/&lt;name_udn&gt;/zone - get the zone associated to the given room</li>'
     returndata += '<li>/room/&lt;name_udn&gt;/separate - Separates the the Room defined by the name or UDN from its zone</li>'
     returndata += '</ul>'
+    returndata += '<b>Batch:</b>'
+    returndata += '<p>POST /batch with a JSON list of operations like {"zone": "&lt;name_udn&gt;", "action": "volume", "value": 20, "group": 0} '
+    returndata += 'or {"room": "&lt;name_udn&gt;", "action": "separate"}, or {"operations": [...], "timeout": &lt;seconds&gt;}. '
+    returndata += 'Zone actions: ' + ', '.join(sorted(ZONE_ACTIONS)) + '; room actions: ' + ', '.join(sorted(ROOM_ACTIONS)) + '. '
+    returndata += 'The operations of a group run concurrently, those of one zone or room in their order; the groups run one after the other in ascending order. '
+    returndata += 'Returns one result per operation in the order of the request.</p>'
     returndata += '</body></html>'
     return returndata
 
@@ -80,30 +193,13 @@ def index():
 @route('/zones')
 def getZones():
     """Returns the Zone names and UDNs in JSON format"""
-    returndata = {}
-    returndata["data"] = []
-    returndata["success"] = False
-    for zone in raumfeld.getZones():
-        z = {}
-        z['name'] = zone.Name
-        z['udn'] = zone.UDN
-        returndata["data"].append(z)
-        returndata["success"] = True
-    return json.dumps(returndata)
+    return __sendCachedJson('zones', lambda topology: __listing(topology.zones))
 
 @route('/unassignedRooms')
 def getUnassignedRooms():
     """Returns the unassigned room names and UDNs in JSON format"""
-    returndata = {}
-    returndata["data"] = []
-    returndata["success"] = False
-    for room in raumfeld.getUnassignedRooms():
-        r = {}
-        r['name'] = room.Name
-        r['udn'] = room.UDN
-        returndata["data"].append(r)
-        returndata["success"] = True
-    return json.dumps(returndata)
+    return __sendCachedJson('unassignedRooms',
+                            lambda topology: __listing(topology.unassigned_rooms))
 
 
 
@@ -160,18 +256,11 @@ def changeZoneVolume(name_udn, amount):
 @route('/zone/<name_udn>/rooms')
 def getZoneRooms(name_udn):
     """Gets the rooms of the Zone defined by the name or UDN"""
-    returndata = {}
-    returndata["data"] = []
-    returndata["success"] = False
     zone = __getSingleZone(name_udn)
-    if zone != None:
-        for room in zone.getRooms():
-            r = {}
-            r['name'] = room.Name
-            r['udn'] = room.UDN
-            returndata["data"].append(r)
-            returndata["success"] = True
-    return json.dumps(returndata)
+    if zone == None:
+        return json.dumps(__listing(()))
+    return __sendCachedJson(('rooms', zone.UDN), lambda topology: __listing(
+        topology.zones_by_udn[zone.UDN].getRooms() if zone.UDN in topology.zones_by_udn else ()))
 
 
 @route('/zone/<name_udn>/play/<uri:path>')
@@ -221,12 +310,7 @@ def zonePlay_Pause(name_udn):
     returndata["success"] = False
     zone = __getSingleZone(name_udn)
     if zone != None:
-        TState = str(zone.transport_info['CurrentTransportState'])
-        if str(TState) == "STOPPED" or str(TState) == "PAUSED_PLAYBACK":
-                zone.mute = False
-                zone.play()
-        else:
-                zone.pause()
+        __playPause(zone)
         returndata["success"] = True
     return json.dumps(returndata)
 
@@ -258,7 +342,7 @@ def getTransportInfo(name_udn):
     returndata["success"] = False
     zone = __getSingleZone(name_udn)
     if zone != None:
-        returndata["data"].append(zone.transport_info_CurrentTransportState(zone))
+        returndata["data"].append(zone.transport_info_CurrentTransportState)
         returndata["success"] = True
     return json.dumps(returndata)
 
@@ -321,14 +405,11 @@ def getRoomZone(name_udn):
 @route('/room/<name_udn>/separate')
 def separateRoom(name_udn):
     """Separates the the Room defined by the name or UDN from its zone"""
-    global updateAvailableEvent
     returndata = {}
     returndata["success"] = False
     room = __getSingleRoom(name_udn)
     if room != None:
-        raumfeld.connectRoomToZone(room.UDN)
-        if updateAvailableEvent.wait(10):
-            returndata["success"] = True
+        returndata["success"] = __separate(room)
     return json.dumps(returndata)
 
 
@@ -336,15 +417,260 @@ def separateRoom(name_udn):
 ##################
 # Wait for Changes
 ##################
+# The change feed counts the topology changes: a client passes the cursor of the last version
+# it has seen and gets all changes after it, so nothing is missed between two requests. The
+# cursor "<epoch>:<version>" tells a restarted server that the client has to resynchronize.
+# With the concurrent server /waitForChanges and /events wait on the event loop without a thread.
+LONG_POLL_TIMEOUT = 10
+EVENT_KEEP_ALIVE = 15
+
+def __parseSince(value):
+    """Returns the tuple (valid, version) of a cursor
+
+    version is None for a cursor of another epoch, e.g. from before a restart of the server
+    """
+    try:
+        return True, changeFeed.versionOf(value)
+    except ValueError:
+        return False, None
+
+def __changesResponse(since):
+    """Returns the JSON of the changes after the version since"""
+    version, changes = changeFeed.changesSince(since)
+    returndata = {}
+    returndata["version"] = changeFeed.cursor(version)
+    # The changes are no longer known: the client has to read the zones again
+    returndata["resync"] = changes is None
+    returndata["changes"] = []
+    for change_version, diff in changes or ():
+        c = diff._asdict()
+        c["version"] = change_version
+        returndata["changes"].append(c)
+    return json.dumps(returndata)
+
+def __sseEvents(since):
+    """Returns the Server-Sent Events of the changes after the version since and the new version"""
+    version, changes = changeFeed.changesSince(since)
+    if changes is None:
+        cursor = changeFeed.cursor(version)
+        return 'id: {0}\nevent: resync\ndata: {{"version": "{0}"}}\n\n'.format(cursor), version
+    events = ''
+    for change_version, diff in changes:
+        events += 'id: {0}\nevent: topology\ndata: {1}\n\n'.format(
+            changeFeed.cursor(change_version), json.dumps(diff._asdict()))
+    return events, version
+
 @route('/waitForChanges')
 def waitForChanges():
-    """Returns when an update in the DataStructure happened"""
-    global updateAvailableEvent
-    returndata = []
-    if updateAvailableEvent.wait(10):
-        r = {}
-        r['changes'] = True
-        returndata.append(r)
+    """Returns when an update in the DataStructure happened
+
+    With ?since=<cursor> it returns the changes after that version at once if there are some
+    """
+    since = request.query.get('since')
+    if since is None:
+        version = changeFeed.version
+        if changeFeed.wait(version, LONG_POLL_TIMEOUT) != version:
+            return json.dumps([{'changes': True}])
+        return json.dumps([])
+    valid, since = __parseSince(since)
+    if not valid:
+        raise HTTPError(400, "since has to be a version cursor")
+    if since is not None:
+        changeFeed.wait(since, LONG_POLL_TIMEOUT)
+    response.content_type = 'application/json'
+    return __changesResponse(since)
+
+@route('/events')
+def events():
+    """Server-Sent Events stream of the changes; occupies a thread unless the concurrent server is used"""
+    valid, since = __parseSince(request.get_header('Last-Event-ID', ''))
+    if not valid:
+        since = changeFeed.version
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+    while True:
+        data, since = __sseEvents(since)
+        yield data
+        if changeFeed.wait(since, EVENT_KEEP_ALIVE) == since:
+            yield ': keep-alive\n\n'
+
+async def __waitForChangesAsync(environ, asyncResponse):
+    """/waitForChanges on the event loop of the concurrent server"""
+    since = parse_qs(environ['QUERY_STRING']).get('since', [None])[0]
+    if since is None:
+        version = changeFeed.version
+        changed = await changeFeed.waitAsync(version, LONG_POLL_TIMEOUT) != version
+        body = json.dumps([{'changes': True}] if changed else [])
+        await asyncResponse.send('200 OK', [('Content-Type', 'text/html; charset=UTF-8')],
+                                 body.encode('utf-8'))
+        return
+    valid, since = __parseSince(since)
+    if not valid:
+        await asyncResponse.send('400 Bad Request', [('Content-Type', 'text/plain')],
+                                 b'since has to be a version cursor')
+        return
+    if since is not None:
+        await changeFeed.waitAsync(since, LONG_POLL_TIMEOUT)
+    await asyncResponse.send('200 OK', [('Content-Type', 'application/json')],
+                             __changesResponse(since).encode('utf-8'))
+
+async def __eventsAsync(environ, asyncResponse):
+    """/events on the event loop of the concurrent server"""
+    valid, since = __parseSince(environ.get('HTTP_LAST_EVENT_ID', ''))
+    if not valid:
+        since = changeFeed.version
+    await asyncResponse.start('200 OK', [('Content-Type', 'text/event-stream'),
+                                         ('Cache-Control', 'no-cache')])
+    while True:
+        data, since = __sseEvents(since)
+        if data:
+            await asyncResponse.write(data.encode('utf-8'))
+        if await changeFeed.waitAsync(since, EVENT_KEEP_ALIVE) == since:
+            await asyncResponse.write(b': keep-alive\n\n')
+
+
+#######
+# Batch
+#######
+# POST /batch runs the operations of a scene in one request instead of one request each, e.g.
+# [{"zone": "Wohnzimmer", "action": "volume", "value": 20},
+#  {"room": "Küche", "action": "separate", "group": 0},
+#  {"zone": "Wohnzimmer", "action": "play", "value": "<uri>", "group": 1}]
+# The operations of a group run concurrently on raumfeld.runConcurrently, the operations of one
+# zone or room in their order; the groups (default 0) run one after the other in ascending order.
+BATCH_TIMEOUT = 30
+MAX_BATCH_OPERATIONS = 100
+
+def __zoneVolume(zone, value):
+    if value is None:
+        return zone.volume
+    if isinstance(value, str) and value.startswith(('+', '-')):
+        zone.changeVolume(int(value))
+    else:
+        zone.volume = int(value)
+
+def __roomVolume(room, value):
+    if value is None:
+        return room.volume
+    room.volume = int(value)
+
+def __roomZone(room, value):
+    zone = raumfeld.getZoneWithRoomUDN(room.UDN)
+    if zone is None:
+        raise LookupError("The room is in no zone")
+    return {'udn': zone.UDN, 'name': zone.Name}
+
+def __roomSeparate(room, value):
+    if not __separate(room):
+        raise TimeoutError("The host did not report the change")
+
+# action -> function(element, value) returning the data of the result
+ZONE_ACTIONS = {
+    'volume': __zoneVolume,
+    'play': lambda zone, value: zone.play(value),
+    'pause': lambda zone, value: zone.pause(),
+    'stop': lambda zone, value: zone.stop(),
+    'play_pause': lambda zone, value: __playPause(zone),
+    'next': lambda zone, value: next(zone),
+    'previous': lambda zone, value: zone.previous(),
+    'transport_info': lambda zone, value: str(zone.transport_info_CurrentTransportState),
+}
+ROOM_ACTIONS = {
+    'volume': __roomVolume,
+    'zone': __roomZone,
+    'separate': __roomSeparate,
+}
+
+def __isNumber(value):
+    """Whether a JSON value is a finite number; true and false are no numbers"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def __batchOperation(operation):
+    """Returns (element, function, value) of an operation; raises ValueError if it is invalid"""
+    if not isinstance(operation, dict):
+        raise ValueError("An operation has to be an object")
+    if 'zone' in operation:
+        kind, actions, lookup = 'zone', ZONE_ACTIONS, __getSingleZone
+    elif 'room' in operation:
+        kind, actions, lookup = 'room', ROOM_ACTIONS, __getSingleRoom
+    else:
+        raise ValueError("An operation needs a zone or a room")
+    if not isinstance(operation[kind], str):
+        raise ValueError("{0} has to be a name or UDN".format(kind))
+    action = operation.get('action')
+    if not isinstance(action, str):
+        raise ValueError("action has to be a string")
+    function = actions.get(action)
+    if function is None:
+        raise ValueError("Unknown {0} action: {1}".format(kind, action))
+    element = lookup(operation[kind])
+    if element is None:
+        raise ValueError("Unknown {0}: {1}".format(kind, operation[kind]))
+    return element, function, operation.get('value')
+
+def __runBatchGroup(operations, results, timeout):
+    """Runs the (index, element, function, value) operations; the ones of an element in order"""
+    byElement = {}
+    for operation in operations:
+        byElement.setdefault(operation[1].UDN, []).append(operation)
+
+    def runOperations(element):
+        for index, _, function, value in byElement[element.UDN]:
+            try:
+                results[index] = {'success': True, 'data': function(element, value)}
+            except Exception as e:
+                results[index] = {'success': False, 'error': str(e) or type(e).__name__}
+
+    for bulkResult in raumfeld.runConcurrently(list(byElement), runOperations, timeout):
+        if bulkResult.error is not None:  # the deadline passed or the lookup failed
+            for index, _, _, _ in byElement[bulkResult.target]:
+                if results[index] is None:
+                    results[index] = {'success': False,
+                                      'error': str(bulkResult.error) or
+                                      type(bulkResult.error).__name__}
+
+@route('/batch', method='POST')
+def batch():
+    """Runs a list of zone and room operations; returns the result of each in their order"""
+    try:
+        operations = json.loads(request.body.read().decode('utf-8'))
+    except ValueError:
+        raise HTTPError(400, "The body has to be a JSON list of operations")
+    timeout = BATCH_TIMEOUT
+    if isinstance(operations, dict):
+        timeout = operations.get('timeout', BATCH_TIMEOUT)
+        operations = operations.get('operations')
+    if not isinstance(operations, list):
+        raise HTTPError(400, "The body has to be a JSON list of operations")
+    if not __isNumber(timeout) or timeout < 0:
+        raise HTTPError(400, "timeout has to be a number of seconds")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPError(400, "At most {0} operations per batch".format(MAX_BATCH_OPERATIONS))
+
+    results = [None] * len(operations)
+    groups = {}
+    for index, operation in enumerate(operations):
+        try:
+            element, function, value = __batchOperation(operation)
+            group = operation.get('group', 0)
+            if not __isNumber(group):
+                raise ValueError("group has to be a number")
+        except ValueError as e:
+            results[index] = {'success': False, 'error': str(e)}
+            continue
+        groups.setdefault(group, []).append((index, element, function, value))
+    end = time.monotonic() + timeout  # for all groups together
+    for group in sorted(groups):
+        if time.monotonic() >= end:
+            for index, _, _, _ in groups[group]:
+                results[index] = {'success': False, 'error': "Deadline exceeded"}
+            continue
+        __runBatchGroup(groups[group], results, end - time.monotonic())
+
+    returndata = {}
+    returndata["data"] = results
+    returndata["success"] = all(result["success"] for result in results)
+    response.content_type = 'application/json'
     return json.dumps(returndata)
 
 
@@ -355,24 +681,41 @@ def waitForChanges():
 def updateData():
     raumfeld.updateData()
 
-def __updateAvailableCallback():
-    global updateAvailableEvent
-    updateAvailableEvent.set()
-
-def __resetUpdateAvailableEventThread():
-    global updateAvailableEvent
-    while True:
-        updateAvailableEvent.wait()
-        updateAvailableEvent.clear()
-
-raumfeld.setLogging(logging.INFO)
-raumfeld.registerChangeCallback(__updateAvailableCallback)
-raumfeld.init()
-print(("Host URL: " +raumfeld.hostBaseURL))
-
-# Start observing the device list
-resetUpdateAvailableEventThread = threading.Thread(target=__resetUpdateAvailableEventThread)
-resetUpdateAvailableEventThread.daemon = True
-resetUpdateAvailableEventThread.start()
-
-run(host='0.0.0.0', port=8080, debug=True)
+class ConcurrentServer(ServerAdapter):
+    """Serves many clients at once: idle and waiting connections need no thread"""
+
+    def run(self, handler):
+        WSGIServer(handler, self.host, self.port, **self.options).serve_forever()
+
+parser = argparse.ArgumentParser(description='Web-based API to the Raumfeld system')
+parser.add_argument('--host', default='0.0.0.0', help='address to listen on')
+parser.add_argument('--port', type=int, default=8080)
+parser.add_argument('--server', default='concurrent',
+                    help="'concurrent' (default), 'wsgiref' (single-threaded) or any other server bottle supports")
+parser.add_argument('--workers', type=int, default=32,
+                    help='threads handling requests (concurrent server)')
+parser.add_argument('--keep-alive', type=float, default=30.0,
+                    help='seconds idle connections are kept open, 0 disables keep-alive (concurrent server)')
+parser.add_argument('--gzip', action='store_true',
+                    help='compress the zone and room listings for clients accepting gzip')
+parser.add_argument('--debug', action='store_true', help="bottle's debug mode")
+# The defaults if the module is imported, e.g. by the tests, which call the routes directly
+args = parser.parse_args([])
+
+def __printHostURL(ready):
+    if not ready.cancelled() and ready.exception() is None:
+        print(("Host URL: " +raumfeld.hostBaseURL))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    raumfeld.setLogging(logging.INFO)
+
+    # Serve the topology of the last run until the host answered
+    raumfeld.init(snapshotFile='raumfeld_snapshot.json').add_done_callback(__printHostURL)
+
+    if args.server == 'concurrent':
+        run(server=ConcurrentServer, host=args.host, port=args.port, debug=args.debug,
+            workers=args.workers, keep_alive=args.keep_alive,
+            async_routes={'/waitForChanges': __waitForChangesAsync, '/events': __eventsAsync})
+    else:
+        run(server=args.server, host=args.host, port=args.port, debug=args.debug)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of the cached zone and room listings of RaumfeldControl
+
+Loads RaumfeldControl.py with the Raumfeld host replaced by a fake host on localhost, then
+calls its WSGI application directly, so only the request handling is measured. The listing
+serialized on every request, as before the cache, is served at /uncached/zones for comparison.
+
+The fake host listens on the port of the real host (47365), which must be free.
+Usage: python benchmarks/cached_listings.py [--zones 100] [--requests 20000]
+"""
+
+import argparse
+import io
+import json
+import os
+import runpy
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import bottle  # noqa: E402
+import raumfeld  # noqa: E402
+from fakehost import FakeHost, topologyXml  # noqa: E402
+
+
+def uncachedZones():
+    """/zones as it was implemented before the cache"""
+    returndata = {}
+    returndata["data"] = []
+    returndata["success"] = False
+    for zone in raumfeld.getZones():
+        z = {}
+        z['name'] = zone.Name
+        z['udn'] = zone.UDN
+        returndata["data"].append(z)
+        returndata["success"] = True
+    return json.dumps(returndata)
+
+
+def call(app, path, headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080', 'SERVER_PROTOCOL': 'HTTP/1.1',
+               'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http'}
+    environ.update(('HTTP_' + name.upper().replace('-', '_'), value)
+                   for name, value in headers.items())
+    status = []
+    body = b''.join(app(environ, lambda status_line, headers, exc_info=None: status.append(
+        (status_line, {name.lower(): value for name, value in headers}))))
+    return status[0][0], status[0][1], body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--zones', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    host = FakeHost(*topologyXml(zones=args.zones, rooms_per_zone=4, unassigned=20),
+                    address=('127.0.0.1', 47365))
+    host.start()
+    system = raumfeld.getDefaultSystem()
+    raumfeld.init = lambda hostIPAddress='', snapshotFile=None: system.init('127.0.0.1')
+    bottle.run = lambda *args, **kwargs: None
+    sys.argv = ['RaumfeldControl.py', '--gzip']
+    os.chdir(tempfile.mkdtemp())
+    runpy.run_path(os.path.join(ROOT, 'RaumfeldControl.py'), run_name='__main__')
+    system.init().result(10)
+    app = bottle.default_app()
+    app.route('/uncached/zones', callback=uncachedZones)
+
+    _, headers, _ = call(app, '/zones', {})
+    _, gzip_headers, _ = call(app, '/zones', {'Accept-Encoding': 'gzip'})
+    cases = [('/uncached/zones', {}, 'serialized per request'),
+             ('/zones', {}, 'cached'),
+             ('/zones', {'If-None-Match': headers['etag']}, 'cached, If-None-Match'),
+             ('/zones', {'Accept-Encoding': 'gzip'}, 'cached, gzip'),
+             ('/zones', {'Accept-Encoding': 'gzip', 'If-None-Match': gzip_headers['etag']},
+              'cached, gzip, If-None-Match'),
+             ('/zone/uuid:zone-0/rooms', {}, 'cached')]
+    print('{0} zones, {1} rooms'.format(args.zones, args.zones * 4 + 20))
+    for path, request_headers, label in cases:
+        status, _, body = call(app, path, request_headers)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            call(app, path, request_headers)
+        elapsed = time.perf_counter() - start
+        print('{0:<24} {1:<28} {2:>8.0f} requests/s {3:>6.1f} us/request  {4} {5} bytes'.format(
+            path, label, args.requests / elapsed, elapsed / args.requests * 1e6,
+            status.split()[0], len(body)))
+    system.close()
+    host.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Raumfeld topologies for the benchmarks and a fake host serving them"""
+
+import http.server
+import threading
+from xml.sax.saxutils import quoteattr
+
+MEDIA_RENDERER = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+MEDIA_SERVER = 'urn:schemas-upnp-org:device:MediaServer:1'
+
+
+def topologyXml(zones=100, rooms_per_zone=4, unassigned=100, renderers_per_room=1,
+                location='http://127.0.0.1:9'):
+    """Returns the listDevices and getZones responses of a synthetic system as bytes
+
+    Every zone, room and renderer has a UDN of the form uuid:zone-<n>, uuid:room-<n> and
+    uuid:renderer-<n>-<m>; all rooms are numbered across zones and unassigned rooms.
+    """
+    devices = ['<?xml version="1.0" encoding="utf-8"?><devices>',
+               '<device location="{0}/ms.xml" type="{1}" udn="uuid:media-server">'
+               'Raumfeld MediaServer</device>'.format(location, MEDIA_SERVER)]
+    zone_elements = []
+    room_elements = []
+    for room in range(zones * rooms_per_zone + unassigned):
+        renderers = []
+        for renderer in range(renderers_per_room):
+            udn = 'uuid:renderer-{0}-{1}'.format(room, renderer)
+            devices.append('<device location={0} type="{1}" udn={2}>Speaker {3}</device>'.format(
+                quoteattr('{0}/{1}.xml'.format(location, udn[5:])), MEDIA_RENDERER,
+                quoteattr(udn), room))
+            renderers.append('<renderer name="Speaker {0}" udn={1}/>'.format(room, quoteattr(udn)))
+        room_elements.append('<room name="Room {0}" udn="uuid:room-{0}" powerState="ACTIVE">'
+                             '{1}</room>'.format(room, ''.join(renderers)))
+    for zone in range(zones):
+        udn = 'uuid:zone-{0}'.format(zone)
+        devices.append('<device location={0} type="{1}" udn={2}>Zone {3}</device>'.format(
+            quoteattr('{0}/{1}.xml'.format(location, udn[5:])), MEDIA_RENDERER, quoteattr(udn),
+            zone))
+        zone_elements.append('<zone udn={0}>{1}</zone>'.format(quoteattr(udn), ''.join(
+            room_elements[zone * rooms_per_zone:(zone + 1) * rooms_per_zone])))
+    devices.append('</devices>')
+    zone_config = ['<?xml version="1.0" encoding="utf-8"?><zoneConfig><zones>']
+    zone_config.extend(zone_elements)
+    zone_config.append('</zones><unassignedRooms>')
+    zone_config.extend(room_elements[zones * rooms_per_zone:])
+    zone_config.append('</unassignedRooms></zoneConfig>')
+    return ''.join(devices).encode('utf-8'), ''.join(zone_config).encode('utf-8')
+
+
+class FakeHost(http.server.ThreadingHTTPServer):
+    """Web services of a Raumfeld host: listDevices and getZones with long-polling
+
+    A request with the current updateID waits until update() is called or the host is closed
+    """
+    daemon_threads = True
+
+    def __init__(self, devices_xml, zones_xml, address=('127.0.0.1', 0)):
+        http.server.ThreadingHTTPServer.__init__(self, address, _FakeHostHandler)
+        self.devices_xml = devices_xml
+        self.zones_xml = zones_xml
+        self.update_id = 1
+        self.condition = threading.Condition()
+        self.closed = False
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def update(self, devices_xml=None, zones_xml=None):
+        with self.condition:
+            self.devices_xml = devices_xml or self.devices_xml
+            self.zones_xml = zones_xml or self.zones_xml
+            self.update_id += 1
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.shutdown()
+        self.server_close()
+
+
+class _FakeHostHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        service = self.path.rpartition('/')[2]
+        if service not in ('listDevices', 'getZones'):
+            self.send_error(404)
+            return
+        host = self.server
+        with host.condition:
+            if self.headers.get('updateID') == str(host.update_id):
+                host.condition.wait_for(lambda: host.closed or
+                                        self.headers.get('updateID') != str(host.update_id))
+            body = host.devices_xml if service == 'listDevices' else host.zones_xml
+            update_id = host.update_id
+        self.send_response(200)
+        self.send_header('updateID', str(update_id))
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Load benchmark of the HTTP servers of RaumfeldControl
+
+Runs the concurrent WSGIServer and bottle's default single-threaded wsgiref server in a child
+process and measures, from asyncio clients in this process:
+
+* pollers: requests/sec of many clients polling /zones over keep-alive connections
+* long-polls: the latency of a command request while many long-polls wait on /waitForChanges
+
+The application serves a fixed JSON body, so only the server is measured, no Raumfeld system
+is needed. Usage: python benchmarks/keepalive_pollers.py [--pollers 200] [--duration 5]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+import wsgiref.simple_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from raumfeld.wsgiserver import WSGIServer  # noqa: E402
+
+ZONES = json.dumps([{'Wohnzimmer {0}'.format(i): 'uuid:zone-{0}'.format(i)}
+                    for i in range(20)]).encode('utf-8')
+LONG_POLL = 2.0  # seconds a /waitForChanges request waits
+
+
+def application(environ, start_response):
+    if environ['PATH_INFO'] == '/waitForChanges':
+        time.sleep(LONG_POLL)
+        body = b'{"changes": []}'
+    else:
+        body = ZONES
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+async def waitForChanges(environ, response):
+    await asyncio.sleep(LONG_POLL)
+    await response.send('200 OK', [('Content-Type', 'application/json')], b'{"changes": []}')
+
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(kind, ports):
+    if kind == 'concurrent':
+        server = WSGIServer(application, host='127.0.0.1', port=0, workers=32, keep_alive=30.0,
+                            async_routes={'/waitForChanges': waitForChanges})
+        server.start()
+        ports.put(server.port)
+        time.sleep(3600)
+    else:
+        server = wsgiref.simple_server.make_server('127.0.0.1', 0, application,
+                                                   handler_class=QuietHandler)
+        ports.put(server.server_port)
+        server.serve_forever()
+
+
+async def request(reader, writer, path):
+    """Send a GET; returns whether the connection can be used for the next request"""
+    writer.write('GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode('latin-1'))
+    await writer.drain()
+    await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' not in headers:
+        await reader.read()
+        return False
+    await reader.readexactly(int(headers['content-length']))
+    return headers.get('connection') != 'close'
+
+
+async def poller(port, path, end, counts):
+    writer = None
+    while time.monotonic() < end:
+        left = max(end - time.monotonic(), 0.01)
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection('127.0.0.1', port), left)
+            keep_alive = await asyncio.wait_for(request(reader, writer, path), left)
+        except (asyncio.TimeoutError, OSError):
+            if time.monotonic() < end:
+                counts['errors'] += 1
+            keep_alive = False
+        else:
+            counts['requests'] += 1
+        if not keep_alive and writer is not None:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def pollers(port, number, duration):
+    counts = {'requests': 0, 'errors': 0}
+    start = time.monotonic()
+    await asyncio.gather(*(poller(port, '/zones', start + duration, counts)
+                           for _ in range(number)))
+    return counts['requests'] / (time.monotonic() - start), counts['errors']
+
+
+async def commandLatency(port, number, duration):
+    """Median and maximum seconds of /zones requests while number long-polls wait"""
+    end = time.monotonic() + duration
+    waiting = [asyncio.ensure_future(poller(port, '/waitForChanges', end,
+                                            {'requests': 0, 'errors': 0}))
+               for _ in range(number)]
+    await asyncio.sleep(0.5)
+    latencies = []
+    while time.monotonic() < end - 0.5:
+        start = time.monotonic()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection('127.0.0.1', port), end - start)
+            await asyncio.wait_for(request(reader, writer, '/zones'), end - start)
+        except (asyncio.TimeoutError, OSError):
+            break
+        writer.close()
+        latencies.append(time.monotonic() - start)
+        await asyncio.sleep(0.05)
+    for task in waiting:
+        task.cancel()
+    await asyncio.gather(*waiting, return_exceptions=True)
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pollers', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    for kind in ('concurrent', 'wsgiref'):
+        for scenario in ('pollers', 'long-polls'):
+            ports = multiprocessing.Queue()
+            process = multiprocessing.Process(target=serve, args=(kind, ports), daemon=True)
+            process.start()
+            port = ports.get()
+            try:
+                if scenario == 'pollers':
+                    rate, errors = asyncio.run(pollers(port, args.pollers, args.duration))
+                    print('{0:<10} {1} keep-alive pollers: {2:.0f} requests/s, {3} errors'.format(
+                        kind, args.pollers, rate, errors))
+                else:
+                    latencies = asyncio.run(commandLatency(port, args.pollers, args.duration))
+                    if latencies:
+                        result = '{0} answered, median {1:.1f} ms, max {2:.1f} ms'.format(
+                            len(latencies), 1000 * latencies[len(latencies) // 2],
+                            1000 * latencies[-1])
+                    else:
+                        result = 'no answer within {0:.0f} s'.format(args.duration)
+                    print('{0:<10} commands during {1} long-polls: {2}'.format(
+                        kind, args.pollers, result))
+            finally:
+                process.terminate()
+                process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of parsing large listDevices and getZones responses
+
+Compares the iterparse parsers of raumfeld.topology with reading the whole response into a
+minidom DOM, as the library did before. Reports the time, the peak memory during the parse and
+the memory kept afterwards: the records, or the DOM which was kept until the next poll.
+
+Usage: python benchmarks/parse_topology.py [--rooms 500 2000 5000] [--repeat 5]
+"""
+
+import argparse
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fakehost import topologyXml  # noqa: E402
+from raumfeld.topology import parseDevices, parseZones  # noqa: E402
+
+
+def minidomDevices(response):
+    return minidom.parseString(response.read()).getElementsByTagName('device')
+
+
+def minidomZones(response):
+    return minidom.parseString(response.read()).getElementsByTagName('zone')
+
+
+def measure(parse, data, repeat):
+    """Returns the fastest time, the peak and the kept memory of parse(response) for data"""
+    times = []
+    for _ in range(repeat):
+        response = io.BytesIO(data)
+        start = time.perf_counter()
+        parse(response)
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    result = parse(io.BytesIO(data))
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(times), peak, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{0:<12} {1:>6} {2:>9} {3:<10} {4:>9} {5:>10} {6:>10}'.format(
+        'response', 'rooms', 'KiB', 'parser', 'ms', 'peak KiB', 'kept KiB'))
+    for rooms in args.rooms:
+        devices_xml, zones_xml = topologyXml(zones=rooms // 5, rooms_per_zone=4,
+                                             unassigned=rooms - rooms // 5 * 4)
+        for name, data, parsers in (
+                ('listDevices', devices_xml, (('iterparse', parseDevices),
+                                              ('minidom', minidomDevices))),
+                ('getZones', zones_xml, (('iterparse', parseZones), ('minidom', minidomZones)))):
+            for label, parse in parsers:
+                elapsed, peak, kept = measure(parse, data, args.repeat)
+                print('{0:<12} {1:>6} {2:>9.0f} {3:<10} {4:>9.2f} {5:>10.0f} {6:>10.0f}'.format(
+                    name, rooms, len(data) / 1024, label, elapsed * 1e3, peak / 1024,
+                    kept / 1024))
+
+
+if __name__ == '__main__':
+    main()
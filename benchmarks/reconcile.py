@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the topology reconciliation and the UDN lookups with a synthetic 500-room system
+
+Reconciles the parsed getZones and listDevices records of the synthetic system to a published
+TopologySnapshot, once from scratch and then for a room moving between two zones. For
+comparison the devices are also resolved by scanning the device list, as the reconciliation
+did before the UDN indexes, and the rooms are looked up by scanning the zones.
+
+Usage: python benchmarks/reconcile.py [--rooms 500] [--repeat 20]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import raumfeld  # noqa: E402
+from fakehost import topologyXml  # noqa: E402
+from raumfeld.topology import (ZoneRecord, buildTopologyState, parseDevices,  # noqa: E402
+                               parseZones)
+
+ROOMS_PER_ZONE = 4
+
+
+class LinearDeviceList(object):
+    """The get() of a dict UDN -> DeviceRecord by scanning the device list"""
+
+    def __init__(self, devices):
+        self._devices = devices
+
+    def get(self, udn):
+        for device in self._devices:
+            if device.udn == udn:
+                return device
+        return None
+
+
+def best(function, repeat):
+    """Returns the fastest of repeat calls of function in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def moveRoom(zones):
+    """Returns the zone records with the last room of the first zone moved to the second zone"""
+    first, second = zones[0], zones[1]
+    return (ZoneRecord(first.udn, first.rooms[:-1]),
+            ZoneRecord(second.udn, second.rooms + first.rooms[-1:])) + zones[2:]
+
+
+def linearRoomByUDN(system, udn):
+    for zone in system.getZones():
+        for room in zone.getRooms():
+            if room.UDN == udn:
+                return room
+    for room in system.getUnassignedRooms():
+        if room.UDN == udn:
+            return room
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    zone_count = args.rooms // ROOMS_PER_ZONE * 9 // 10
+    devices_xml, zones_xml = topologyXml(zones=zone_count, rooms_per_zone=ROOMS_PER_ZONE,
+                                         unassigned=args.rooms - zone_count * ROOMS_PER_ZONE)
+    devices = parseDevices(io.BytesIO(devices_xml))
+    zones, unassigned = parseZones(io.BytesIO(zones_xml))
+    devices_by_udn = {device.udn: device for device in devices}
+    moved = moveRoom(zones)
+    print('{0} zones, {1} rooms, {2} devices'.format(len(zones), args.rooms, len(devices)))
+
+    build = best(lambda: buildTopologyState(zones, unassigned, devices_by_udn), args.repeat)
+    build_linear = best(lambda: buildTopologyState(zones, unassigned, LinearDeviceList(devices)),
+                        max(args.repeat // 10, 1))
+    print('resolve the devices:  {0:8.2f} ms indexed, {1:8.2f} ms scanning the device list'.format(
+        build * 1e3, build_linear * 1e3))
+
+    def reconcileFromScratch():
+        system = raumfeld.RaumfeldSystem('127.0.0.1')
+        system._publishTopologyState(buildTopologyState(zones, unassigned, devices_by_udn))
+        system.close()
+    print('reconcile from scratch: {0:6.2f} ms'.format(
+        best(reconcileFromScratch, args.repeat) * 1e3))
+
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    states = [buildTopologyState(zones, unassigned, devices_by_udn),
+              buildTopologyState(moved, unassigned, devices_by_udn)]
+    system._publishTopologyState(states[0])
+
+    def reconcileMovedRoom():
+        # Moves the room back and forth
+        states.reverse()
+        system._publishTopologyState(states[0])
+    print('reconcile a moved room: {0:6.2f} ms'.format(
+        best(reconcileMovedRoom, args.repeat) * 1e3))
+
+    udns = list(system.getTopology().rooms_by_udn)
+    indexed = best(lambda: [system.getRoomByUDN(udn) for udn in udns], args.repeat)
+    linear = best(lambda: [linearRoomByUDN(system, udn) for udn in udns],
+                  max(args.repeat // 10, 1))
+    print('getRoomByUDN:         {0:8.2f} us indexed, {1:8.2f} us scanning the zones'.format(
+        indexed / len(udns) * 1e6, linear / len(udns) * 1e6))
+    system.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,60 +11,164 @@ https://github.com/tfeldmann/python-raumfeld
 Further information see README.md
 """
 
+import functools
+import json
 import logging
+import os
 import socket
 import threading
 import time
 import urllib.request, urllib.error, urllib.parse
-import xml.dom.minidom
-from http.client import BadStatusLine
+from collections import namedtuple
+from itertools import count
+from types import MappingProxyType
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from http.client import HTTPException
 from urllib.error import URLError
 from uuid import uuid4
+from xml.etree import ElementTree
 
 from pysimplesoap.client import SoapClient
 
+from .changefeed import ChangeFeed
+from .connectionpool import ConnectionPool, SoapTransport
+from .contentcache import ContentDirectoryCache
+from .deadline import (CancelledError, Cancellation, deadline, getDefaultTimeout, remaining,
+                       runInContext, setDefaultTimeout, withTimeout)
+from .description import DescriptionCache, DeviceDescription, ServiceDescription
+from .didl import didlObjectFromElement, parseDidl, parseDidlObject
+from .dispatch import COALESCE, DROP_OLDEST, Dispatcher
+from .gena import EventManager
+from .health import CONNECTED, DEGRADED, DISCONNECTED, HostHealth, ReconnectPolicy
+from .nameindex import NameIndex, normalizeName
+from .ssdp import (ALL_TARGETS, CONFIG_DEVICE, MEDIA_RENDERER, MEDIA_SERVER, SsdpResponse,
+                   discover, discoverAsync, discoverHost, discoverHostAsync, discoverHosts)
+from .topology import (EMPTY_SNAPSHOT, DeviceList, ZoneList, applyTopologyDiff,
+                       buildTopologyState, diffTopology, parseDevices, parseZones,
+                       topologyStateFromDict, topologyStateToDict)
+
 __version__ = '0.5'
 
-__zones = []
-__zonesLock = threading.Lock()
-__unassignedRooms = []
-__unassignedRoomsLock = threading.Lock()
+# Worker pools shared by all RaumfeldSystems
+__bulkExecutor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='raumfeld-bulk')
+# Separate pool for the requests issued on behalf of a single call (status(), page prefetch),
+# so calls made from bulk operations can not starve each other
+__requestExecutor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='raumfeld-request')
+# Change notifications are queued per listener and delivered on their own executor, so slow
+# listeners can not hold up the update threads
+__dispatchExecutor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='raumfeld-dispatch')
+
+
+# Evented AVTransport state variables corresponding to the results of GetMediaInfo and
+# GetTransportInfo; the position is not evented
+_MEDIA_INFO_VARIABLES = {'NrTracks': 'NumberOfTracks',
+                         'MediaDuration': 'CurrentMediaDuration',
+                         'CurrentURI': 'AVTransportURI',
+                         'CurrentURIMetaData': 'AVTransportURIMetaData',
+                         'NextUri': 'NextAVTransportURI',
+                         'NextUriMetaData': 'NextAVTransportURIMetaData',
+                         'PlayMedium': 'PlaybackStorageMedium',
+                         'RecordMedium': 'RecordStorageMedium',
+                         'WriteStatus': 'RecordMediumWriteStatus'}
+_TRANSPORT_INFO_VARIABLES = {'CurrentTransportState': 'TransportState',
+                             'CurrentTransportStatus': 'TransportStatus',
+                             'CurrentSpeed': 'TransportPlaySpeed'}
+
+
+@functools.lru_cache(maxsize=1)
+def _getSoapClientTemplate():
+    """Returns the SoapClient whose settings all SoapClients are created with
+
+    SoapClient.__init__ creates an HTTP transport with its own SSL context (tens of milliseconds),
+    which is replaced by the connection pool anyway; copying the template skips it
+    """
+    return SoapClient(namespace='http://schemas.xmlsoap.org/soap/envelope/',
+                      soap_ns='soap', ns='s', exceptions=False)
 
-__zoneElements = []  # XML <zone> elements from getZones
-__zoneElementsLock = threading.Lock()
-__unassignedElements = []  # XML <room> elements from getZones
-__unassignedElementsLock = threading.Lock()
-__deviceElements = []  # XML <device> elements from listDevices
-__deviceElementsLock = threading.Lock()
 
-__mediaServer = None
+def _submitRequest(function, *args):
+    """Run a request issued on behalf of another call (status(), page prefetch) in the background
 
-__newZoneDataEvent = threading.Event()
-__newDeviceDataEvent = threading.Event()
-__dataProcessedEvent = threading.Event()
+    The request runs with the deadline of the calling thread
+    """
+    return __requestExecutor.submit(runInContext(function), *args)
 
-__sessionUUID = uuid4().hex
-# __mediaServerUDN = ""
-__callback = None
 
-hostBaseURL = "http://hostip:47365"
-socket.setdefaulttimeout(None)
+def _submitBulk(function, *args):
+    """Run an operation of a bulk call on the shared bulk executor"""
+    return __bulkExecutor.submit(runInContext(function), *args)
+
+
+def _getDispatchExecutor():
+    """Returns the executor which delivers the notifications of all systems"""
+    return __dispatchExecutor
+
+
+def _parseDidlObjects(result):
+    """Returns the DidlContainers and DidlItems of one page of a DIDL-Lite Result
+
+    Pages are not memoized like parseDidl results, they are seldom requested twice
+    """
+    if not result:
+        return []
+    objects = (didlObjectFromElement(element) for element in ElementTree.fromstring(result))
+    return [didl_object for didl_object in objects if didl_object is not None]
+
+
+def _nextPageIndex(index, number_returned, total_matches, page_size):
+    """Returns the StartingIndex of the next page or None if the last page was received"""
+    if number_returned <= 0:
+        return None
+    index += number_returned
+    if total_matches:
+        return index if index < total_matches else None
+    # A TotalMatches of 0 means the server does not know the total
+    return index if number_returned >= page_size else None
+
+
+class RendererStatus(namedtuple('RendererStatus', ['transport_info', 'position_info',
+                                                   'media_info', 'volume', 'mute', 'timestamp'])):
+    """Status of a Renderer or Zone fetched at once by status()
+
+    transport_info, position_info and media_info are read-only dicts like the properties of the
+    same name, timestamp is the time.time() when all values were received
+    """
+    __slots__ = ()
+
+    @property
+    def track(self):
+        """DIDL object of the TrackMetaData or None"""
+        return parseDidlObject(str(self.position_info.get('TrackMetaData', '')))
+
+    @property
+    def media(self):
+        """DIDL object of the CurrentURIMetaData or None"""
+        return parseDidlObject(str(self.media_info.get('CurrentURIMetaData', '')))
 
 
 class MediaServer(object):
     """Raumfeld MediaServer"""
 
-    def __init__(self, udn, location):
+    # service -> (SOAP action namespace, control path, event path); the paths are only used if
+    # the device description does not provide the URLs
+    _services = {'ContentDirectory': ('urn:schemas-upnp-org:service:ContentDirectory:1#',
+                                      '/cd/Control', None)}
+
+    def __init__(self, udn, location, system=None):
+        self._system = system if system is not None else getDefaultSystem()
         self._udn = udn
         self._location = location
-        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
-        self._address = '{0}://{1}'.format(scheme, netloc)
-        # ToDo: get correct ControlLocation from the XML file
-        self._contentDirectory = SoapClient(
-            location='{0}/cd/Control'.format(self._address),
-            action='urn:schemas-upnp-org:service:ContentDirectory:1#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
+        self._soapClients = None
+
+    @property
+    def _contentDirectory(self):
+        soap_clients = self._soapClients
+        if soap_clients is None:
+            soap_clients, described = self._system._createServiceClients(self._location,
+                                                                         self._services)
+            if described:
+                self._soapClients = soap_clients
+        return soap_clients['ContentDirectory']
 
     @property
     def UDN(self):
@@ -76,35 +180,100 @@ class MediaServer(object):
         """Get the location URI"""
         return self._location
 
-    # Browse and Search
-    def browse(self, object_id, browse_flag="BrowseMetadata", filter="*", request_count="25"):
-        """Browse Media Server"""
-        return self._contentDirectory.Browse(ObjectID=object_id, BrowseFlag=browse_flag,
-                                             Filter=filter, StartingIndex="0",
-                                             RequestedCount=request_count, SortCriteria="").Result
+    @property
+    def system_update_id(self):
+        """Get the SystemUpdateID, which changes with every change of the content"""
+        return str(self._contentDirectory.GetSystemUpdateID().Id)
 
-    def browse_children(self, object_id, filter="*", request_count="25"):
+    # Browse and Search
+    @withTimeout
+    def browse(self, object_id, browse_flag="BrowseMetadata", filter="*", request_count="25",
+               starting_index="0"):
+        """Browse Media Server; the Result is served from the ContentDirectoryCache if possible"""
+        return self.__cachedBrowse(object_id, browse_flag, filter, starting_index,
+                                   request_count)[0]
+
+    @withTimeout
+    def browse_children(self, object_id, filter="*", request_count="25", starting_index="0"):
         """Convenience function for browsing child elements; returns Result and NumberReturned"""
-        children = self._contentDirectory.Browse(ObjectID=object_id,
-                                                 BrowseFlag="BrowseDirectChildren",
-                                                 Filter=filter, StartingIndex="0",
-                                                 RequestedCount=request_count, SortCriteria="")
-        result = children.Result
-        count_returned = children.NumberReturned
-        return result, count_returned
-
-    def search(self, container_id, search_criteria, filter="*", request_count="25"):
+        return self.__cachedBrowse(object_id, "BrowseDirectChildren", filter, starting_index,
+                                   request_count)
+
+    def __cachedBrowse(self, object_id, browse_flag, filter, starting_index, request_count):
+        """Returns the tuple (Result, NumberReturned) of a Browse request"""
+        cache = self._system._contentDirectoryCache
+        if cache.systemUpdateCheckDue():
+            cache.systemUpdated(self.system_update_id)
+        key = (object_id, self._udn, browse_flag, filter, str(starting_index), str(request_count))
+        value = cache.get(key)
+        if value is None:
+            response = self._contentDirectory.Browse(ObjectID=object_id, BrowseFlag=browse_flag,
+                                                     Filter=filter, StartingIndex=starting_index,
+                                                     RequestedCount=request_count,
+                                                     SortCriteria="")
+            value = (str(response.Result), str(response.NumberReturned))
+            cache.put(key, value, str(response.UpdateID))
+        return value
+
+    @withTimeout
+    def search(self, container_id, search_criteria, filter="*", request_count="25",
+               starting_index="0"):
         """Search Media Server"""
         return self._contentDirectory.Search(ContainerID=container_id,
                                              SearchCriteria=search_criteria,
-                                             Filter=filter, StartingIndex="0",
+                                             Filter=filter, StartingIndex=starting_index,
                                              RequestedCount=request_count, SortCriteria="").Result
 
+    def iter_children(self, object_id, page_size=100, filter="*", sort_criteria=""):
+        """Generator over the DidlContainers and DidlItems of a container, fetched page by page
+
+        The next page is requested while the current one is consumed, so at most two pages
+        are held in memory
+        """
+        def fetchPage(starting_index):
+            return self._contentDirectory.Browse(
+                ObjectID=object_id, BrowseFlag="BrowseDirectChildren", Filter=filter,
+                StartingIndex=str(starting_index), RequestedCount=str(page_size),
+                SortCriteria=sort_criteria)
+        return self.__iterPages(fetchPage, page_size)
+
+    def iter_search(self, container_id, search_criteria, page_size=100, filter="*",
+                    sort_criteria=""):
+        """Generator over the DIDL objects matching the search criteria, fetched page by page"""
+        def fetchPage(starting_index):
+            return self._contentDirectory.Search(
+                ContainerID=container_id, SearchCriteria=search_criteria, Filter=filter,
+                StartingIndex=str(starting_index), RequestedCount=str(page_size),
+                SortCriteria=sort_criteria)
+        return self.__iterPages(fetchPage, page_size)
+
+    def __iterPages(self, fetchPage, page_size):
+        """Yield the DIDL objects of all pages while the following page is prefetched"""
+        index = 0
+        future = _submitRequest(fetchPage, index)
+        try:
+            while future is not None:
+                response = future.result()
+                future = None
+                next_index = _nextPageIndex(index, int(response.NumberReturned),
+                                            int(response.TotalMatches), page_size)
+                if next_index is not None:
+                    future = _submitRequest(fetchPage, next_index)
+                index = next_index
+                objects = _parseDidlObjects(str(response.Result))
+                del response
+                yield from objects
+        finally:
+            if future is not None:
+                future.cancel()
+
     # Queue Operations
+    @withTimeout
     def create_queue(self, desired_name, container_id):
         """CreateQueue Returns GivenName and QueueID"""
         self._contentDirectory.CreateQueue(DesiredName=desired_name, ContainerID=container_id)
 
+    @withTimeout
     def add_container(self, queue_id, container_id, source_id="", criteria="", start_index="0",
                       end_index="0", position="0"):
         """AddContainerToQueue"""
@@ -113,15 +282,18 @@ class MediaServer(object):
                                                    StartIndex=start_index, EndIndex=end_index,
                                                    Position=position)
 
+    @withTimeout
     def add_item(self, queue_id, object_id, position):
         """AddItemToQueue"""
         self._contentDirectory.AddItemToQueue(QueueID=queue_id, ObjectID=object_id,
                                               Position=position)
 
+    @withTimeout
     def move_in_queue(self, object_id, new_position):
         """MoveInQueue"""
         self._contentDirectory.MoveInQueue(ObjectID=object_id, NewPosition=new_position)
 
+    @withTimeout
     def remove_from_queue(self, queue_id, from_position, to_position):
         """RemoveFromQueue"""
         self._contentDirectory.RemoveFromQueue(QueueID=queue_id, FromPosition=from_position,
@@ -131,41 +303,56 @@ class MediaServer(object):
 class Renderer(object):
     """Raumfeld Renderer"""
 
-    def __init__(self, name, udn, location):
-        self._name = name
-        self._udn = udn
-        self._location = location
-        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
-        self._address = '{0}://{1}'.format(scheme, netloc)
-        # ToDo: get correct ControlLocation from the XML file
-        self._renderingControl = SoapClient(
-            location='{0}/RenderingControl/ctrl'.format(self._address),
-            action='urn:upnp-org:serviceId:RenderingControl#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
-        self._avTransport = SoapClient(
-            location='{0}/AVTransport/ctrl'.format(self._address),
-            action='urn:schemas-upnp-org:service:AVTransport:1#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
+    # service -> (SOAP action namespace, control path, event path); the paths are only used if
+    # the device description does not provide the URLs
+    _services = {'RenderingControl': ('urn:upnp-org:serviceId:RenderingControl#',
+                                      '/RenderingControl/ctrl', '/RenderingControl/evt'),
+                 'AVTransport': ('urn:schemas-upnp-org:service:AVTransport:1#',
+                                 '/AVTransport/ctrl', '/AVTransport/evt')}
+
+    def __init__(self, name, udn, location, system=None):
+        self._system = system if system is not None else getDefaultSystem()
+        self._location = None
+        self.reinit(name, udn, location)
 
     def reinit(self, name, udn, location):
         self._name = name
         self._udn = udn
-        self._location = location
-        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
-        self._address = '{0}://{1}'.format(scheme, netloc)
-        # ToDo: get correct ControlLocation from the XML file
-        self._renderingControl = SoapClient(
-            location='{0}/RenderingControl/ctrl'.format(self._address),
-            action='urn:upnp-org:serviceId:RenderingControl#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
-        self._avTransport = SoapClient(
-            location='{0}/AVTransport/ctrl'.format(self._address),
-            action='urn:schemas-upnp-org:service:AVTransport:1#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
+        if location != self._location:
+            self._location = location
+            scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
+            self._address = '{0}://{1}'.format(scheme, netloc)
+            # The SOAP clients are created from the device description with the next request
+            self._soapClients = None
+
+    def _inherit(self, previous):
+        """Take over the SOAP clients of the object this one replaces in a new TopologySnapshot"""
+        if previous._location == self._location:
+            self._soapClients = previous._soapClients
+
+    def _getSoapClients(self):
+        """Returns the dict service -> SoapClient of the current location"""
+        soap_clients = self._soapClients
+        if soap_clients is None:
+            location = self._location
+            soap_clients, described = self._system._createServiceClients(location, self._services)
+            # Clients of the default paths are not kept: the description is asked for again
+            if described and location == self._location:
+                self._soapClients = soap_clients
+        return soap_clients
+
+    @property
+    def _renderingControl(self):
+        return self._getSoapClients()['RenderingControl']
+
+    @property
+    def _avTransport(self):
+        return self._getSoapClients()['AVTransport']
+
+    def _getEventURLs(self):
+        """Returns the dict service -> event URL"""
+        urls, _ = self._system._getServiceURLs(self._location, self._services)
+        return {service: service_urls[1] for service, service_urls in urls.items()}
 
     @property
     def Name(self):
@@ -187,6 +374,7 @@ class Renderer(object):
         """Get the network address"""
         return self._address
 
+    @withTimeout
     def play(self, uri=None, meta=""):
         """Start playing
         :param uri: (optional) play a specific uri
@@ -198,29 +386,37 @@ class Renderer(object):
         else:
             self._avTransport.Play(InstanceID=1, Speed=2)
 
+    @withTimeout
     def __next__(self):
         """Next"""
         self._avTransport.Next(InstanceID=1)
 
+    @withTimeout
     def previous(self):
         """Previous"""
         self._avTransport.Previous(InstanceID=1)
 
+    @withTimeout
     def pause(self):
         """Pause"""
         self._avTransport.Pause(InstanceID=1)
 
+    @withTimeout
     def seek(self, target, unit='ABS_TIME'):
         """Seek; unit = _ABS_TIME_/REL_TIME/TRACK_NR"""
         return self._avTransport.Seek(InstanceID=1, Unit=unit, Target=target)
 
+    @withTimeout
     def stop(self):
         """Stop"""
         self._avTransport.Stop(InstanceID=1)
 
     @property
     def volume(self):
-        """get/set the current volume"""
+        """get/set the current volume; served from the events if they are subscribed"""
+        info = self._system._getEventInfo(self._udn, 'RenderingControl', {'Volume': 'Volume'})
+        if info is not None:
+            return int(info['Volume'])
         try:
             return int(self._renderingControl.GetVolume(InstanceID=1).CurrentVolume)
         except:
@@ -230,12 +426,16 @@ class Renderer(object):
     def volume(self, value):
         self._renderingControl.SetVolume(InstanceID=1, DesiredVolume=value)
 
+    @withTimeout
     def changeVolume(self, value):
         self._renderingControl.ChangeVolume(InstanceID=1, Amount=value)
 
     @property
     def mute(self):
-        """get/set the current mute state"""
+        """get/set the current mute state; served from the events if they are subscribed"""
+        info = self._system._getEventInfo(self._udn, 'RenderingControl', {'Mute': 'Mute'})
+        if info is not None:
+            return info['Mute'] in ('1', 'true')
         response = self._renderingControl.GetMute(InstanceID=1, Channel=1)
         return int(response.CurrentMute) == 1
 
@@ -243,82 +443,14 @@ class Renderer(object):
     def mute(self, value):
         self._renderingControl.SetMute(InstanceID=1, DesiredMute=1 if value else 0, Channel=1)
 
-
-class Zone(Renderer):
-    """Raumfeld Zone"""
-
-    def __init__(self, name, udn, location):
-        self._rooms = []
-        self._udn = udn
-        self._name = name
-        self._location = location
-        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
-        self._address = '{0}://{1}'.format(scheme, netloc)
-        # ToDo: get correct ControlLocation from the XML file
-        self._renderingControl = SoapClient(
-            location='{0}/RenderingService/Control'.format(self._address),
-            action='urn:upnp-org:serviceId:RenderingControl#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
-        self._avTransport = SoapClient(
-            location='{0}/TransportService/Control'.format(self._address),
-            action='urn:schemas-upnp-org:service:AVTransport:1#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
-
-    def reinit(self, name, udn, location):
-        self._udn = udn
-        self._name = name
-        self._location = location
-        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
-        self._address = '{0}://{1}'.format(scheme, netloc)
-        # ToDo: get correct ControlLocation from the XML file
-        self._renderingControl = SoapClient(
-            location='{0}/RenderingService/Control'.format(self._address),
-            action='urn:upnp-org:serviceId:RenderingControl#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
-        self._avTransport = SoapClient(
-            location='{0}/TransportService/Control'.format(self._address),
-            action='urn:schemas-upnp-org:service:AVTransport:1#',
-            namespace='http://schemas.xmlsoap.org/soap/envelope/',
-            soap_ns='soap', ns='s', exceptions=False)
-
-    def _removeRoomByUDN(self, udn):
-        """Remove the room with the UDN from the list of rooms"""
-        for room_element in self._rooms:
-            if room_element.UDN == udn:
-                self._rooms.remove(room_element)
-
-    def getRoomByUDN(self, udn):
-        """Try to get the room of the zone by its UDN"""
-        for room_element in self._rooms:
-            if room_element.UDN == udn:
-                return room_element
-        return None
-
-    def getRooms(self):
-        """Returns the list of rooms in this zone"""
-        return self._rooms
-
-    def getRoomsByName(self, name):
-        """Searches for rooms with a special name"""
-        rooms = []
-        for room in self._rooms:
-            if room.Name.find(name):
-                rooms.append(room)
-        return rooms
-
-    def bend(self, uri=None, meta=None):
-        """BendAVTransportURI"""
-        self._avTransport.BendAVTransportURI(
-            InstanceID=0, CurrentURI=uri, CurrentURIMetaData=meta)
-
     """Generic function for getting all media info"""
 
     @property
     def media_info(self):
-        """Get the media information"""
+        """Get the media information; served from the events if they are subscribed"""
+        info_dict = self._system._getEventInfo(self._udn, 'AVTransport', _MEDIA_INFO_VARIABLES)
+        if info_dict is not None:
+            return info_dict
         info = self._avTransport.GetMediaInfo(InstanceID=1)
         info_dict = {'NrTracks': info.NrTracks,
                      'MediaDuration': info.MediaDuration,
@@ -336,39 +468,39 @@ class Zone(Renderer):
 
     @property
     def media_info_NrTracks(self):
-        return self.media_info()['NrTracks']
+        return self.media_info['NrTracks']
 
     @property
     def media_info_MediaDuration(self):
-        return self.media_info()['MediaDuration']
+        return self.media_info['MediaDuration']
 
     @property
     def media_info_CurrentURI(self):
-        return self.media_info()['CurrentURI']
+        return self.media_info['CurrentURI']
 
     @property
     def media_info_CurrentURIMetaData(self):
-        return self.media_info()['CurrentURIMetaData']
+        return self.media_info['CurrentURIMetaData']
 
     @property
     def media_info_NextUri(self):
-        return self.media_info()['NextUri']
+        return self.media_info['NextUri']
 
     @property
     def media_info_NextUriMetaData(self):
-        return self.media_info()['NextUriMetaData']
+        return self.media_info['NextUriMetaData']
 
     @property
     def media_info_PlayMedium(self):
-        return self.media_info()['PlayMedium']
+        return self.media_info['PlayMedium']
 
     @property
     def media_info_RecordMedium(self):
-        return self.media_info()['RecordMedium']
+        return self.media_info['RecordMedium']
 
     @property
     def media_info_WriteStatus(self):
-        return self.media_info()['WriteStatus']
+        return self.media_info['WriteStatus']
 
     """Generic function for getting all position info"""
 
@@ -391,41 +523,54 @@ class Zone(Renderer):
 
     @property
     def position_info_Track(self):
-        return self.position_info()['Track']
+        return self.position_info['Track']
 
     @property
     def position_info_TrackDuration(self):
-        return self.position_info()['TrackDuration']
+        return self.position_info['TrackDuration']
 
     @property
     def position_info_TrackMetaData(self):
-        return self.position_info()['TrackMetaData']
+        return self.position_info['TrackMetaData']
 
     @property
     def position_info_TrackURI(self):
-        return self.position_info()['TrackURI']
+        return self.position_info['TrackURI']
 
     @property
     def position_info_RelTime(self):
-        return self.position_info()['RelTime']
+        return self.position_info['RelTime']
 
     @property
     def position_info_AbsTime(self):
-        return self.position_info()['AbsTime']
+        return self.position_info['AbsTime']
 
     @property
     def position_info_RelCount(self):
-        return self.position_info()['RelCount']
+        return self.position_info['RelCount']
 
     @property
     def position_info_AbsCount(self):
-        return self.position_info()['AbsCount']
+        return self.position_info['AbsCount']
+
+    @property
+    def current_media(self):
+        """DIDL object of the CurrentURIMetaData or None"""
+        return parseDidlObject(str(self.media_info_CurrentURIMetaData))
+
+    @property
+    def current_track(self):
+        """DIDL object of the TrackMetaData or None"""
+        return parseDidlObject(str(self.position_info_TrackMetaData))
 
     """Generic function for getting all transport info"""
 
     @property
     def transport_info(self):
-        """Get the transport information"""
+        """Get the transport information; served from the events if they are subscribed"""
+        info_dict = self._system._getEventInfo(self._udn, 'AVTransport', _TRANSPORT_INFO_VARIABLES)
+        if info_dict is not None:
+            return info_dict
         info = self._avTransport.GetTransportInfo(InstanceID=1)
         info_dict = {'CurrentTransportState': info.CurrentTransportState,
                      'CurrentTransportStatus': info.CurrentTransportStatus,
@@ -437,40 +582,87 @@ class Zone(Renderer):
 
     @property
     def transport_info_CurrentTransportState(self):
-        return self.transport_info()['CurrentTransportState']
+        return self.transport_info['CurrentTransportState']
 
     @property
     def transport_info_CurrentTransportStatus(self):
-        return self.transport_info()['CurrentTransportStatus']
+        return self.transport_info['CurrentTransportStatus']
 
     @property
     def transport_info_CurrentSpeed(self):
-        return self.transport_info()['CurrentSpeed']
+        return self.transport_info['CurrentSpeed']
+
+    @withTimeout
+    def status(self):
+        """Fetch transport, position and media info, volume and mute concurrently
+
+        Returns one immutable RendererStatus, so a refresh costs one parallel round of requests
+        """
+        futures = [_submitRequest(getattr, self, name) for name in
+                   ('transport_info', 'position_info', 'media_info', 'volume', 'mute')]
+        transport_info, position_info, media_info, volume, mute = [future.result()
+                                                                   for future in futures]
+        return RendererStatus(MappingProxyType(transport_info), MappingProxyType(position_info),
+                              MappingProxyType(media_info), volume, mute, time.time())
+
+
+class Zone(Renderer):
+    """Raumfeld Zone"""
+
+    _services = {'RenderingControl': ('urn:upnp-org:serviceId:RenderingControl#',
+                                      '/RenderingService/Control', '/RenderingService/Event'),
+                 'AVTransport': ('urn:schemas-upnp-org:service:AVTransport:1#',
+                                 '/TransportService/Control', '/TransportService/Event')}
+
+    def __init__(self, name, udn, location, system=None):
+        self._rooms = ()
+        self._roomsByUDN = {}
+        Renderer.__init__(self, name, udn, location, system)
+
+    def _setRooms(self, rooms):
+        """Set the rooms of a new zone, before it is published in a TopologySnapshot"""
+        self._roomsByUDN = {room.UDN: room for room in rooms}
+        self._rooms = tuple(rooms)
+
+    def getRoomByUDN(self, udn):
+        """Try to get the room of the zone by its UDN"""
+        return self._roomsByUDN.get(udn)
+
+    def getRooms(self):
+        """Returns the tuple of rooms in this zone"""
+        return self._rooms
+
+    def getRoomsByName(self, name):
+        """Searches for rooms with a special name"""
+        return NameIndex(self._rooms).find(name)
+
+    @withTimeout
+    def bend(self, uri=None, meta=None):
+        """BendAVTransportURI"""
+        self._avTransport.BendAVTransportURI(
+            InstanceID=0, CurrentURI=uri, CurrentURIMetaData=meta)
 
 
 class Room(object):
     """Raumfeld Room"""
 
     def __init__(self, name, udn):
-        self._renderers = []
+        self._renderers = ()
+        self._renderersByUDN = {}
         self._udn = udn
         self._name = name
 
-    def _removeRendererByUDN(self, udn):
-        """Remove the renderer with the UDN from the list of renderers"""
-        for renderer_element in self._renderers:
-            if renderer_element.UDN == udn:
-                self._renderers.remove(renderer_element)
+    def _setRenderers(self, renderers):
+        """Set the renderers of a new room, before it is published in a TopologySnapshot"""
+        self._renderersByUDN = {renderer.UDN: renderer for renderer in renderers}
+        self._renderers = tuple(renderers)
 
     def getRenderer(self, udn):
         """Try to get the renderer of the room by its UDN"""
-        for renderer_element in self._renderers:
-            if renderer_element.UDN == udn:
-                return renderer_element
-        return None
+        return self._renderersByUDN.get(udn)
 
     def getRenderers(self):
-        """Returns the list of renderers in this zone"""
+        """Returns the tuple of renderers in this room"""
         return self._renderers
 
     @property
@@ -483,6 +675,7 @@ class Room(object):
         """Get the UDN of the device"""
         return self._udn
 
+    @withTimeout
     def play(self, uri=None, meta=""):
         """Start playing
         :param uri: (optional) play a specific uri
@@ -490,22 +683,27 @@ class Room(object):
         """
         self._renderers[0].play(uri, meta)
 
+    @withTimeout
     def __next__(self):
         """Next"""
         next(self._renderers[0])
 
+    @withTimeout
     def previous(self):
         """Previous"""
         self._renderers[0].previous()
 
+    @withTimeout
     def pause(self):
         """Pause"""
         self._renderers[0].pause()
 
+    @withTimeout
     def seek(self, target, unit='ABS_TIME'):
         """Seek; unit = _ABS_TIME_/REL_TIME/TRACK_NR"""
         return self._renderers[0].seek(target, unit)
 
+    @withTimeout
     def stop(self):
         """Stop"""
         self._renderers[0].stop()
@@ -519,6 +717,7 @@ class Room(object):
     def volume(self, value):
         self._renderers[0].volume = value
 
+    @withTimeout
     def changeVolume(self, value):
         self._renderers[0].changeVolume(value)
 
@@ -531,524 +730,783 @@ class Room(object):
     def mute(self, value):
         self._renderers[0].mute = value
 
+    @withTimeout
+    def status(self):
+        """Returns the RendererStatus of the renderer of the room"""
+        return self._renderers[0].status()
+
+
+class BulkResult(namedtuple('BulkResult', ['target', 'result', 'error'])):
+    """Outcome of the operation on one target of a bulk call; error is the raised exception or None"""
+    __slots__ = ()
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+def _mergeTopologyChanges(old_change, new_change):
+    """Combine two (old state, new state, diff) events into one"""
+    return old_change[0], new_change[1], diffTopology(old_change[0], new_change[1])
+
 
-def __listDevices(listDevices_updateID=''):
-    """Fetch the  device list"""
-    global hostBaseURL, __newDeviceDataEvent, __deviceElements, __deviceElementsLock, __mediaServer
+def _iterRooms(snapshot):
+    """Iterate the rooms of the zones and the unassigned rooms of the snapshot in their order"""
+    for zone_state in snapshot.state.zones.values():
+        for room_udn in zone_state.rooms:
+            yield snapshot.rooms_by_udn[room_udn]
+    for room_udn in snapshot.state.unassigned:
+        yield snapshot.rooms_by_udn[room_udn]
 
-    request = urllib.request.Request("{0}/{1}/listDevices".format(hostBaseURL, __sessionUUID),
-                              headers={"updateID": listDevices_updateID})
-    response = urllib.request.urlopen(request, timeout=900)  # Updating the device list at least every 15minutes
-    listDevices_updateID = response.getheader('updateID')
-    devices_xml = response.read()
-    logging.debug(devices_xml.decode('utf-8'))
-    dom = xml.dom.minidom.parseString(devices_xml)
 
-    __deviceElementsLock.acquire()
-    __deviceElements = dom.getElementsByTagName("device")
-    __deviceElementsLock.release()
+class RaumfeldSystem(object):
+    """One Raumfeld host with its topology, long-poll threads, caches and connection pool
 
-    for device_element in __deviceElements:
-        if device_element.childNodes[0].nodeValue == "Raumfeld MediaServer":
-            __mediaServer = MediaServer(device_element.getAttribute("udn"),
-                                        device_element.getAttribute("location"))
-            break
+    Any number of systems can be managed in one process; the worker pools of the bulk calls,
+    status() and the change notifications are shared by all of them. The module-level functions
+    operate on the default system returned by getDefaultSystem().
+    """
 
-    # signal changes
-    __newDeviceDataEvent.set()
-    return listDevices_updateID
+    # A getZones response can reference devices which listDevices does not report yet. The
+    # reconciler then waits for a newer device list and requests one explicitly after each of
+    # these delays, before it publishes the topology with the devices unresolved
+    _RESOLVE_RETRY_DELAYS = (0.5, 1.0, 2.0, 4.0)
 
+    # Format of the snapshot files written by the warm start
+    _SNAPSHOT_FORMAT = 1
 
-def __listDevicesThread():
-    """Thread for LongPolling the listDevices Web-Service of Raumfeld"""
-    global __dataProcessedEvent
-    listDevices_updateID = ''
+    # The host holds a long-poll until something changed; the lists are requested again at
+    # least this often (15 minutes)
+    _LONG_POLL_TIMEOUT = 900
 
-    while True:
+    def __init__(self, hostIPAddress="", port=47365, snapshotFile=None):
+        """
+        :param hostIPAddress: IP address of the host, init() discovers it if none is provided
+        :param port: port of the web services of the host
+        :param snapshotFile: path of the file the host address and the topology are kept in
+        """
+        self._hostIPAddress = hostIPAddress
+        self._port = port
+        self._snapshotFile = snapshotFile
+        self.hostBaseURL = "http://{0}:{1}".format(hostIPAddress or "hostip", port)
+        self._sessionUUID = uuid4().hex
+
+        # Latest responses of the two long-polls. Each poller publishes a new versioned
+        # DeviceList or ZoneList by replacing the reference and wakes the reconciler; neither
+        # waits for the other
+        self._deviceList = None
+        self._zoneList = None
+        self._listVersions = count(1)
+        self._newListDataEvent = threading.Event()
+
+        self._reconnectPolicy = ReconnectPolicy()  # delays after failed long-polls
+
+        # Zones, rooms, renderers and their UDN indexes. Only the update thread publishes a new
+        # TopologySnapshot by replacing the reference, so readers never need a lock
+        self._topology = EMPTY_SNAPSHOT
+        self._nameIndexes = (EMPTY_SNAPSHOT, NameIndex(()), NameIndex(()))  # snapshot, zones, rooms
+        self._mediaServer = None
+        self._ready = Future()  # resolved with the first TopologySnapshot received from the host
+
+        self._connectionPool = ConnectionPool()  # keep-alive connections of all SOAP clients
+        # device descriptions with the control and event URLs of the services
+        self._descriptionCache = DescriptionCache(self._connectionPool)
+        self._contentDirectoryCache = ContentDirectoryCache()  # Browse results of the MediaServer
+        self._eventManager = None  # EventManager if the events of the renderers are subscribed
+
+        self._changeDispatcher = Dispatcher(_getDispatchExecutor())  # events: None
+        # events: (old state, new state, diff)
+        self._topologyDispatcher = Dispatcher(_getDispatchExecutor())
+        self._healthDispatcher = Dispatcher(_getDispatchExecutor())  # events: host health state
+        # fed by the long-poll threads
+        self._hostHealth = HostHealth(on_change=self._healthDispatcher.publish)
+        self._callbackListener = None  # listener of registerChangeCallback
+        self._topologyCallbackListener = None  # listener of registerTopologyCallback
+        self._changeFeed = ChangeFeed()  # versioned diffs for long-polls and event streams
+
+        self._started = False
+        self._closed = False
+
+    def __repr__(self):
+        return 'RaumfeldSystem({0!r})'.format(self.hostBaseURL)
+
+    def _createSoapClient(self, location, action):
+        """Create a SoapClient which sends its requests through the connection pool of the system"""
+        client = SoapClient.__new__(SoapClient)
+        client.__dict__.update(_getSoapClientTemplate().__dict__)
+        client.location = location
+        client.action = action
+        client.http = SoapTransport(self._connectionPool)
+        return client
+
+    def _getServiceURLs(self, location, services):
+        """Returns the dict service -> (control URL, event URL) of the device at the location
+        and whether its device description was available
+
+        The URLs are taken from the device description, the default paths of services are used
+        for the services it does not list or if it can not be fetched
+        """
         try:
-            listDevices_updateID = __listDevices(listDevices_updateID)
-            __dataProcessedEvent.wait()
-        except URLError as e:
-            if isinstance(e.reason, socket.timeout):
-                logging.info("Updating deviceList...")
-                listDevices_updateID = ''
+            description = self._descriptionCache.get(location)
+        except (HTTPException, OSError) as e:
+            logging.info("Device description {0} not available: {1}".format(location, e))
+            description = None
+        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
+        address = '{0}://{1}'.format(scheme, netloc)
+        urls = {}
+        for name, (_, control_path, event_path) in services.items():
+            service = description.getService(name) if description is not None else None
+            if service is not None and service.control_url:
+                urls[name] = (service.control_url, service.event_url)
             else:
-                logging.warn("Exception: {0}".format(e))
-                time.sleep(1)
-        except (BadStatusLine, socket.timeout):
-            logging.warning("Connection to host was lost. waiting 1 second and retrying...")
-            time.sleep(1)
-
-def __getZones(getZones_updateID=''):
-    """Fetch zones list"""
-    global hostBaseURL, __newZoneDataEvent, __zoneElements, __zoneElementsLock, __unassignedElements, __unassignedElementsLock
-
-    request = urllib.request.Request("{0}/{1}/getZones".format(hostBaseURL, __sessionUUID),
-                              headers={"updateID": getZones_updateID})
-    response = urllib.request.urlopen(request, timeout=900)  # Updating the zone list at least every 15minutes
-    getZones_updateID = response.getheader('updateID')
-    zone_xml = response.read()
-    logging.debug(zone_xml.decode('utf-8'))
-    dom = xml.dom.minidom.parseString(zone_xml)
-
-    __zoneElementsLock.acquire()
-    __zoneElements = dom.getElementsByTagName("zone")
-    __zoneElementsLock.release()
-
-    # Get all the unassigned rooms
-    __unassignedElementsLock.acquire()
-    if dom.getElementsByTagName("unassignedRooms").length > 0:
-        __unassignedElements = dom.getElementsByTagName("unassignedRooms")[
-            0].getElementsByTagName('room')
-    else:
-        __unassignedElements = []
-    __unassignedElementsLock.release()
-
-    # signal changes
-    __newZoneDataEvent.set()
-    return getZones_updateID
-
-
-def __getZonesThread():
-    """Thread for LongPolling the listDevices Web-Service of Raumfeld"""
-    global __dataProcessedEvent
-    getZones_updateID = ''
-
-    while True:
+                urls[name] = (address + control_path, address + event_path if event_path else None)
+        return urls, description is not None
+
+    def _createServiceClients(self, location, services):
+        """Returns the dict service -> SoapClient for the services of the device at the location
+        and whether they were created from its device description
+        """
+        urls, described = self._getServiceURLs(location, services)
+        return {name: self._createSoapClient(control_url, services[name][0])
+                for name, (control_url, _) in urls.items()}, described
+
+    def _getEventInfo(self, udn, service, variables):
+        """Returns a dict of evented state variables (dict name -> variable) or None if one is unknown"""
+        manager = self._eventManager
+        if manager is None:
+            return None
+        state = manager.getState(udn, service)
+        if state is None:
+            return None
         try:
-            getZones_updateID = __getZones(getZones_updateID)
-            __dataProcessedEvent.wait()
-        except URLError as e:
-            if isinstance(e.reason, socket.timeout):
-                logging.info("Updating zoneList...")
-                getZones_updateID = ''
-            else:
-                logging.warn("Exception: {0}".format(e))
-                time.sleep(1)
-        except (BadStatusLine, socket.timeout):
-            logging.warning("Connection to host was lost. waiting 1 second and retrying...")
-            time.sleep(1)
-
-
-def __updateZonesAndRoomsThread():
-    """Thread for updating the Zone and Room data structure"""
-    global __newZoneDataEvent, __newDeviceDataEvent, __newDeviceElementsEvent, __dataProcessedEvent, __zones, __zonesLock, __unassignedRooms, __unassignedRoomsLock, __zoneElements, __zoneElementsLock, __unassignedElements, __unassignedElementsLock, __deviceElements, __deviceElementsLock, __callback
-
-    # Start observing the device list
-    device_list_thread = threading.Thread(target=__listDevicesThread)
-    device_list_thread.start()
-
-    # Start observing the zone list
-    zone_list_thread = threading.Thread(target=__getZonesThread)
-    zone_list_thread.start()
-
-    __newDeviceDataEvent.wait()
-
-    while True:
-        # Wait until there are new zone elements
-        __newZoneDataEvent.wait()
-        __newZoneDataEvent.clear()
-
-        # Process Data...
-        # Build data structure and fill with information from listDevices
-
-        # List of unresolved devices
-        unresolved_devices = []
-
-        __zonesLock.acquire()
-        __zoneElementsLock.acquire()
-
-        # Create List of all UDNs from which we will delete the UDNs that are handled by the
-        # following code. Remaining UDNs are elements to be removed from the data structure,
-        # because they no longer exist
-        udn_list = []
-        for zone_element in __zones:
-            udn_list.append(zone_element.UDN)
-            for room_element in zone_element._rooms:
-                udn_list.append(room_element.UDN)
-                for renderer_element in room_element._renderers:
-                    udn_list.append(renderer_element.UDN)
-
-        # Modify data structure
-        for zone_element in __zoneElements:
-            zone_udn = zone_element.getAttribute("udn")
-
-            # Fetch the device information from the listDevices elements
-            __deviceElementsLock.acquire()
-            zone_device = __getDeviceByUDN(__deviceElements, zone_udn)
-            __deviceElementsLock.release()
-            if zone_device is None:
-                unresolved_devices.append(zone_udn)
+            return {name: state[variable] for name, variable in variables.items()}
+        except KeyError:
+            return None
+
+    def _listDevices(self, listDevices_updateID=''):
+        """Fetch the  device list"""
+        request = urllib.request.Request(
+            "{0}/{1}/listDevices".format(self.hostBaseURL, self._sessionUUID),
+            headers={"updateID": listDevices_updateID})
+        # Updating the device list at least every 15minutes
+        with urllib.request.urlopen(request, timeout=self._LONG_POLL_TIMEOUT) as response:
+            listDevices_updateID = response.getheader('updateID')
+            # Parse the response while it is received, only the device records are kept
+            device_records = parseDevices(response)
+        logging.debug("listDevices: {0}".format(device_records))
+
+        for device in device_records:
+            if device.name == "Raumfeld MediaServer":
+                media_server = self._mediaServer
+                if media_server is None or media_server.Location != device.location:
+                    self._mediaServer = MediaServer(device.udn, device.location, self)
+                break
+
+        # publish the new version and signal changes
+        self._deviceList = DeviceList(next(self._listVersions), listDevices_updateID,
+                                      device_records,
+                                      {device.udn: device for device in device_records})
+        self._newListDataEvent.set()
+        return listDevices_updateID
+
+    def _getZones(self, getZones_updateID=''):
+        """Fetch zones list"""
+        request = urllib.request.Request(
+            "{0}/{1}/getZones".format(self.hostBaseURL, self._sessionUUID),
+            headers={"updateID": getZones_updateID})
+        # Updating the zone list at least every 15minutes
+        with urllib.request.urlopen(request, timeout=self._LONG_POLL_TIMEOUT) as response:
+            getZones_updateID = response.getheader('updateID')
+            # Parse the response while it is received, only the zone and room records are kept
+            zone_records, unassigned_records = parseZones(response)
+        logging.debug("getZones: {0} {1}".format(zone_records, unassigned_records))
+
+        # publish the new version and signal changes
+        self._zoneList = ZoneList(next(self._listVersions), getZones_updateID, zone_records,
+                                  unassigned_records)
+        self._newListDataEvent.set()
+        return getZones_updateID
+
+    def _longPoll(self, name, fetch):
+        """Call fetch(updateID) in a loop, with jittered exponential backoff after failures"""
+        updateID = ''
+
+        while not self._closed:
+            if not self._hostHealth.mayRequest(name):
+                # The circuit is open and another poller probes the host
+                self._hostHealth.waitUntilConnected(self._reconnectPolicy.max_delay)
                 continue
-            zone_location = zone_device.getAttribute("location")
-
-            # Try to get existing zone, otherwise create a new zone
-            zone = __getZoneByUDN(zone_udn)
-            if zone is None:
-                # Create Zone with information
-                zone = Zone(zone_device.childNodes[0].nodeValue, zone_udn, zone_location)
-                # Append the zone to the zones list
-                __zones.append(zone)
-            else:
-                zone.reinit(zone_device.childNodes[0].nodeValue, zone_udn, zone_location)
-                udn_list.remove(zone.UDN)
-
-            # Fill zone with rooms
-            for room_element in zone_element.getElementsByTagName("room"):
-                # Try to get existing room, otherwise create a new room
-                room = zone.getRoomByUDN(room_element.getAttribute("udn"))
-                if room is None:
-                    # Create the room with information
-                    room = Room(room_element.getAttribute("name"), room_element.getAttribute("udn"))
-                    # Append the room to the room list of the zone
-                    zone._rooms.append(room)
-                else:
-                    udn_list.remove(room.UDN)
-
-                # Fill room with renderers
-                for renderer_element in room_element.getElementsByTagName("renderer"):
-                    renderer_udn = renderer_element.getAttribute("udn")
-
-                    # Fetch the device information from the listDevices elements
-                    __deviceElementsLock.acquire()
-                    renderer_device = __getDeviceByUDN(__deviceElements, renderer_udn)
-                    __deviceElementsLock.release()
-                    if renderer_device is None:
-                        unresolved_devices.append(renderer_udn)
-                        continue
-                    renderer_location = renderer_device.getAttribute("location")
-
-                    # Try to get existing renderer, otherwise create a new renderer
-                    renderer = room.getRenderer(renderer_udn)
-                    if renderer is None:
-                        # Create Renderer with information
-                        renderer = Renderer(renderer_element.getAttribute("name"), renderer_udn,
-                                            renderer_location)
-                        # Append the renderer to the list of renderers in the room
-                        # (normally there is only one renderer)
-                        room._renderers.append(renderer)
-                    else:
-                        renderer.reinit(renderer_element.getAttribute("name"), renderer_udn,
-                                            renderer_location)
-                        udn_list.remove(renderer.UDN)
-
-        # Now delete the remaining UDNs from the data structure, because they don't exist anymore
-        for zone_element in __zones:
-            for room_element in zone_element._rooms:
-                for udn in udn_list:
-                    room_element._removeRendererByUDN(udn)
-            for udn in udn_list:
-                zone_element._removeRoomByUDN(udn)
-        for udn in udn_list:
-            __removeZoneByUDN(udn)
-
-        __zoneElementsLock.release()
-        __zonesLock.release()
-
-        # Get all the unassigned rooms
-        __unassignedRoomsLock.acquire()
-        __unassignedElementsLock.acquire()
-
-        # Create List of all UDNs from which we will delete the UDNs that are handled by the
-        # following code. Remaining UDNs are elements to be removed from the data structure,
-        # because they no longer exist
-        udn_list = []
-        for room_element in __unassignedRooms:
-            udn_list.append(room_element.UDN)
-            for renderer_element in room_element._renderers:
-                udn_list.append(renderer_element.UDN)
-
-        # Modify the data structure
-        for room_element in __unassignedElements:
-            # Try to get existing room, otherwise create a new room
-            room = __getUnassignedRoomByUDN(room_element.getAttribute("udn"))
-            if room is None:
-                # Create the room with information
-                room = Room(room_element.getAttribute("name"), room_element.getAttribute("udn"))
-                # Append the room to the list of unassigned rooms
-                __unassignedRooms.append(room)
-            else:
-                udn_list.remove(room.UDN)
-            # Create the room with information
-            for renderer_element in room_element.getElementsByTagName("renderer"):
-                renderer_udn = renderer_element.getAttribute("udn")
-
-                # Fetch the device information from the listDevices elements
-                __deviceElementsLock.acquire()
-                renderer_device = __getDeviceByUDN(__deviceElements, renderer_udn)
-                __deviceElementsLock.release()
-                if renderer_device is None:
-                    unresolved_devices.append(renderer_udn)
+            try:
+                updateID = fetch(updateID)
+                self._hostHealth.success(name)
+                continue
+            except URLError as e:
+                if isinstance(e.reason, socket.timeout):
+                    logging.info("Updating {0}...".format(name))
+                    updateID = ''
                     continue
-                renderer_location = renderer_device.getAttribute("location")
-
-                # Try to get existing renderer, otherwise create a new renderer
-                renderer = room.getRenderer(renderer_udn)
-                if renderer is None:
-                    # Create Renderer with information
-                    renderer = Renderer(renderer_element.getAttribute("name"), renderer_udn,
-                                        renderer_location)
-                    # Append the renderer to the list of renderers in the room
-                    # (normally there is only one renderer)
-                    room._renderers.append(renderer)
-                else:
-                    renderer.reinit(renderer_element.getAttribute("name"), renderer_udn,
-                                        renderer_location)
-                    udn_list.remove(renderer.UDN)
-
-        # Now delete the remaining UDNs from the data structure, because they don't exist anymore
-        for room_element in __unassignedRooms:
-            for udn in udn_list:
-                room_element._removeRendererByUDN(udn)
-        for udn in udn_list:
-            __removeUnassignedRoomByUDN(udn)
-
-        __unassignedElementsLock.release()
-        __unassignedRoomsLock.release()
-
-        logging.debug("Unresolved devices: " + str(unresolved_devices))
-
-        if (__callback is not None) & (len(unresolved_devices) == 0):
+                error = e
+            except socket.timeout:
+                # Nothing changed during the long-poll: the host is fine, request the list again
+                logging.info("Updating {0}...".format(name))
+                updateID = ''
+                continue
+            except (HTTPException, OSError, ElementTree.ParseError) as e:
+                error = e
+            self._hostHealth.failure(name)
+            # Without updateID the host answers at once, so the reconnect is noticed immediately
+            updateID = ''
+            delay = self._reconnectPolicy.delay(self._hostHealth.failures(name))
+            logging.debug("{0} failed: {1}; retrying in {2:.1f} seconds".format(name, error, delay))
+            time.sleep(delay)
+
+    def _updateZonesAndRoomsThread(self):
+        """Thread for updating the Zone and Room data structure
+
+        Starts the two long-poll threads and reconciles their latest DeviceList and ZoneList
+        whenever one of them has a new version
+        """
+        # Start observing the device list and the zone list
+        for name, fetch in (('listDevices', self._listDevices), ('getZones', self._getZones)):
+            poll_thread = threading.Thread(target=self._longPoll, args=(name, fetch))
+            poll_thread.daemon = True
+            poll_thread.start()
+
+        reconciled_versions = None
+        retry = 0
+        timeout = None
+        while not self._closed:
+            if not self._newListDataEvent.wait(timeout):
+                # The devices referenced by getZones did not arrive in time: ask for them explicitly
+                retry += 1
+                try:
+                    self._listDevices()
+                except (HTTPException, OSError, ElementTree.ParseError) as e:
+                    logging.info("Requesting the device list failed: {0}".format(e))
+                    timeout = self._resolveRetryDelay(retry)
+                continue
+            self._newListDataEvent.clear()
+
+            device_list, zone_list = self._deviceList, self._zoneList
+            if device_list is None or zone_list is None:
+                continue
+            versions = (device_list.version, zone_list.version)
+            if versions == reconciled_versions:
+                continue
+
+            # Combine the records of getZones and listDevices to the new state of the topology
+            state = buildTopologyState(zone_list.zones, zone_list.unassigned,
+                                       device_list.devices_by_udn)
+            if state.unresolved and self._resolveRetryDelay(retry) is not None:
+                logging.debug("Devices not listed yet: {0}".format(state.unresolved))
+                timeout = self._resolveRetryDelay(retry)
+                continue
+            if state.unresolved:
+                logging.warning("Unresolved devices: {0}".format(state.unresolved))
+            retry = 0
+            timeout = None
+            reconciled_versions = versions
+            self._publishTopologyState(state)
+
+    def _resolveRetryDelay(self, retry):
+        """Returns the seconds to wait for unresolved devices or None if all retries are used up"""
+        if retry < len(self._RESOLVE_RETRY_DELAYS):
+            return self._RESOLVE_RETRY_DELAYS[retry]
+        return None
+
+    def _publishTopologyState(self, state, stale=False):
+        """Apply the differences to the previous state, publish the new snapshot and notify listeners
+
+        stale marks a state loaded from the snapshot file instead of received from the host
+        """
+        previous_state = self._topology.state
+        previous_version = self._topology.version
+        diff = diffTopology(previous_state, state)
+        topology = self._topology
+        if state != previous_state:
+            topology = applyTopologyDiff(topology, state, diff,
+                                         functools.partial(Zone, system=self), Room,
+                                         functools.partial(Renderer, system=self))
+        if topology.stale != stale:
+            topology = topology._replace(stale=stale)
+        if topology is not self._topology:
+            self._topology = topology
+            self._getNameIndexes()
+            if self._eventManager is not None and state != previous_state:
+                self._eventManager.setTargets(self._eventTargets(topology))
+
+        logging.debug("Topology changes: " + str(diff))
+
+        if topology.version != previous_version:
+            self._changeFeed.publish(topology.version, diff)
+        if diff:
+            self._topologyDispatcher.publish((previous_state, state, diff))
+
+        if len(self._changeDispatcher) and len(state.unresolved) == 0:
             logging.info("Zone configuration changed.")
-            __callback()
+            self._changeDispatcher.publish(None)
+
+        if not stale:
+            if state != previous_state or not self._ready.done():
+                self._saveSnapshot(state)
+            if not self._ready.done():
+                self._ready.set_result(topology)
+
+    def _eventTargets(self, topology):
+        """Returns the services of all zones and renderers as dict (udn, service) -> event URL"""
+        devices = list(topology.zones_by_udn.values()) + list(topology.renderers_by_udn.values())
+        # The descriptions of new devices are fetched concurrently
+        futures = [_submitRequest(device._getEventURLs) for device in devices]
+        targets = {}
+        for device, future in zip(devices, futures):
+            for service, url in future.result().items():
+                if url is not None:
+                    targets[(device.UDN, service)] = url
+        return targets
+
+    def _getDeviceByUDN(self, udn):
+        """Search and return the DeviceRecord defined by the UDN from the listDevices records"""
+        device_list = self._deviceList
+        return device_list.devices_by_udn.get(udn) if device_list is not None else None
+
+    def init(self, hostIPAddress="", snapshotFile=None):
+        """Start keeping the data structure updated; returns at once with the readiness Future
+
+        The Future is resolved with the first TopologySnapshot received from the host. Until then
+        the topology of the snapshot file is served, marked as stale. Searches for the host if
+        neither hostIPAddress, the address of the constructor nor the snapshot file provide it.
+        """
+        if self._started:
+            return self._ready
+        self._started = True
+        if snapshotFile is not None:
+            self._snapshotFile = snapshotFile
+
+        snapshot = self._loadSnapshot()
+        rediscover = False
+        if hostIPAddress == "":
+            hostIPAddress = self._hostIPAddress
+        if hostIPAddress == "" and snapshot is not None:
+            # The host may have got another address since: search it if it does not answer
+            hostIPAddress = snapshot['host']
+            rediscover = True
+        if hostIPAddress != "":
+            self._setHost(hostIPAddress)
+        if snapshot is not None:
+            self._publishTopologyState(topologyStateFromDict(snapshot['topology']), stale=True)
+            if snapshot.get('media_server'):
+                self._mediaServer = MediaServer(*snapshot['media_server'], system=self)
+
+        updateThread = threading.Thread(target=self._run, args=(hostIPAddress == "", rediscover))
+        updateThread.daemon = True
+        updateThread.start()
+        return self._ready
+
+    def _run(self, discover, rediscover):
+        """Thread which searches for the host if needed and keeps the data structure updated"""
+        if discover:
+            hostIPAddress = discoverHost()
+            if hostIPAddress == "":
+                logging.warning("Cannot determine host IP Address.")
+                self._ready.set_exception(ConnectionError("Cannot determine host IP Address."))
+                return
+            self._setHost(hostIPAddress)
+        if rediscover:
+            threading.Thread(target=self._rediscoverHost, daemon=True).start()
+        self._updateZonesAndRoomsThread()
+
+    def _rediscoverHost(self):
+        """Search for the host again while it does not answer at the address of the snapshot file"""
+        while not self._ready.done() and not self._closed:
+            if self._hostHealth.failures('listDevices') or self._hostHealth.failures('getZones'):
+                hostIPAddress = discoverHost(useCache=False)
+                if hostIPAddress != "" and hostIPAddress != self._hostIPAddress:
+                    logging.info("Host moved to {0}".format(hostIPAddress))
+                    # The long-polls use the new address with their next request
+                    self._setHost(hostIPAddress)
+                    return
+                time.sleep(self._reconnectPolicy.max_delay)
+            else:
+                time.sleep(1.0)
 
-        # Notify the observing threads to continue
-        __dataProcessedEvent.set()
+    def _setHost(self, hostIPAddress):
+        self._hostIPAddress = hostIPAddress
+        self.hostBaseURL = "http://{0}:{1}".format(hostIPAddress, self._port)
 
+    def _loadSnapshot(self):
+        """Returns the content of the snapshot file or None if there is no usable one"""
+        if self._snapshotFile is None:
+            return None
+        try:
+            with open(self._snapshotFile, encoding='utf-8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            if (snapshot.get('format'), snapshot.get('port')) != (self._SNAPSHOT_FORMAT, self._port):
+                return None
+            topologyStateFromDict(snapshot['topology'])  # check it before anything is changed
+            return snapshot
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning("Ignoring the snapshot file {0}: {1}".format(self._snapshotFile, e))
+            return None
+
+    def _saveSnapshot(self, state):
+        """Write the host address and the topology state to the snapshot file"""
+        if self._snapshotFile is None:
+            return
+        media_server = self._mediaServer
+        snapshot = {'format': self._SNAPSHOT_FORMAT,
+                    'host': self._hostIPAddress,
+                    'port': self._port,
+                    'saved': time.time(),
+                    'media_server': None,
+                    'topology': topologyStateToDict(state)}
+        if media_server is not None:
+            snapshot['media_server'] = [media_server.UDN, media_server.Location]
+        # Replace the file at once, so a crash never leaves a truncated snapshot behind
+        temporary_file = self._snapshotFile + '.tmp'
+        try:
+            with open(temporary_file, 'w', encoding='utf-8') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(temporary_file, self._snapshotFile)
+        except OSError as e:
+            logging.warning("Saving the snapshot file {0} failed: {1}".format(self._snapshotFile, e))
 
-def __getZoneByUDN(zone_udn):
-    """return the zone with the given UDN (private function without lock)"""
-    for zone_element in __zones:
-        if zone_element.UDN == zone_udn:
-            return zone_element
-    return None
+    def close(self):
+        """Stop updating the data structure and the event subscriptions, close all connections
 
+        The long-poll threads end after their current request
+        """
+        self._closed = True
+        self._ready.cancel()
+        self._newListDataEvent.set()
+        self.disableEventSubscriptions()
+        self._connectionPool.clear()
+
+    def updateData(self):
+        """Update Device list and Zone list"""
+        self._listDevices()
+        self._getZones()
+
+    def registerChangeCallback(self, callback):
+        """Method to register a callback function which is called when the data structure has changed"""
+        if self._callbackListener is not None:
+            self._changeDispatcher.remove(self._callbackListener)
+            self._callbackListener = None
+        if callback is not None:
+            self._callbackListener = self.addChangeListener(callback)
+
+    def registerTopologyCallback(self, callback):
+        """Method to register a callback function which is called with the TopologyDiff of every change of the data structure"""
+        if self._topologyCallbackListener is not None:
+            self._topologyDispatcher.remove(self._topologyCallbackListener)
+            self._topologyCallbackListener = None
+        if callback is not None:
+            self._topologyCallbackListener = self.addTopologyListener(callback)
+
+    def addChangeListener(self, callback, maxQueue=16, policy=COALESCE):
+        """Add a function which is called without arguments after every change of the data structure
+
+        Each listener has its own queue of maxQueue notifications and is called on the dispatch
+        executor. policy COALESCE (default) merges a full queue into one notification, DROP_OLDEST
+        drops the oldest. Returns the Listener, which is needed to remove it and has stats.
+        """
+        return self._changeDispatcher.add(lambda event: callback(), maxQueue, policy)
 
-def __removeZoneByUDN(udn):
-    """Remove the zone with the UDN from the list of zones"""
-    for zone_element in __zones:
-        if zone_element.UDN == udn:
-            __zones.remove(zone_element)
+    def addTopologyListener(self, callback, maxQueue=16, policy=COALESCE):
+        """Add a function which is called with the TopologyDiff of every change of the data structure
 
+        Coalescing merges the queued changes into one TopologyDiff from the oldest to the newest state
+        """
+        return self._topologyDispatcher.add(lambda event: callback(event[2]), maxQueue, policy,
+                                            _mergeTopologyChanges)
 
-def __getUnassignedRoomByUDN(room_udn):
-    """return the unassigned room with the given UDN (private function without lock)"""
-    for room_element in __unassignedRooms:
-        if room_element.UDN == room_udn:
-            return room_element
-    return None
+    def getChangeFeed(self):
+        """Returns the ChangeFeed with the versioned TopologyDiffs of this system"""
+        return self._changeFeed
 
+    def removeListener(self, listener):
+        """Remove a listener added by addChangeListener, addTopologyListener or addHealthListener"""
+        self._changeDispatcher.remove(listener)
+        self._topologyDispatcher.remove(listener)
+        self._healthDispatcher.remove(listener)
 
-def __removeUnassignedRoomByUDN(udn):
-    """Remove the unassigned room with the UDN from the list of unassigned rooms"""
-    for room_element in __unassignedRooms:
-        if room_element.UDN == udn:
-            __unassignedRooms.remove(room_element)
+    def getListenerStats(self):
+        """Returns the queue, drop and latency counters of all change, topology and health listeners"""
+        return [listener.stats for listener in self._changeDispatcher.listeners +
+                self._topologyDispatcher.listeners + self._healthDispatcher.listeners]
 
+    def getMediaServer(self):
+        """Returns the Raumfeld Media Server"""
+        return self._mediaServer
 
-def __getDeviceByUDN(deviceElements, udn):
-    """Search and return the device element defined by the UDN from the listDevices elements"""
-    for device_element in deviceElements:
-        if device_element.getAttribute("udn") == udn:
-            return device_element
+    def getMediaServerUDN(self):
+        """Returns the UDN of the Raumfeld Media Server"""
+        return self._mediaServer.UDN
 
+    def getTopology(self):
+        """Returns the current TopologySnapshot, for several lookups on one consistent state"""
+        return self._topology
 
-def __discoverHost():
-    """Discover the Raumfeld Host and return the IP Address"""
-    group = ('239.255.255.250', 1900)
-    service = 'urn:schemas-raumfeld-com:device:ConfigDevice:1'
-    message = '\r\n'.join(['M-SEARCH * HTTP/1.1',
-                           'HOST: {group[0]}:{group[1]}',
-                           'MAN: "ssdp:discover"',
-                           'ST: {st}',
-                           'MX: 1', '', '']).format(group=group, st=service)
+    def _getNameIndexes(self):
+        """Returns the NameIndexes of the zones and rooms of the current topology
+
+        They are rebuilt by the update thread with every new snapshot; a lookup which sees a
+        newer snapshot first builds them itself
+        """
+        topology = self._topology
+        snapshot, zones, rooms = self._nameIndexes
+        if snapshot is not topology:
+            zones, rooms = NameIndex(topology.zones), NameIndex(_iterRooms(topology))
+            self._nameIndexes = (topology, zones, rooms)
+        return zones, rooms
 
-    socket.setdefaulttimeout(10)
-    sock = socket.socket(socket.AF_INET,
-                         socket.SOCK_DGRAM,
-                         socket.IPPROTO_UDP)
+    def getRoomsByName(self, name):
+        """Searches for rooms whose name contains name, best matches first
 
-    # socket options
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        Names are compared case-insensitively, "Kueche" and "Kuche" find "Küche"
+        """
+        return self._getNameIndexes()[1].find(name)
 
-    # send group multicast
-    sock.sendto(message.encode('utf-8'), group)
+    def getRoomByName(self, name):
+        """Returns the room matching name best (exact, then prefix, then substring) or None"""
+        return self._getNameIndexes()[1].findFirst(name)
 
-    while True:
-        try:
-            response = sock.recv(2048).decode('utf-8')
-            # logging.debug(response)
-            for line in response.split('\r\n'):
-                if line.startswith('Location: '):
-                    sock.close()
-                    location = line.split(' ')[1].strip()
-                    # Extract the netloc fragment of the URL
-                    netloc = urllib.parse.urlparse(location)[1]
-                    sock.close()
-                    socket.setdefaulttimeout(None)
-                    # Return the IP-Address
-                    return netloc.split(':')[0]
-        except socket.timeout:
-            sock.close()
-            socket.setdefaulttimeout(None)
-            break
-    return ""
-
-
-def updateData():
-    """Update Device list and Zone list"""
-    __listDevices()
-    __getZones()
-
-
-def registerChangeCallback(callback):
-    """Method to register a callback function which is called when the data structure has changed"""
-    global __callback
-    __callback = callback
-
-
-def getMediaServer():
-    """Returns the Raumfeld Media Server"""
-    return __mediaServer
-
-
-def getMediaServerUDN():
-    """Returns the UDN of the Raumfeld Media Server"""
-    return __mediaServer.UDN
-
-
-def getRoomsByName(name):
-    """Searches for rooms with a special name"""
-    global __zonesLock, __unassignedRoomsLock
-
-    __zonesLock.acquire()
-    __unassignedRoomsLock.acquire()
-    roomList = []
-    for zone in __zones:
-        for room in zone._rooms:
-            if (room.Name.find(name) >= 0):
-                roomList.append(room)
-    for room in __unassignedRooms:
-        if (room.Name.find(name) >= 0):
-            roomList.append(room)
-    __unassignedRoomsLock.release()
-    __zonesLock.release()
-    return roomList
-
-
-def getRoomByUDN(udn):
-    """Searches for a room_element with a given UDN"""
-    global __zonesLock, __unassignedRoomsLock
-
-    __zonesLock.acquire()
-    __unassignedRoomsLock.acquire()
-    for zone_element in __zones:
-        for room_element in zone_element._rooms:
-            if room_element.UDN == udn:
-                __unassignedRoomsLock.release()
-                __zonesLock.release()
-                return room_element
-    for room_element in __unassignedRooms:
-        if room_element.UDN == udn:
-            __unassignedRoomsLock.release()
-            __zonesLock.release()
-            return room_element
-    __unassignedRoomsLock.release()
-    __zonesLock.release()
-    return None
-
-
-def getZones():
-    """get all discovered zones. Requires initialize('Host-IP-Address')"""
-    return __zones
-
-
-def getUnassignedRooms():
-    """get all unassigned rooms. Requires initialize('Host-IP-Address')"""
-    return __unassignedRooms
-
-
-def getZonesByName(name):
-    """Searches for zones with a special name"""
-    global __zonesLock
-
-    zoneList = []
-    __zonesLock.acquire()
-    for zone_element in __zones:
-        if (zone_element.Name.find(name) >= 0):
-            zoneList.append(zone_element)
-    __zonesLock.release()
-    return zoneList
-
-
-def getZoneByUDN(udn):
-    """Searches for the zone with a given UDN"""
-    global __zonesLock
-
-    __zonesLock.acquire()
-    for zone_element in __zones:
-        if zone_element.UDN == udn:
-            __zonesLock.release()
-            return zone_element
-    __zonesLock.release()
-    return None
-
-
-def getZoneWithRoom(room):
-    """Returns the zone containing the room"""
-    global __zonesLock
-
-    __zonesLock.acquire()
-    for zone_element in __zones:
-        for room_element in zone_element._rooms:
-            if room_element.UDN == room.UDN:
-                __zonesLock.release()
-                return zone_element
-    __zonesLock.release()
-    return None
-
-
-def getZoneWithRoomName(name):
-    """Returns the zones containing a room defined by its name"""
-    global __zonesLock
-
-    __zonesLock.acquire()
-    zoneList = []
-    for zone in __zones:
-        for room_element in zone._rooms:
-            if (room_element.Name.find(name) >= 0):
+    def getRoomByUDN(self, udn):
+        """Searches for a room_element with a given UDN"""
+        return self._topology.rooms_by_udn.get(udn)
+
+    def getZones(self):
+        """get all discovered zones. Requires initialize('Host-IP-Address')"""
+        return self._topology.zones
+
+    def getUnassignedRooms(self):
+        """get all unassigned rooms. Requires initialize('Host-IP-Address')"""
+        return self._topology.unassigned_rooms
+
+    def getZonesByName(self, name):
+        """Searches for zones whose name contains name, best matches first"""
+        return self._getNameIndexes()[0].find(name)
+
+    def getZoneByName(self, name):
+        """Returns the zone matching name best (exact, then prefix, then substring) or None"""
+        return self._getNameIndexes()[0].findFirst(name)
+
+    def getZoneByUDN(self, udn):
+        """Searches for the zone with a given UDN"""
+        return self._topology.zones_by_udn.get(udn)
+
+    def getZoneWithRoom(self, room):
+        """Returns the zone containing the room"""
+        return self.getZoneWithRoomUDN(room.UDN)
+
+    def getZoneWithRoomName(self, name):
+        """Returns the zones containing a room defined by its name, best matching room first"""
+        zone_by_room_udn = self._topology.zone_by_room_udn
+        zoneList = []
+        for room in self._getNameIndexes()[1].find(name):
+            zone = zone_by_room_udn.get(room.UDN)
+            if zone is not None and zone not in zoneList:
                 zoneList.append(zone)
-                break
-    __zonesLock.release()
-    return zoneList
+        return zoneList
+
+    def getZoneWithRoomUDN(self, udn):
+        """Returns the zone containing a room defined by its UDN"""
+        return self._topology.zone_by_room_udn.get(udn)
+
+    @withTimeout
+    def dropRoomByUDN(self, udn):
+        """Drops the room with the given UDN from the zone it is in"""
+        with urllib.request.urlopen("{0}/dropRoomJob?roomUDN={1}".format(self.hostBaseURL, udn),
+                                    timeout=remaining()):
+            pass
+
+    @withTimeout
+    def connectRoomToZone(self, roomUDN, zoneUDN=''):
+        """Puts the room with the given roomUDN in the zone with the zoneUDN"""
+        with urllib.request.urlopen(
+                "{0}/connectRoomToZone?roomUDN={1}&zoneUDN={2}".format(
+                    self.hostBaseURL, roomUDN, zoneUDN),
+                timeout=remaining()):
+            pass
+
+    def _resolveTarget(self, target):
+        """Returns the Zone, Room or Renderer for an object or a UDN"""
+        if not isinstance(target, str):
+            return target
+        snapshot = self._topology
+        for index in (snapshot.zones_by_udn, snapshot.rooms_by_udn, snapshot.renderers_by_udn):
+            if target in index:
+                return index[target]
+        raise KeyError("Unknown UDN: {0}".format(target))
+
+    def _runOperation(self, target, function):
+        try:
+            return BulkResult(target, function(self._resolveTarget(target)), None)
+        except Exception as e:
+            return BulkResult(target, None, e)
+
+    def _runAll(self, operations, timeout=None, cancellation=None):
+        """Run the (target, function) operations in parallel and return their BulkResults
+
+        Operations which did not finish when the deadline passed or the cancellation was
+        cancelled get a TimeoutError or CancelledError; their requests end at the same deadline
+        at the latest
+        """
+        with deadline(timeout, cancellation):
+            futures = [(target, _submitBulk(self._runOperation, target, function))
+                       for target, function in operations]
+            pending = {future for _, future in futures}
+            if cancellation is not None:
+                pending.add(cancellation.future)
+            error = None
+            try:
+                while not all(future.done() for _, future in futures):
+                    done, pending = wait(pending, remaining(), FIRST_COMPLETED)
+            except (TimeoutError, CancelledError) as e:
+                error = e
+        results = []
+        for target, future in futures:
+            if future.done() and not future.cancelled():
+                results.append(future.result())
+            else:
+                future.cancel()
+                results.append(BulkResult(target, None, error))
+        return results
+
+    def runConcurrently(self, targets, function, timeout=None, cancellation=None):
+        """Calls function(target) for all targets (Zone, Room, Renderer objects or UDNs) in parallel
 
+        Returns a list of BulkResults in the order of the targets. The call takes about as long as
+        the slowest target; errors are returned in the BulkResult instead of being raised. After
+        timeout seconds or once the Cancellation is cancelled, the call returns and the unfinished
+        targets get a TimeoutError or CancelledError.
+        """
+        return self._runAll(((target, function) for target in targets), timeout, cancellation)
+
+    def pauseAll(self, timeout=None, cancellation=None):
+        """Pauses all zones in parallel; returns a list of BulkResults"""
+        return self.runConcurrently(self.getZones(), lambda zone: zone.pause(), timeout,
+                                    cancellation)
+
+    def stopAll(self, timeout=None, cancellation=None):
+        """Stops all zones in parallel; returns a list of BulkResults"""
+        return self.runConcurrently(self.getZones(), lambda zone: zone.stop(), timeout,
+                                    cancellation)
+
+    def pauseZones(self, zones, timeout=None, cancellation=None):
+        """Pauses the given zones (objects or UDNs) in parallel; returns a list of BulkResults"""
+        return self.runConcurrently(zones, lambda zone: zone.pause(), timeout, cancellation)
+
+    def stopZones(self, zones, timeout=None, cancellation=None):
+        """Stops the given zones (objects or UDNs) in parallel; returns a list of BulkResults"""
+        return self.runConcurrently(zones, lambda zone: zone.stop(), timeout, cancellation)
+
+    def setVolumes(self, volumes, timeout=None, cancellation=None):
+        """Sets the volumes given as dict {target: volume} in parallel; returns a list of BulkResults
+
+        The targets can be Zone, Room or Renderer objects or their UDNs
+        """
+        def volumeSetter(volume):
+            def setVolume(target):
+                target.volume = volume
+            return setVolume
+
+        return self._runAll(((target, volumeSetter(volume)) for target, volume in volumes.items()),
+                            timeout, cancellation)
+
+    def muteRooms(self, rooms, mute=True, timeout=None, cancellation=None):
+        """Sets the mute state of the given rooms (objects or UDNs) in parallel; returns a list of BulkResults"""
+        def setMute(room):
+            room.mute = mute
+
+        return self.runConcurrently(rooms, setMute, timeout, cancellation)
 
-def getZoneWithRoomUDN(udn):
-    """Returns the zone containing a room defined by its UDN"""
-    global __zonesLock
+    def configureConnectionPool(self, maxsize=None, idleTimeout=None):
+        """Sets the number of idle keep-alive connections per host and their idle timeout in seconds"""
+        self._connectionPool.configure(maxsize=maxsize, idle_timeout=idleTimeout)
 
-    __zonesLock.acquire()
-    for zone_element in __zones:
-        for room_element in zone_element._rooms:
-            if room_element.UDN == udn:
-                __zonesLock.release()
-                return zone_element
-    __zonesLock.release()
-    return None
+    def getConnectionPoolStats(self):
+        """Returns the counters of reused, newly created and idle connections of the connection pool"""
+        return self._connectionPool.stats
 
+    def configureContentDirectoryCache(self, maxBytes=None, ttl=None, systemUpdateInterval=None):
+        """Sets the memory cap, the time to live and the SystemUpdateID check interval of the browse cache"""
+        self._contentDirectoryCache.configure(max_bytes=maxBytes, ttl=ttl,
+                                              system_update_interval=systemUpdateInterval)
 
-def dropRoomByUDN(udn):
-    """Drops the room with the given UDN from the zone it is in"""
-    global hostBaseURL
-    urllib.request.urlopen("{0}/dropRoomJob?roomUDN={1}".format(hostBaseURL, udn))
+    def getContentDirectoryCacheStats(self):
+        """Returns the hits, misses, evictions, invalidations, entries and size of the browse cache"""
+        return self._contentDirectoryCache.stats
+
+    def clearContentDirectoryCache(self):
+        """Drops all cached browse results"""
+        self._contentDirectoryCache.clear()
+
+    def configureDescriptionCache(self, directory=None):
+        """Sets the directory the device descriptions are stored in (None: memory only)"""
+        self._descriptionCache.configure(directory)
+
+    def getDescriptionCacheStats(self):
+        """Returns the hits, downloads, revalidations and entries of the device description cache"""
+        return self._descriptionCache.stats
+
+    def enableEventSubscriptions(self, port=0, timeout=300):
+        """Subscribe to the events of all zones and renderers
+
+        A local NOTIFY server is started on the given port (any free port by default). Afterwards
+        volume, mute, media_info and transport_info are served from the events without a request
+        to the device whenever their current values are known.
+        """
+        if self._eventManager is not None:
+            return
+        manager = EventManager(self._connectionPool, timeout=timeout, port=port)
+        manager.start()
+        self._eventManager = manager
+        manager.setTargets(self._eventTargets(self._topology))
+
+    def disableEventSubscriptions(self):
+        """Cancel all event subscriptions and stop the NOTIFY server"""
+        manager, self._eventManager = self._eventManager, None
+        if manager is not None:
+            manager.stop()
+
+    def getEventSubscriptionStats(self):
+        """Returns the number of active subscriptions, received events and failed subscription requests"""
+        if self._eventManager is None:
+            return {'subscriptions': 0, 'events': 0, 'failures': 0}
+        return self._eventManager.stats
+
+    def configureReconnect(self, initialDelay=None, maxDelay=None, factor=None, jitter=None,
+                           failureThreshold=None):
+        """Configures the backoff of the host long-polls after failures
+
+        The delay starts at initialDelay seconds and grows by factor up to maxDelay, jitter is the
+        fraction randomly subtracted from it. After failureThreshold failures in a row the host
+        counts as disconnected.
+        """
+        self._reconnectPolicy.configure(initialDelay, maxDelay, factor, jitter)
+        if failureThreshold is not None:
+            self._hostHealth.failure_threshold = failureThreshold
+
+    def getHostHealth(self):
+        """Returns the state of the connection to the host: CONNECTED, DEGRADED or DISCONNECTED"""
+        return self._hostHealth.state
+
+    def addHealthListener(self, callback):
+        """Add a function which is called with the new state whenever the host health changes
+
+        Returns the Listener; the function is called asynchronously like the change listeners
+        """
+        return self._healthDispatcher.add(callback)
 
 
-def connectRoomToZone(roomUDN, zoneUDN=''):
-    """Puts the room with the given roomUDN in the zone with the zoneUDN"""
-    global hostBaseURL
-    urllib.request.urlopen(
-        "{0}/connectRoomToZone?roomUDN={1}&zoneUDN={2}".format(hostBaseURL, roomUDN, zoneUDN))
+def configureBulkExecutor(maxWorkers):
+    """Sets the number of threads which execute the operations of the bulk calls of all systems"""
+    global __bulkExecutor
+    previous_executor = __bulkExecutor
+    __bulkExecutor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix='raumfeld-bulk')
+    previous_executor.shutdown(wait=False)
 
 
 def setLogging(level=logging.DEBUG):
@@ -1056,20 +1514,66 @@ def setLogging(level=logging.DEBUG):
     logging.basicConfig(format='%(asctime)-15s %(message)s')
 
 
-def init(hostIPAddress=""):
-    global hostBaseURL
-    if hostIPAddress == "":
-        hostIPAddress = __discoverHost()
-    if hostIPAddress == "":
-        logging.warning("Cannot determine host IP Address.")
-        return
-
-    hostBaseURL = "http://{0}:47365".format(hostIPAddress)
-    # Start Thread which keeps the data structure updated
-    updateThread = threading.Thread(target=__updateZonesAndRoomsThread)
-    updateThread.daemon = True
-    updateThread.start()
-    __dataProcessedEvent.wait()
+def getDefaultSystem():
+    """Returns the RaumfeldSystem the module-level functions operate on"""
+    return __defaultSystem
+
+
+def __getattr__(name):
+    # hostBaseURL (read only) is the one of the default system
+    if name == 'hostBaseURL':
+        return __defaultSystem.hostBaseURL
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+__defaultSystem = RaumfeldSystem()
+
+# The module-level functions operate on the default system
+init = __defaultSystem.init
+updateData = __defaultSystem.updateData
+registerChangeCallback = __defaultSystem.registerChangeCallback
+registerTopologyCallback = __defaultSystem.registerTopologyCallback
+addChangeListener = __defaultSystem.addChangeListener
+addTopologyListener = __defaultSystem.addTopologyListener
+removeListener = __defaultSystem.removeListener
+getChangeFeed = __defaultSystem.getChangeFeed
+getListenerStats = __defaultSystem.getListenerStats
+getMediaServer = __defaultSystem.getMediaServer
+getMediaServerUDN = __defaultSystem.getMediaServerUDN
+getTopology = __defaultSystem.getTopology
+getRoomsByName = __defaultSystem.getRoomsByName
+getRoomByName = __defaultSystem.getRoomByName
+getRoomByUDN = __defaultSystem.getRoomByUDN
+getZones = __defaultSystem.getZones
+getUnassignedRooms = __defaultSystem.getUnassignedRooms
+getZonesByName = __defaultSystem.getZonesByName
+getZoneByName = __defaultSystem.getZoneByName
+getZoneByUDN = __defaultSystem.getZoneByUDN
+getZoneWithRoom = __defaultSystem.getZoneWithRoom
+getZoneWithRoomName = __defaultSystem.getZoneWithRoomName
+getZoneWithRoomUDN = __defaultSystem.getZoneWithRoomUDN
+dropRoomByUDN = __defaultSystem.dropRoomByUDN
+connectRoomToZone = __defaultSystem.connectRoomToZone
+runConcurrently = __defaultSystem.runConcurrently
+pauseAll = __defaultSystem.pauseAll
+stopAll = __defaultSystem.stopAll
+pauseZones = __defaultSystem.pauseZones
+stopZones = __defaultSystem.stopZones
+setVolumes = __defaultSystem.setVolumes
+muteRooms = __defaultSystem.muteRooms
+configureConnectionPool = __defaultSystem.configureConnectionPool
+getConnectionPoolStats = __defaultSystem.getConnectionPoolStats
+configureContentDirectoryCache = __defaultSystem.configureContentDirectoryCache
+getContentDirectoryCacheStats = __defaultSystem.getContentDirectoryCacheStats
+clearContentDirectoryCache = __defaultSystem.clearContentDirectoryCache
+configureDescriptionCache = __defaultSystem.configureDescriptionCache
+getDescriptionCacheStats = __defaultSystem.getDescriptionCacheStats
+enableEventSubscriptions = __defaultSystem.enableEventSubscriptions
+disableEventSubscriptions = __defaultSystem.disableEventSubscriptions
+getEventSubscriptionStats = __defaultSystem.getEventSubscriptionStats
+configureReconnect = __defaultSystem.configureReconnect
+getHostHealth = __defaultSystem.getHostHealth
+addHealthListener = __defaultSystem.addHealthListener
 
 
 if __name__ == '__main__':
@@ -0,0 +1,999 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client for the Teufel Raumfeld system
+
+The counterpart of the threaded raumfeld module for a single event loop: the
+listDevices/getZones long-polls run as tasks and every SOAP call of Renderer,
+Zone, Room and MediaServer is a coroutine, so hundreds of control operations
+can run concurrently without a thread per request.
+
+Usage:
+
+    host = RaumfeldHost("192.168.0.10")
+    await host.start()
+    await asyncio.gather(*(zone.setVolume(20) for zone in host.getZones()))
+    async for diff in host.changes():
+        print(diff)
+"""
+
+import asyncio
+import io
+import logging
+import time
+import urllib.parse
+import weakref
+from collections import deque
+from types import MappingProxyType
+from uuid import uuid4
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from pysimplesoap.client import SoapFault
+
+from . import RendererStatus, _iterRooms, _nextPageIndex, _parseDidlObjects, description
+from .contentcache import ContentDirectoryCache
+from .deadline import remaining
+from .health import DISCONNECTED, HostHealth, ReconnectPolicy
+from .nameindex import NameIndex
+from .ssdp import discoverHostAsync
+from .didl import parseDidlObject
+from .topology import (EMPTY_SNAPSHOT, applyTopologyDiff, buildTopologyState, diffTopology,
+                       parseDevices, parseZones)
+
+_SOAP_ENVELOPE_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+# The same request layout the SoapClients of the raumfeld module send
+_SOAP_REQUEST = ('<?xml version="1.0" encoding="UTF-8"?>'
+                 '<soap:Envelope xmlns:soap="{ns}" xmlns:s="{ns}">\n<soap:Header/>\n'
+                 '<soap:Body><s:{method}>{arguments}</s:{method}></soap:Body></soap:Envelope>')
+
+_STALE_CONNECTION_ERRORS = (ConnectionResetError, BrokenPipeError, ConnectionAbortedError,
+                            asyncio.IncompleteReadError)
+
+# Methods which can be sent again if it is unknown whether the device received them; SOAP
+# actions are POSTs and must not run twice
+_IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+class ConnectionPool(object):
+    """Pool of idle keep-alive connections (asyncio streams), kept separately for every host"""
+
+    def __init__(self, maxsize=4, idle_timeout=30.0):
+        """
+        :param maxsize: number of idle connections kept per host
+        :param idle_timeout: seconds after which an idle connection is discarded
+        """
+        self._maxsize = maxsize
+        self._idleTimeout = idle_timeout
+        self._idle = {}  # netloc -> deque of (reader, writer, last_used)
+        self._reused = 0
+        self._created = 0
+
+    def configure(self, maxsize=None, idle_timeout=None):
+        """Change the pool size and/or the idle timeout"""
+        if maxsize is not None:
+            self._maxsize = maxsize
+        if idle_timeout is not None:
+            self._idleTimeout = idle_timeout
+
+    @property
+    def stats(self):
+        """Returns a dict with the number of reused, created and currently idle connections"""
+        return {'reused': self._reused,
+                'created': self._created,
+                'idle': sum(len(connections) for connections in self._idle.values())}
+
+    def clear(self):
+        """Close all idle connections"""
+        for connections in self._idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+        self._idle.clear()
+
+    async def request(self, url, method='GET', body=None, headers=None, timeout=60):
+        """Send a request and return the tuple (status, headers, content)
+
+        The names of the returned headers are lower case. A timeout of None waits forever.
+        """
+        _, netloc, path, _, query, _ = urllib.parse.urlparse(url)
+        if query:
+            path = '{0}?{1}'.format(path, query)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        request = self._encodeRequest(method, netloc, path or '/', body, headers or {})
+        return await asyncio.wait_for(self._exchange(netloc, method, request), timeout)
+
+    async def _exchange(self, netloc, method, request):
+        reader, writer, reused = await self._acquire(netloc)
+        sent = False
+        try:
+            try:
+                await self._send(writer, request)
+                sent = True
+                status, headers, content, keep_alive = await self._receive(reader)
+            except _STALE_CONNECTION_ERRORS:
+                writer.close()
+                # The device closed the idle connection in the meantime: retry once with a new
+                # one, unless the device may have received a request which must not run twice
+                if not reused or (sent and method not in _IDEMPOTENT_METHODS):
+                    raise
+                reader, writer, reused = await self._connect(netloc)
+                await self._send(writer, request)
+                status, headers, content, keep_alive = await self._receive(reader)
+        except BaseException:
+            # Also on timeout/cancellation: the connection is in an undefined state
+            writer.close()
+            raise
+        if keep_alive:
+            self._release(netloc, reader, writer)
+        else:
+            writer.close()
+        return status, headers, content
+
+    @staticmethod
+    def _encodeRequest(method, netloc, path, body, headers):
+        lines = ['{0} {1} HTTP/1.1'.format(method, path), 'Host: {0}'.format(netloc)]
+        lines.extend('{0}: {1}'.format(name, value) for name, value in headers.items()
+                     if name.lower() not in ('host', 'content-length'))
+        lines.append('Content-Length: {0}'.format(len(body) if body else 0))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+    async def _send(self, writer, request):
+        writer.write(request)
+        await writer.drain()
+
+    async def _receive(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the device")
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' and (version != 'HTTP/1.0' or connection == 'keep-alive')
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip the trailer
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            content = await reader.read()
+            keep_alive = False
+        return int(status), headers, content, keep_alive
+
+    async def _acquire(self, netloc):
+        """Returns the tuple (reader, writer, reused)"""
+        now = time.monotonic()
+        connections = self._idle.get(netloc)
+        while connections:
+            reader, writer, last_used = connections.pop()
+            if now - last_used < self._idleTimeout and not writer.is_closing() \
+                    and not reader.at_eof():
+                self._reused += 1
+                return reader, writer, True
+            writer.close()
+        return await self._connect(netloc)
+
+    async def _connect(self, netloc):
+        host, _, port = netloc.rpartition(':')
+        if not host:
+            host, port = netloc, 80
+        reader, writer = await asyncio.open_connection(host, int(port))
+        self._created += 1
+        return reader, writer, False
+
+    def _release(self, netloc, reader, writer):
+        connections = self._idle.setdefault(netloc, deque())
+        if len(connections) < self._maxsize:
+            connections.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+
+# One pool per event loop, because asyncio streams are bound to the loop they were created on
+__connectionPools = weakref.WeakKeyDictionary()
+
+
+def getConnectionPool():
+    """Returns the ConnectionPool of the running event loop"""
+    loop = asyncio.get_running_loop()
+    pool = __connectionPools.get(loop)
+    if pool is None:
+        pool = __connectionPools[loop] = ConnectionPool()
+    return pool
+
+
+__contentDirectoryCache = ContentDirectoryCache()
+
+
+def getContentDirectoryCache():
+    """Returns the ContentDirectoryCache of the Browse results"""
+    return __contentDirectoryCache
+
+
+class DescriptionCache(description.DescriptionCache):
+    """DescriptionCache which fetches with the ConnectionPool of the running event loop
+
+    Concurrent requests for the same location await one fetch
+    """
+
+    def __init__(self, directory=None):
+        description.DescriptionCache.__init__(self, None, directory)
+        self._fetches = {}  # (event loop, location) -> task fetching the description
+
+    async def get(self, location):
+        """Returns the DeviceDescription of the location, fetching it if it is not known yet
+
+        Raises OSError, asyncio.TimeoutError or asyncio.IncompleteReadError if the device can not
+        be reached
+        """
+        with self._lock:
+            device_description = self._descriptions.get(location)
+            if device_description is not None:
+                self._hits += 1
+                return device_description
+        key = (asyncio.get_running_loop(), location)
+        fetch = self._fetches.get(key)
+        if fetch is None:
+            fetch = self._fetches[key] = asyncio.ensure_future(self._fetchAsync(location))
+            # The task is done once the description is remembered or the fetch failed
+            fetch.add_done_callback(lambda _: self._fetches.pop(key, None))
+        # One cancelled request does not cancel the fetch of the others
+        return await asyncio.shield(fetch)
+
+    async def _fetchAsync(self, location):
+        stored, headers = self._request(location)
+        status, response_headers, content = await getConnectionPool().request(
+            location, headers=headers, timeout=remaining())
+        device_description = self._response(location, stored, status,
+                                            response_headers.get('etag'),
+                                            response_headers.get('last-modified'), content)
+        self._remember(location, device_description)
+        return device_description
+
+
+__descriptionCache = DescriptionCache()
+
+
+def getDescriptionCache():
+    """Returns the DescriptionCache the control URLs of the devices are taken from"""
+    return __descriptionCache
+
+
+class SoapService(object):
+    """Calls the actions of one UPnP service of a device"""
+
+    def __init__(self, location, action):
+        """
+        :param location: control URL of the service
+        :param action: SOAPAction prefix, e.g. 'urn:schemas-upnp-org:service:AVTransport:1#'
+        """
+        self._location = location
+        self._action = action
+
+    async def call(self, method, **arguments):
+        """Call the action and return its out arguments as dict; raises SoapFault on errors
+
+        The request has to finish within the current deadline (see raumfeld.deadline)
+        """
+        body = _SOAP_REQUEST.format(
+            ns=_SOAP_ENVELOPE_NS, method=method,
+            arguments=''.join('<s:{0}>{1}</s:{0}>'.format(name, escape(str(value)))
+                              for name, value in arguments.items()))
+        _, _, content = await getConnectionPool().request(
+            self._location, 'POST', body,
+            {'Content-Type': 'text/xml; charset="UTF-8"', 'SOAPAction': self._action + method},
+            remaining())
+
+        body_element = ElementTree.fromstring(content).find('{%s}Body' % _SOAP_ENVELOPE_NS)
+        response = body_element[0] if body_element is not None and len(body_element) else None
+        if response is None:
+            raise SoapFault('Client', 'Empty response to {0}'.format(method))
+        values = {child.tag.rpartition('}')[2]: child.text or '' for child in response}
+        if response.tag.rpartition('}')[2] == 'Fault':
+            raise SoapFault(values.get('faultcode', ''), values.get('faultstring', ''),
+                            ElementTree.tostring(response, encoding='unicode'))
+        return values
+
+
+class DeviceService(object):
+    """SoapService of a device whose control URL is taken from the device description
+
+    The default path is used if the description does not list the service. If the description
+    can not be fetched, it is used for this call only and the description is asked for again.
+    """
+
+    def __init__(self, location, name, action, default_path):
+        """
+        :param location: URL of the device description
+        :param name: name of the service type, e.g. AVTransport
+        :param action: SOAPAction prefix, e.g. 'urn:schemas-upnp-org:service:AVTransport:1#'
+        :param default_path: control path of the service if the description does not list it
+        """
+        self._location = location
+        self._name = name
+        self._action = action
+        self._defaultPath = default_path
+        self._service = None
+
+    async def call(self, method, **arguments):
+        """Call the action and return its out arguments as dict; raises SoapFault on errors"""
+        service = self._service
+        if service is None:
+            try:
+                device_description = await getDescriptionCache().get(self._location)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                logging.info("Device description {0} not available: {1}".format(self._location,
+                                                                                e))
+                device_description = None
+            service = self._createService(device_description)
+            if device_description is not None:
+                self._service = service
+        return await service.call(method, **arguments)
+
+    def _createService(self, device_description):
+        service = device_description.getService(self._name) if device_description else None
+        if service is not None and service.control_url:
+            return SoapService(service.control_url, self._action)
+        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(self._location)
+        return SoapService('{0}://{1}{2}'.format(scheme, netloc, self._defaultPath), self._action)
+
+
+class MediaServer(object):
+    """Raumfeld MediaServer"""
+
+    def __init__(self, udn, location):
+        self._udn = udn
+        self._location = location
+        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
+        self._address = '{0}://{1}'.format(scheme, netloc)
+        self._contentDirectory = DeviceService(
+            location, 'ContentDirectory', 'urn:schemas-upnp-org:service:ContentDirectory:1#',
+            '/cd/Control')
+
+    @property
+    def UDN(self):
+        """Get the UDN of the MediaServer"""
+        return self._udn
+
+    @property
+    def Location(self):
+        """Get the location URI"""
+        return self._location
+
+    async def system_update_id(self):
+        """Get the SystemUpdateID, which changes with every change of the content"""
+        return (await self._contentDirectory.call('GetSystemUpdateID'))['Id']
+
+    # Browse and Search
+    async def browse(self, object_id, browse_flag="BrowseMetadata", filter="*", request_count="25",
+                     starting_index="0"):
+        """Browse Media Server; the Result is served from the ContentDirectoryCache if possible"""
+        return (await self.__cachedBrowse(object_id, browse_flag, filter, starting_index,
+                                          request_count))[0]
+
+    async def browse_children(self, object_id, filter="*", request_count="25",
+                              starting_index="0"):
+        """Convenience function for browsing child elements; returns Result and NumberReturned"""
+        return await self.__cachedBrowse(object_id, "BrowseDirectChildren", filter,
+                                         starting_index, request_count)
+
+    async def __cachedBrowse(self, object_id, browse_flag, filter, starting_index, request_count):
+        """Returns the tuple (Result, NumberReturned) of a Browse request"""
+        cache = getContentDirectoryCache()
+        if cache.systemUpdateCheckDue():
+            cache.systemUpdated(await self.system_update_id())
+        key = (object_id, self._udn, browse_flag, filter, str(starting_index), str(request_count))
+        value = cache.get(key)
+        if value is None:
+            response = await self._contentDirectory.call(
+                'Browse', ObjectID=object_id, BrowseFlag=browse_flag, Filter=filter,
+                StartingIndex=starting_index, RequestedCount=request_count, SortCriteria="")
+            value = (response['Result'], response['NumberReturned'])
+            cache.put(key, value, response.get('UpdateID'))
+        return value
+
+    async def search(self, container_id, search_criteria, filter="*", request_count="25",
+                     starting_index="0"):
+        """Search Media Server"""
+        response = await self._contentDirectory.call(
+            'Search', ContainerID=container_id, SearchCriteria=search_criteria, Filter=filter,
+            StartingIndex=starting_index, RequestedCount=request_count, SortCriteria="")
+        return response['Result']
+
+    def iter_children(self, object_id, page_size=100, filter="*", sort_criteria=""):
+        """Async generator over the DIDL objects of a container, fetched page by page"""
+        def fetchPage(starting_index):
+            return self._contentDirectory.call(
+                'Browse', ObjectID=object_id, BrowseFlag="BrowseDirectChildren", Filter=filter,
+                StartingIndex=starting_index, RequestedCount=page_size,
+                SortCriteria=sort_criteria)
+        return self.__iterPages(fetchPage, page_size)
+
+    def iter_search(self, container_id, search_criteria, page_size=100, filter="*",
+                    sort_criteria=""):
+        """Async generator over the DIDL objects matching the search criteria, fetched page by page"""
+        def fetchPage(starting_index):
+            return self._contentDirectory.call(
+                'Search', ContainerID=container_id, SearchCriteria=search_criteria,
+                Filter=filter, StartingIndex=starting_index, RequestedCount=page_size,
+                SortCriteria=sort_criteria)
+        return self.__iterPages(fetchPage, page_size)
+
+    async def __iterPages(self, fetchPage, page_size):
+        """Yield the DIDL objects of all pages while the following page is prefetched"""
+        index = 0
+        task = asyncio.ensure_future(fetchPage(index))
+        try:
+            while task is not None:
+                response = await task
+                task = None
+                index = _nextPageIndex(index, int(response['NumberReturned']),
+                                       int(response['TotalMatches']), page_size)
+                if index is not None:
+                    task = asyncio.ensure_future(fetchPage(index))
+                for didl_object in _parseDidlObjects(response.pop('Result')):
+                    yield didl_object
+        finally:
+            if task is not None:
+                task.cancel()
+
+    # Queue Operations
+    async def create_queue(self, desired_name, container_id):
+        """CreateQueue Returns GivenName and QueueID"""
+        return await self._contentDirectory.call('CreateQueue', DesiredName=desired_name,
+                                                 ContainerID=container_id)
+
+    async def add_container(self, queue_id, container_id, source_id="", criteria="",
+                            start_index="0", end_index="0", position="0"):
+        """AddContainerToQueue"""
+        await self._contentDirectory.call('AddContainerToQueue', QueueID=queue_id,
+                                          ContainerID=container_id, SourceID=source_id,
+                                          SearchCriteria=criteria, StartIndex=start_index,
+                                          EndIndex=end_index, Position=position)
+
+    async def add_item(self, queue_id, object_id, position):
+        """AddItemToQueue"""
+        await self._contentDirectory.call('AddItemToQueue', QueueID=queue_id,
+                                          ObjectID=object_id, Position=position)
+
+    async def move_in_queue(self, object_id, new_position):
+        """MoveInQueue"""
+        await self._contentDirectory.call('MoveInQueue', ObjectID=object_id,
+                                          NewPosition=new_position)
+
+    async def remove_from_queue(self, queue_id, from_position, to_position):
+        """RemoveFromQueue"""
+        await self._contentDirectory.call('RemoveFromQueue', QueueID=queue_id,
+                                          FromPosition=from_position, ToPosition=to_position)
+
+
+class Renderer(object):
+    """Raumfeld Renderer"""
+
+    # Control paths used if the device description does not list the services
+    _renderingControlPath = '/RenderingControl/ctrl'
+    _avTransportPath = '/AVTransport/ctrl'
+
+    def __init__(self, name, udn, location):
+        self._location = None
+        self.reinit(name, udn, location)
+
+    def reinit(self, name, udn, location):
+        self._name = name
+        self._udn = udn
+        if location != self._location:
+            self._location = location
+            scheme, netloc, _, _, _, _ = urllib.parse.urlparse(location)
+            self._address = '{0}://{1}'.format(scheme, netloc)
+            # The control URLs are taken from the device description with the first call
+            self._renderingControl = DeviceService(
+                location, 'RenderingControl', 'urn:upnp-org:serviceId:RenderingControl#',
+                self._renderingControlPath)
+            self._avTransport = DeviceService(
+                location, 'AVTransport', 'urn:schemas-upnp-org:service:AVTransport:1#',
+                self._avTransportPath)
+
+    def _inherit(self, previous):
+        """Take over the SOAP services of the object this one replaces in a new TopologySnapshot"""
+        if previous._location == self._location:
+            self._renderingControl = previous._renderingControl
+            self._avTransport = previous._avTransport
+
+    @property
+    def Name(self):
+        """Get the name of the renderer"""
+        return self._name
+
+    @property
+    def UDN(self):
+        """Get the UDN of the renderer"""
+        return self._udn
+
+    @property
+    def Location(self):
+        """Get the location URI"""
+        return self._location
+
+    @property
+    def Address(self):
+        """Get the network address"""
+        return self._address
+
+    async def play(self, uri=None, meta=""):
+        """Start playing
+        :param uri: (optional) play a specific uri
+        :param meta: (optional) meta data in DIDL-Lite format
+        """
+        if uri:
+            await self._avTransport.call('SetAVTransportURI', InstanceID=0, CurrentURI=uri,
+                                         CurrentURIMetaData=meta)
+        else:
+            await self._avTransport.call('Play', InstanceID=1, Speed=2)
+
+    async def next(self):
+        """Next"""
+        await self._avTransport.call('Next', InstanceID=1)
+
+    async def previous(self):
+        """Previous"""
+        await self._avTransport.call('Previous', InstanceID=1)
+
+    async def pause(self):
+        """Pause"""
+        await self._avTransport.call('Pause', InstanceID=1)
+
+    async def seek(self, target, unit='ABS_TIME'):
+        """Seek; unit = _ABS_TIME_/REL_TIME/TRACK_NR"""
+        return await self._avTransport.call('Seek', InstanceID=1, Unit=unit, Target=target)
+
+    async def stop(self):
+        """Stop"""
+        await self._avTransport.call('Stop', InstanceID=1)
+
+    async def volume(self):
+        """get the current volume"""
+        response = await self._renderingControl.call('GetVolume', InstanceID=1)
+        return int(response['CurrentVolume'])
+
+    async def setVolume(self, value):
+        """set the current volume"""
+        await self._renderingControl.call('SetVolume', InstanceID=1, DesiredVolume=value)
+
+    async def changeVolume(self, value):
+        await self._renderingControl.call('ChangeVolume', InstanceID=1, Amount=value)
+
+    async def mute(self):
+        """get the current mute state"""
+        response = await self._renderingControl.call('GetMute', InstanceID=1, Channel=1)
+        return int(response['CurrentMute']) == 1
+
+    async def setMute(self, value):
+        """set the current mute state"""
+        await self._renderingControl.call('SetMute', InstanceID=1, DesiredMute=1 if value else 0,
+                                          Channel=1)
+
+    async def media_info(self):
+        """Get the media information"""
+        info = await self._avTransport.call('GetMediaInfo', InstanceID=1)
+        return {key: info.get(key) for key in ('NrTracks', 'MediaDuration', 'CurrentURI',
+                                               'CurrentURIMetaData', 'NextUri', 'NextUriMetaData',
+                                               'PlayMedium', 'RecordMedium', 'WriteStatus')}
+
+    async def position_info(self):
+        """Get the position information"""
+        info = await self._avTransport.call('GetPositionInfo', InstanceID=1)
+        return {key: info.get(key) for key in ('Track', 'TrackDuration', 'TrackMetaData',
+                                               'TrackURI', 'RelTime', 'AbsTime', 'RelCount',
+                                               'AbsCount')}
+
+    async def transport_info(self):
+        """Get the transport information"""
+        info = await self._avTransport.call('GetTransportInfo', InstanceID=1)
+        return {key: info.get(key) for key in ('CurrentTransportState', 'CurrentTransportStatus',
+                                               'CurrentSpeed')}
+
+    async def current_media(self):
+        """DIDL object of the CurrentURIMetaData or None"""
+        return parseDidlObject((await self.media_info()).get('CurrentURIMetaData'))
+
+    async def current_track(self):
+        """DIDL object of the TrackMetaData or None"""
+        return parseDidlObject((await self.position_info()).get('TrackMetaData'))
+
+    async def status(self):
+        """Fetch transport, position and media info, volume and mute concurrently
+
+        Returns one immutable RendererStatus
+        """
+        transport_info, position_info, media_info, volume, mute = await asyncio.gather(
+            self.transport_info(), self.position_info(), self.media_info(), self.volume(),
+            self.mute())
+        return RendererStatus(MappingProxyType(transport_info), MappingProxyType(position_info),
+                              MappingProxyType(media_info), volume, mute, time.time())
+
+
+class Zone(Renderer):
+    """Raumfeld Zone"""
+
+    _renderingControlPath = '/RenderingService/Control'
+    _avTransportPath = '/TransportService/Control'
+
+    def __init__(self, name, udn, location):
+        self._rooms = ()
+        self._roomsByUDN = {}
+        Renderer.__init__(self, name, udn, location)
+
+    def _setRooms(self, rooms):
+        """Set the rooms of a new zone, before it is published in a TopologySnapshot"""
+        self._roomsByUDN = {room.UDN: room for room in rooms}
+        self._rooms = tuple(rooms)
+
+    def getRoomByUDN(self, udn):
+        """Try to get the room of the zone by its UDN"""
+        return self._roomsByUDN.get(udn)
+
+    def getRooms(self):
+        """Returns the tuple of rooms in this zone"""
+        return self._rooms
+
+    def getRoomsByName(self, name):
+        """Searches for rooms with a special name"""
+        return NameIndex(self._rooms).find(name)
+
+    async def bend(self, uri=None, meta=None):
+        """BendAVTransportURI"""
+        await self._avTransport.call('BendAVTransportURI', InstanceID=0, CurrentURI=uri,
+                                     CurrentURIMetaData=meta)
+
+
+class Room(object):
+    """Raumfeld Room"""
+
+    def __init__(self, name, udn):
+        self._renderers = ()
+        self._renderersByUDN = {}
+        self._udn = udn
+        self._name = name
+
+    def _setRenderers(self, renderers):
+        """Set the renderers of a new room, before it is published in a TopologySnapshot"""
+        self._renderersByUDN = {renderer.UDN: renderer for renderer in renderers}
+        self._renderers = tuple(renderers)
+
+    def getRenderer(self, udn):
+        """Try to get the renderer of the room by its UDN"""
+        return self._renderersByUDN.get(udn)
+
+    def getRenderers(self):
+        """Returns the tuple of renderers in this room"""
+        return self._renderers
+
+    @property
+    def Name(self):
+        """Get the name of the device"""
+        return self._name
+
+    @property
+    def UDN(self):
+        """Get the UDN of the device"""
+        return self._udn
+
+    async def play(self, uri=None, meta=""):
+        """Start playing
+        :param uri: (optional) play a specific uri
+        :param meta: (optional) meta data in DIDL-Lite format
+        """
+        await self._renderers[0].play(uri, meta)
+
+    async def next(self):
+        """Next"""
+        await self._renderers[0].next()
+
+    async def previous(self):
+        """Previous"""
+        await self._renderers[0].previous()
+
+    async def pause(self):
+        """Pause"""
+        await self._renderers[0].pause()
+
+    async def seek(self, target, unit='ABS_TIME'):
+        """Seek; unit = _ABS_TIME_/REL_TIME/TRACK_NR"""
+        return await self._renderers[0].seek(target, unit)
+
+    async def stop(self):
+        """Stop"""
+        await self._renderers[0].stop()
+
+    async def volume(self):
+        """get the current volume"""
+        return await self._renderers[0].volume()
+
+    async def setVolume(self, value):
+        """set the current volume"""
+        await self._renderers[0].setVolume(value)
+
+    async def changeVolume(self, value):
+        await self._renderers[0].changeVolume(value)
+
+    async def mute(self):
+        """get the current mute state"""
+        return await self._renderers[0].mute()
+
+    async def setMute(self, value):
+        """set the current mute state"""
+        await self._renderers[0].setMute(value)
+
+    async def status(self):
+        """Returns the RendererStatus of the renderer of the room"""
+        return await self._renderers[0].status()
+
+
+class RaumfeldHost(object):
+    """Long-polls the topology of one Raumfeld host and keeps its TopologySnapshot up to date"""
+
+    def __init__(self, hostIPAddress="", port=47365):
+        """
+        :param hostIPAddress: IP address of the host, start() discovers it if none is provided
+        """
+        self._hostIPAddress = hostIPAddress
+        self._port = port
+        self.hostBaseURL = 'http://{0}:{1}'.format(hostIPAddress or 'hostip', port)
+        self._sessionUUID = uuid4().hex
+        self._topology = EMPTY_SNAPSHOT
+        self._nameIndexes = (EMPTY_SNAPSHOT, NameIndex(()), NameIndex(()))  # snapshot, zones, rooms
+        self._zoneRecords = None
+        self._unassignedRecords = ()
+        self._deviceRecordsByUDN = None
+        self._mediaServer = None
+        self._queues = set()
+        self._tasks = []
+        self._closed = False
+        self._ready = None
+        self._disconnected = None
+        self._reconnectPolicy = ReconnectPolicy()  # delays after failed long-polls
+        self._hostHealth = HostHealth(on_change=self._onHealthChange)
+
+    async def start(self, timeout=None):
+        """Start the long-polls and return when the first complete topology is available
+
+        Raises ConnectionError if no host address was given and no host answers, or if the host
+        counts as disconnected before it delivered the topology; asyncio.TimeoutError if it was
+        not delivered within timeout seconds. The long-polls are stopped in both cases.
+        """
+        if self._hostIPAddress == "":
+            self._hostIPAddress = await discoverHostAsync()
+            if self._hostIPAddress == "":
+                raise ConnectionError("Cannot determine host IP Address.")
+            self.hostBaseURL = 'http://{0}:{1}'.format(self._hostIPAddress, self._port)
+        self._closed = False
+        self._ready = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._poll('listDevices', self._onDevices)),
+                       asyncio.ensure_future(self._poll('getZones', self._onZones))]
+        waiters = [asyncio.ensure_future(self._ready.wait()),
+                   asyncio.ensure_future(self._disconnected.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        if self._ready.is_set():
+            return
+        await self.close()
+        if self._disconnected.is_set():
+            raise ConnectionError("The host {0} does not answer".format(self.hostBaseURL))
+        raise asyncio.TimeoutError("The host {0} did not deliver the topology within {1} "
+                                   "seconds".format(self.hostBaseURL, timeout))
+
+    async def close(self):
+        """Stop the long-polls"""
+        # The polls also check the flag: wait_for may swallow a cancellation which coincides
+        # with a failed request, which _poll would retry
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def configureReconnect(self, initialDelay=None, maxDelay=None, factor=None, jitter=None,
+                           failureThreshold=None):
+        """Configures the backoff of the long-polls like RaumfeldSystem.configureReconnect"""
+        self._reconnectPolicy.configure(initialDelay, maxDelay, factor, jitter)
+        if failureThreshold is not None:
+            self._hostHealth.failure_threshold = failureThreshold
+
+    def getHostHealth(self):
+        """Returns the state of the connection to the host: CONNECTED, DEGRADED or DISCONNECTED"""
+        return self._hostHealth.state
+
+    def _onHealthChange(self, state):
+        if state == DISCONNECTED and self._disconnected is not None:
+            self._disconnected.set()
+
+    async def _poll(self, service, handler):
+        """Long-poll the Web-Service of the host and pass each response to the handler
+
+        Failed requests are retried with the jittered exponential backoff of the ReconnectPolicy;
+        while the host counts as disconnected only one of the polls probes it
+        """
+        url = '{0}/{1}/{2}'.format(self.hostBaseURL, self._sessionUUID, service)
+        update_id = ''
+        while not self._closed:
+            if not self._hostHealth.mayRequest(service):
+                await asyncio.sleep(self._reconnectPolicy.initial_delay)
+                continue
+            try:
+                # Updating the data at least every 15minutes
+                status, headers, content = await getConnectionPool().request(
+                    url, headers={'updateID': update_id}, timeout=900)
+                if status >= 300:
+                    raise ConnectionError("HTTP status {0}".format(status))
+                update_id = headers.get('updateid', '')
+                try:
+                    handler(content)
+                except (ValueError, ElementTree.ParseError):
+                    raise  # an invalid response counts as a failure of the host
+                except Exception:
+                    # A bug in the handler must not end the poll, the next change is handled
+                    logging.exception("Handling the {0} response failed".format(service))
+                self._hostHealth.success(service)
+                continue
+            except asyncio.TimeoutError:
+                logging.info("Updating {0}...".format(service))
+                update_id = ''
+                continue
+            except (OSError, ValueError, asyncio.IncompleteReadError,
+                    ElementTree.ParseError) as e:
+                error = e
+            if self._closed:
+                break
+            self._hostHealth.failure(service)
+            # Without updateID the host answers at once, so the reconnect is noticed immediately
+            update_id = ''
+            delay = self._reconnectPolicy.delay(self._hostHealth.failures(service))
+            logging.debug("{0} failed: {1}; retrying in {2:.1f} seconds".format(service, error,
+                                                                               delay))
+            await asyncio.sleep(delay)
+
+    def _onDevices(self, content):
+        device_records = parseDevices(io.BytesIO(content))
+        self._deviceRecordsByUDN = {device.udn: device for device in device_records}
+        for device in device_records:
+            if device.name == "Raumfeld MediaServer":
+                if self._mediaServer is None or self._mediaServer.Location != device.location:
+                    self._mediaServer = MediaServer(device.udn, device.location)
+                break
+        self._reconcile()
+
+    def _onZones(self, content):
+        self._zoneRecords, self._unassignedRecords = parseZones(io.BytesIO(content))
+        self._reconcile()
+
+    def _reconcile(self):
+        """Apply the changes of the topology and notify the change iterators"""
+        if self._zoneRecords is None or self._deviceRecordsByUDN is None:
+            return
+        state = buildTopologyState(self._zoneRecords, self._unassignedRecords,
+                                   self._deviceRecordsByUDN)
+        old_state = self._topology.state
+        diff = diffTopology(old_state, state)
+        if state != self._topology.state:
+            self._topology = applyTopologyDiff(self._topology, state, diff, Zone, Room, Renderer)
+            self._getNameIndexes()
+        logging.debug("Unresolved devices: " + str(state.unresolved))
+        if diff:
+            for queue in self._queues:
+                if queue.full():
+                    # The iterator fell behind: merge its pending changes and this one
+                    pending_state = queue.get_nowait()[0]
+                    while not queue.empty():
+                        queue.get_nowait()
+                    merged = diffTopology(pending_state, state)
+                    if merged:
+                        queue.put_nowait((pending_state, merged))
+                else:
+                    queue.put_nowait((old_state, diff))
+        self._ready.set()
+
+    async def changes(self, maxPending=64):
+        """Async iterator over the TopologyDiffs of all following changes of the topology
+
+        If more than maxPending changes were not consumed yet, they are merged into one diff
+        """
+        # (state before the change, TopologyDiff)
+        queue = asyncio.Queue(maxPending)
+        self._queues.add(queue)
+        try:
+            while True:
+                yield (await queue.get())[1]
+        finally:
+            self._queues.discard(queue)
+
+    # Lookups on the current snapshot
+    def getTopology(self):
+        """Returns the current TopologySnapshot"""
+        return self._topology
+
+    def getZones(self):
+        """get all discovered zones"""
+        return self._topology.zones
+
+    def getUnassignedRooms(self):
+        """get all unassigned rooms"""
+        return self._topology.unassigned_rooms
+
+    def getZoneByUDN(self, udn):
+        """Searches for the zone with a given UDN"""
+        return self._topology.zones_by_udn.get(udn)
+
+    def _getNameIndexes(self):
+        """Returns the NameIndexes of the zones and rooms of the current topology"""
+        topology = self._topology
+        snapshot, zones, rooms = self._nameIndexes
+        if snapshot is not topology:
+            zones, rooms = NameIndex(topology.zones), NameIndex(_iterRooms(topology))
+            self._nameIndexes = (topology, zones, rooms)
+        return zones, rooms
+
+    def getZonesByName(self, name):
+        """Searches for zones whose name contains name, best matches first"""
+        return self._getNameIndexes()[0].find(name)
+
+    def getZoneByName(self, name):
+        """Returns the zone matching name best (exact, then prefix, then substring) or None"""
+        return self._getNameIndexes()[0].findFirst(name)
+
+    def getRoomByUDN(self, udn):
+        """Searches for a room with a given UDN"""
+        return self._topology.rooms_by_udn.get(udn)
+
+    def getRoomsByName(self, name):
+        """Searches for rooms whose name contains name, best matches first"""
+        return self._getNameIndexes()[1].find(name)
+
+    def getRoomByName(self, name):
+        """Returns the room matching name best (exact, then prefix, then substring) or None"""
+        return self._getNameIndexes()[1].findFirst(name)
+
+    def getZoneWithRoomUDN(self, udn):
+        """Returns the zone containing a room defined by its UDN"""
+        return self._topology.zone_by_room_udn.get(udn)
+
+    def getMediaServer(self):
+        """Returns the Raumfeld Media Server"""
+        return self._mediaServer
+
+    # Zone configuration
+    async def dropRoomByUDN(self, udn):
+        """Drops the room with the given UDN from the zone it is in"""
+        await getConnectionPool().request(
+            '{0}/dropRoomJob?roomUDN={1}'.format(self.hostBaseURL, udn), timeout=remaining())
+
+    async def connectRoomToZone(self, roomUDN, zoneUDN=''):
+        """Puts the room with the given roomUDN in the zone with the zoneUDN"""
+        await getConnectionPool().request('{0}/connectRoomToZone?roomUDN={1}&zoneUDN={2}'.format(
+            self.hostBaseURL, roomUDN, zoneUDN), timeout=remaining())
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned feed of the topology changes
+
+Every change of the topology gets the version of the TopologySnapshot it
+produced, and the latest diffs are kept in a bounded log. A client remembers
+the last version it has seen and asks for everything after it, so no change is
+missed between two requests. Clients outside the process get cursors
+"<epoch>:<version>": the epoch is random per feed, so a cursor from before a
+restart is recognized instead of being mistaken for a version of the new feed.
+Waiting for a new version blocks a thread with wait() or, with waitAsync(),
+only parks a future on the caller's event loop, so any number of long-polls
+and event streams can wait without a thread each.
+"""
+
+import asyncio
+import threading
+import uuid
+from collections import deque
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ChangeFeed(object):
+    """Log of the last (version, TopologyDiff) changes with waiting for newer versions"""
+
+    def __init__(self, maxlen=256):
+        """
+        :param maxlen: number of changes kept; older versions can only be resynchronized
+        """
+        self._changes = deque(maxlen=maxlen)  # (version, TopologyDiff)
+        self._version = 0
+        self._epoch = uuid.uuid4().hex[:8]
+        self._condition = threading.Condition()
+        self._waiters = set()  # (event loop, future) of the waitAsync calls
+
+    @property
+    def version(self):
+        """Version of the latest change, 0 before the first one"""
+        return self._version
+
+    @property
+    def epoch(self):
+        """Random id of this feed which distinguishes its cursors from those of other processes"""
+        return self._epoch
+
+    def cursor(self, version=None):
+        """Returns the cursor "<epoch>:<version>" of the version, by default the current one"""
+        return '{0}:{1}'.format(self._epoch, self._version if version is None else version)
+
+    def versionOf(self, cursor):
+        """Returns the version of a cursor or None if it has another epoch (e.g. before a restart)
+
+        Raises ValueError if cursor is no cursor
+        """
+        epoch, separator, version = cursor.partition(':')
+        if not separator or not version.isdecimal():
+            raise ValueError("Invalid cursor: {0}".format(cursor))
+        return int(version) if epoch == self._epoch else None
+
+    def publish(self, version, diff):
+        """Append the change which produced the given version and wake all waiters"""
+        with self._condition:
+            self._version = version
+            self._changes.append((version, diff))
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def changesSince(self, since):
+        """Returns the tuple (version, changes) with the list of (version, TopologyDiff) after since
+
+        changes is None if the changes after since are no longer kept or since is unknown (e.g.
+        None for a cursor from before a restart): the client has to read the whole topology again.
+        """
+        with self._condition:
+            version = self._version
+            if since is None:
+                return version, None
+            if since == version:
+                return version, []
+            if since > version or not self._changes or self._changes[0][0] > since + 1:
+                return version, None
+            return version, [change for change in self._changes if change[0] > since]
+
+    def wait(self, since, timeout=None):
+        """Block until the version differs from since; returns the current version"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != since, timeout)
+            return self._version
+
+    async def waitAsync(self, since, timeout=None):
+        """Coroutine variant of wait, no thread is blocked while waiting"""
+        with self._condition:
+            if self._version != since:
+                return self._version
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                self._waiters.discard(waiter)
+        return self._version
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent HTTP/1.1 keep-alive connections shared by all SOAP clients
+
+Every Renderer, Zone and MediaServer talks to its device through the same
+ConnectionPool, so repeated control calls to one host reuse an already
+established TCP connection instead of opening a new one per request.
+"""
+
+import http.client
+import select
+import threading
+import time
+import urllib.parse
+from collections import deque
+
+from .deadline import remaining
+
+# Errors which indicate that a reused keep-alive connection was closed by the device
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                            ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+# Methods which can be sent again if it is unknown whether the device received them. SOAP actions
+# are POSTs and may change the state, e.g. SetVolume or Next, so they must not run twice
+_IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+def _isDropped(connection):
+    """Whether an idle connection was closed by the device: its socket is readable (EOF)"""
+    if connection.sock is None:
+        return False
+    try:
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(connection.sock, select.POLLIN)
+            return bool(poller.poll(0))
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class ConnectionPool(object):
+    """Pool of idle keep-alive connections, kept separately for every host"""
+
+    def __init__(self, maxsize=4, idle_timeout=30.0, timeout=60):
+        """
+        :param maxsize: number of idle connections kept per host
+        :param idle_timeout: seconds after which an idle connection is discarded
+        :param timeout: socket timeout of the connections in seconds
+        """
+        self._maxsize = maxsize
+        self._idleTimeout = idle_timeout
+        self._timeout = timeout
+        self._idle = {}  # (scheme, netloc) -> deque of (connection, last_used)
+        self._lock = threading.Lock()
+        self._reused = 0
+        self._created = 0
+
+    def configure(self, maxsize=None, idle_timeout=None):
+        """Change the pool size and/or the idle timeout; surplus idle connections are closed"""
+        with self._lock:
+            if maxsize is not None:
+                self._maxsize = maxsize
+            if idle_timeout is not None:
+                self._idleTimeout = idle_timeout
+            for connections in self._idle.values():
+                while len(connections) > self._maxsize:
+                    connections.popleft()[0].close()
+
+    @property
+    def stats(self):
+        """Returns a dict with the number of reused, created and currently idle connections"""
+        with self._lock:
+            return {'reused': self._reused,
+                    'created': self._created,
+                    'idle': sum(len(connections) for connections in self._idle.values())}
+
+    def clear(self):
+        """Close all idle connections"""
+        with self._lock:
+            for connections in self._idle.values():
+                for connection, _ in connections:
+                    connection.close()
+            self._idle.clear()
+
+    def request(self, url, method='GET', body=None, headers=None, timeout=None):
+        """Send a request and return the tuple (status, headers, content)
+
+        :param timeout: socket timeout of this request, the timeout of the pool by default
+        """
+        scheme, netloc, path, _, query, _ = urllib.parse.urlparse(url)
+        if query:
+            path = '{0}?{1}'.format(path, query)
+        key = (scheme, netloc)
+
+        if timeout is None:
+            timeout = self._timeout
+        connection, reused = self._acquire(key)
+        sent = False
+        try:
+            self._send(connection, method, path or '/', body, headers or {}, timeout)
+            sent = True
+            response = self._receive(connection)
+        except _STALE_CONNECTION_ERRORS:
+            connection.close()
+            # The device closed the idle connection in the meantime: retry once with a new one,
+            # unless the device may have received a request which must not run twice
+            if not reused or (sent and method not in _IDEMPOTENT_METHODS):
+                raise
+            connection, reused = self._newConnection(key), False
+            try:
+                self._send(connection, method, path or '/', body, headers or {}, timeout)
+                response = self._receive(connection)
+            except:
+                connection.close()
+                raise
+        except:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        return response.status, response.headers, response.content
+
+    def _send(self, connection, method, path, body, headers, timeout):
+        # Applies to the connect of a new connection and to the socket of a reused one
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        connection.request(method, path, body=body, headers=headers)
+
+    def _receive(self, connection):
+        response = connection.getresponse()
+        # Read the complete body, otherwise the connection can not be reused
+        response.content = response.read()
+        return response
+
+    def _acquire(self, key):
+        """Returns the tuple (connection, reused)"""
+        now = time.monotonic()
+        with self._lock:
+            connections = self._idle.get(key)
+            while connections:
+                connection, last_used = connections.pop()
+                # Most closed connections are detected here, before a request is sent on them
+                if now - last_used < self._idleTimeout and not _isDropped(connection):
+                    self._reused += 1
+                    return connection, True
+                connection.close()
+        return self._newConnection(key), False
+
+    def _newConnection(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(netloc, timeout=self._timeout)
+        else:
+            connection = http.client.HTTPConnection(netloc, timeout=self._timeout)
+        with self._lock:
+            self._created += 1
+        return connection
+
+    def _release(self, key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(key, deque())
+            if len(connections) < self._maxsize:
+                connections.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+
+class SoapTransport(object):
+    """Transport for pysimplesoap's SoapClient which sends all requests through a ConnectionPool
+
+    The socket timeout of every request is the time left until the current deadline
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def request(self, url, method='GET', body=None, headers=None):
+        # pysimplesoap computes Content-length from the unencoded body, so set it here again
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        request_headers = {key: value for key, value in (headers or {}).items()
+                           if key.lower() != 'content-length'}
+        if body is not None:
+            request_headers['Content-Length'] = str(len(body))
+        _, response_headers, content = self._pool.request(url, method, body, request_headers,
+                                                          remaining())
+        return response_headers, content
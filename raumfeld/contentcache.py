@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Cache for the results of ContentDirectory Browse requests
+
+The UI browses the same containers (favourites, radio lists, playlists) over
+and over, so their results are kept in a LRU cache with a time to live and a
+memory cap. An entry is dropped as soon as the UpdateID of its container or the
+SystemUpdateID of the MediaServer is seen to change.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class ContentDirectoryCache(object):
+    """LRU cache with TTL and memory cap for Browse results, invalidated by UpdateIDs"""
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, ttl=60.0, system_update_interval=5.0):
+        """
+        :param max_bytes: approximate memory used by all cached results
+        :param ttl: seconds after which an entry expires
+        :param system_update_interval: seconds after which the SystemUpdateID should be checked again
+        """
+        self._maxBytes = max_bytes
+        self._ttl = ttl
+        self._systemUpdateInterval = system_update_interval
+        self._entries = OrderedDict()  # key -> (value, size, update_id, expires)
+        self._keysByContainer = {}  # container ID (key[0]) -> set of keys
+        self._size = 0
+        self._systemUpdateID = None
+        self._systemUpdateChecked = None
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def configure(self, max_bytes=None, ttl=None, system_update_interval=None):
+        """Change the memory cap, the time to live and/or the SystemUpdateID check interval"""
+        with self._lock:
+            if max_bytes is not None:
+                self._maxBytes = max_bytes
+            if ttl is not None:
+                self._ttl = ttl
+            if system_update_interval is not None:
+                self._systemUpdateInterval = system_update_interval
+            self._shrink()
+
+    @property
+    def stats(self):
+        """Returns a dict with hits, misses, evictions, invalidations, entries and size in bytes"""
+        with self._lock:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'evictions': self._evictions,
+                    'invalidations': self._invalidations,
+                    'entries': len(self._entries),
+                    'size': self._size}
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._keysByContainer.clear()
+            self._size = 0
+            self._systemUpdateID = None
+            self._systemUpdateChecked = None
+
+    def get(self, key):
+        """Returns the cached value or None; the first element of the key is the container ID"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, update_id=None):
+        """Store the value; a new UpdateID of the container invalidates its other entries"""
+        size = sys.getsizeof(value) if not isinstance(value, tuple) else \
+            sum(sys.getsizeof(item) for item in value)
+        with self._lock:
+            if update_id is not None:
+                self._containerUpdated(key[0], update_id)
+            if key in self._entries:
+                self._remove(key)
+            if size > self._maxBytes:
+                return
+            self._entries[key] = (value, size, update_id, time.monotonic() + self._ttl)
+            self._keysByContainer.setdefault(key[0], set()).add(key)
+            self._size += size
+            self._shrink()
+
+    def containerUpdated(self, container_id, update_id):
+        """Drop the entries of the container if they were stored with another UpdateID"""
+        with self._lock:
+            self._containerUpdated(container_id, update_id)
+
+    def systemUpdateCheckDue(self):
+        """True if the SystemUpdateID was not checked within the configured interval"""
+        checked = self._systemUpdateChecked
+        return checked is None or time.monotonic() - checked >= self._systemUpdateInterval
+
+    def systemUpdated(self, system_update_id):
+        """Drop all entries if the SystemUpdateID of the MediaServer changed"""
+        with self._lock:
+            self._systemUpdateChecked = time.monotonic()
+            if system_update_id == self._systemUpdateID:
+                return
+            if self._systemUpdateID is not None:
+                self._invalidations += len(self._entries)
+                self._entries.clear()
+                self._keysByContainer.clear()
+                self._size = 0
+            self._systemUpdateID = system_update_id
+
+    def _containerUpdated(self, container_id, update_id):
+        for key in list(self._keysByContainer.get(container_id, ())):
+            if self._entries[key][2] != update_id:
+                self._remove(key)
+                self._invalidations += 1
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._size -= size
+        keys = self._keysByContainer[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keysByContainer[key[0]]
+
+    def _shrink(self):
+        while self._size > self._maxBytes:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
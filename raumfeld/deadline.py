@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Deadlines and cancellation for the network operations of the library
+
+Every request to a device asks remaining() how long it may take: the time
+left until the deadline of the enclosing deadline() scope, or the library wide
+default timeout. Scopes are kept in a context variable, so they apply to the
+current thread or asyncio task and are handed on to the worker threads of
+status() and the bulk operations. No global socket state is touched.
+"""
+
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+__all__ = ['CancelledError', 'Cancellation', 'deadline', 'getDefaultTimeout', 'remaining',
+           'runInContext', 'setDefaultTimeout', 'withTimeout']
+
+_deadline = contextvars.ContextVar('raumfeld_deadline', default=None)  # time.monotonic() value
+_cancellation = contextvars.ContextVar('raumfeld_cancellation', default=None)
+_defaultTimeout = 30.0
+
+
+def setDefaultTimeout(seconds):
+    """Sets the timeout of network operations which are not inside a deadline() scope"""
+    global _defaultTimeout
+    _defaultTimeout = seconds
+
+
+def getDefaultTimeout():
+    return _defaultTimeout
+
+
+class Cancellation(object):
+    """Token to cancel the operations which were started with it"""
+
+    def __init__(self):
+        self._future = Future()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._future.done()
+
+    @property
+    def future(self):
+        """Future which is done once cancelled, to wait for it together with other futures"""
+        return self._future
+
+    def cancel(self):
+        with self._lock:
+            if not self._future.done():
+                self._future.set_result(None)
+
+    def check(self):
+        """Raise CancelledError if the operations were cancelled"""
+        if self.cancelled:
+            raise CancelledError()
+
+
+@contextlib.contextmanager
+def deadline(seconds=None, cancellation=None):
+    """Scope in which all network operations have to finish within the given seconds
+
+    An enclosing scope with an earlier deadline still applies. Operations started inside the
+    scope raise CancelledError once the given Cancellation is cancelled.
+    """
+    deadline_token = cancellation_token = None
+    if seconds is not None:
+        until = time.monotonic() + seconds
+        current = _deadline.get()
+        if current is not None and current < until:
+            until = current
+        deadline_token = _deadline.set(until)
+    if cancellation is not None:
+        cancellation_token = _cancellation.set(cancellation)
+    try:
+        yield
+    finally:
+        if cancellation_token is not None:
+            _cancellation.reset(cancellation_token)
+        if deadline_token is not None:
+            _deadline.reset(deadline_token)
+
+
+def remaining():
+    """Returns the seconds the next network operation may take
+
+    Raises TimeoutError if the deadline already passed and CancelledError if the operation
+    was cancelled
+    """
+    cancellation = _cancellation.get()
+    if cancellation is not None:
+        cancellation.check()
+    until = _deadline.get()
+    if until is None:
+        return _defaultTimeout
+    left = until - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("Deadline exceeded")
+    return left
+
+
+def withTimeout(function):
+    """Decorator adding the keyword argument timeout: seconds the whole call may take"""
+    @functools.wraps(function)
+    def wrapper(*args, timeout=None, **kwargs):
+        if timeout is None:
+            return function(*args, **kwargs)
+        with deadline(timeout):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def runInContext(function):
+    """Returns a function which runs function in a copy of the current context
+
+    Used for work handed to executors, so the deadline and cancellation of the caller apply
+    """
+    return functools.partial(contextvars.copy_context().run, function)
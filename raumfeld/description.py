@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Device descriptions of the Raumfeld devices
+
+The description XML behind the location of a device lists the control and
+event URLs of its services. Every description is fetched once per location and
+kept in memory. With a cache directory it is also stored on disk together with
+its ETag and Last-Modified header, so after a restart it is only revalidated
+with a conditional GET, which the device answers with 304 Not Modified.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.parse
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from .deadline import remaining
+
+_DEVICE_NS = '{urn:schemas-upnp-org:device-1-0}'
+
+
+class ServiceDescription(namedtuple('ServiceDescription', ['service_type', 'service_id',
+                                                           'control_url', 'event_url',
+                                                           'scpd_url'])):
+    """One service of a device description, with absolute URLs"""
+    __slots__ = ()
+
+    @property
+    def name(self):
+        """Name of the service type, e.g. AVTransport"""
+        parts = self.service_type.split(':')
+        return parts[-2] if len(parts) > 2 else self.service_type
+
+
+class DeviceDescription(namedtuple('DeviceDescription', ['location', 'udn', 'friendly_name',
+                                                         'services'])):
+    """Device description: UDN, friendlyName and the tuple of ServiceDescriptions
+
+    The services of embedded devices are included
+    """
+    __slots__ = ()
+
+    def getService(self, name):
+        """Returns the first ServiceDescription with the given service type name or None"""
+        for service in self.services:
+            if service.name == name:
+                return service
+        return None
+
+
+def parseDeviceDescription(content, location):
+    """Parse a device description XML and resolve its URLs relative to the location"""
+    root = ElementTree.fromstring(content)
+    base = root.findtext(_DEVICE_NS + 'URLBase') or location
+    device = root.find(_DEVICE_NS + 'device')
+    if device is None:
+        raise ValueError("No device in the description {0}".format(location))
+
+    def url(service, tag):
+        path = (service.findtext(_DEVICE_NS + tag) or '').strip()
+        return urllib.parse.urljoin(base, path) if path else None
+
+    services = tuple(ServiceDescription((service.findtext(_DEVICE_NS + 'serviceType') or '').strip(),
+                                        (service.findtext(_DEVICE_NS + 'serviceId') or '').strip(),
+                                        url(service, 'controlURL'), url(service, 'eventSubURL'),
+                                        url(service, 'SCPDURL'))
+                     for service in device.iter(_DEVICE_NS + 'service'))
+    return DeviceDescription(location, (device.findtext(_DEVICE_NS + 'UDN') or '').strip(),
+                             (device.findtext(_DEVICE_NS + 'friendlyName') or '').strip(),
+                             services)
+
+
+class DescriptionCache(object):
+    """Device descriptions fetched once per location, optionally persisted in a directory
+
+    A description which the device does not deliver or which can not be parsed is remembered
+    as a description without services, so the default paths are used instead of asking again.
+    Network errors are not remembered.
+    """
+
+    def __init__(self, pool, directory=None):
+        """
+        :param pool: ConnectionPool the descriptions are fetched with
+        :param directory: directory the descriptions are stored in, None keeps them in memory only
+        """
+        self._pool = pool
+        self._directory = directory
+        self._descriptions = {}  # location -> DeviceDescription
+        self._locks = {}  # location -> lock held while the description is fetched
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._downloads = 0
+        self._revalidations = 0
+
+    def configure(self, directory):
+        """Change the directory; None keeps the descriptions in memory only"""
+        self._directory = directory
+
+    @property
+    def stats(self):
+        """Returns a dict with hits, downloads, revalidations (304 answers) and entries"""
+        with self._lock:
+            return {'hits': self._hits,
+                    'downloads': self._downloads,
+                    'revalidations': self._revalidations,
+                    'entries': len(self._descriptions)}
+
+    def clear(self):
+        """Forget the descriptions in memory; the files are revalidated with the next request"""
+        with self._lock:
+            self._descriptions.clear()
+
+    def get(self, location):
+        """Returns the DeviceDescription of the location, fetching it if it is not known yet
+
+        Raises OSError or http.client.HTTPException if the device can not be reached
+        """
+        with self._lock:
+            description = self._descriptions.get(location)
+            if description is not None:
+                self._hits += 1
+                return description
+            lock = self._locks.setdefault(location, threading.Lock())
+        # Concurrent requests for the same location wait for one fetch
+        if not lock.acquire(timeout=remaining()):
+            raise TimeoutError("Deadline exceeded")
+        try:
+            description = self._descriptions.get(location)
+            if description is None:
+                description = self._fetch(location)
+                self._remember(location, description)
+            return description
+        finally:
+            lock.release()
+
+    def _remember(self, location, description):
+        with self._lock:
+            self._descriptions[location] = description
+            # Only now: after a failed fetch the waiting requests retry it one after the other
+            self._locks.pop(location, None)
+
+    def _fetch(self, location):
+        stored, headers = self._request(location)
+        status, response_headers, content = self._pool.request(location, headers=headers,
+                                                               timeout=remaining())
+        return self._response(location, stored, status, response_headers.get('ETag'),
+                              response_headers.get('Last-Modified'), content)
+
+    def _request(self, location):
+        """Returns the stored description of the location or None and the request headers"""
+        stored = self._load(location)
+        headers = {}
+        if stored is not None:
+            if stored.get('etag'):
+                headers['If-None-Match'] = stored['etag']
+            if stored.get('last_modified'):
+                headers['If-Modified-Since'] = stored['last_modified']
+        return stored, headers
+
+    def _response(self, location, stored, status, etag, last_modified, content):
+        """Returns the DeviceDescription of the response to _request() and stores it"""
+        if status == 304 and stored is not None:
+            with self._lock:
+                self._revalidations += 1
+            content = stored['content'].encode('utf-8')
+        elif status == 200:
+            with self._lock:
+                self._downloads += 1
+            stored = None
+        else:
+            logging.warning("Device description {0}: HTTP status {1}".format(location, status))
+            return DeviceDescription(location, '', '', ())
+        try:
+            description = parseDeviceDescription(content, location)
+        except (ElementTree.ParseError, ValueError) as e:
+            logging.warning("Invalid device description {0}: {1}".format(location, e))
+            return DeviceDescription(location, '', '', ())
+        if stored is None:
+            self._store(location, etag, last_modified, content)
+        return description
+
+    def _path(self, location):
+        name = hashlib.sha1(location.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self._directory, name)
+
+    def _load(self, location):
+        """Returns the stored description of the location with its validators or None"""
+        if self._directory is None:
+            return None
+        try:
+            with open(self._path(location), encoding='utf-8') as description_file:
+                stored = json.load(description_file)
+            return stored if stored.get('location') == location else None
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring the stored description of {0}: {1}".format(location, e))
+            return None
+
+    def _store(self, location, etag, last_modified, content):
+        if self._directory is None or (etag is None and last_modified is None):
+            return  # without a validator every start would download it anyway
+        path = self._path(location)
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            with open(path + '.tmp', 'w', encoding='utf-8') as description_file:
+                json.dump({'location': location, 'etag': etag, 'last_modified': last_modified,
+                           'content': content.decode('utf-8')}, description_file)
+            os.replace(path + '.tmp', path)
+        except (OSError, UnicodeDecodeError) as e:
+            logging.warning("Storing the description of {0} failed: {1}".format(location, e))
+
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Compact object model of DIDL-Lite metadata
+
+Browse and Search results as well as the CurrentURIMetaData and TrackMetaData
+of a renderer are DIDL-Lite documents. parseDidl turns such a document into
+DidlContainer and DidlItem objects. Their attributes are read from the XML
+element on first access only, and the parsed objects are memoized per
+metadata string, so the track metadata which is returned by every status poll
+is parsed once.
+"""
+
+import functools
+from xml.etree import ElementTree
+
+DIDL_NS = 'urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/'
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+UPNP_NS = 'urn:schemas-upnp-org:metadata-1-0/upnp/'
+
+_CONTAINER_TAG = '{%s}container' % DIDL_NS
+_ITEM_TAG = '{%s}item' % DIDL_NS
+_RES_TAG = '{%s}res' % DIDL_NS
+
+
+class _lazy(object):
+    """Property which computes its value on first access and stores it in the slot '_<name>'"""
+
+    def __init__(self, function):
+        self._function = function
+        self.__doc__ = function.__doc__
+
+    def __set_name__(self, owner, name):
+        self._slot = getattr(owner, '_' + name)
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return self._slot.__get__(instance, owner)
+        except AttributeError:
+            value = self._function(instance)
+            self._slot.__set__(instance, value)
+            return value
+
+
+class DidlResource(object):
+    """A res element: the URI of the media and its protocolInfo, duration, size and bitrate"""
+    __slots__ = ('uri', 'protocol_info', 'duration', 'size', 'bitrate')
+
+    def __init__(self, element):
+        self.uri = (element.text or '').strip()
+        self.protocol_info = element.get('protocolInfo')
+        self.duration = element.get('duration')
+        self.size = element.get('size')
+        self.bitrate = element.get('bitrate')
+
+    def __repr__(self):
+        return 'DidlResource({0!r}, {1!r})'.format(self.uri, self.protocol_info)
+
+
+class DidlObject(object):
+    """Common attributes of DIDL-Lite containers and items"""
+    __slots__ = ('_element', '_title', '_upnp_class', '_creator', '_artist', '_album', '_genre',
+                 '_album_art_uri', '_resources')
+
+    def __init__(self, element):
+        self._element = element
+
+    def _text(self, namespace, tag):
+        return self._element.findtext('{%s}%s' % (namespace, tag))
+
+    @property
+    def id(self):
+        return self._element.get('id')
+
+    @property
+    def parent_id(self):
+        return self._element.get('parentID')
+
+    @property
+    def restricted(self):
+        return self._element.get('restricted') in ('1', 'true')
+
+    @_lazy
+    def title(self):
+        """dc:title"""
+        return self._text(DC_NS, 'title')
+
+    @_lazy
+    def upnp_class(self):
+        """upnp:class, e.g. object.item.audioItem.musicTrack"""
+        return self._text(UPNP_NS, 'class')
+
+    @_lazy
+    def creator(self):
+        """dc:creator"""
+        return self._text(DC_NS, 'creator')
+
+    @_lazy
+    def artist(self):
+        """upnp:artist"""
+        return self._text(UPNP_NS, 'artist')
+
+    @_lazy
+    def album(self):
+        """upnp:album"""
+        return self._text(UPNP_NS, 'album')
+
+    @_lazy
+    def genre(self):
+        """upnp:genre"""
+        return self._text(UPNP_NS, 'genre')
+
+    @_lazy
+    def album_art_uri(self):
+        """upnp:albumArtURI"""
+        return self._text(UPNP_NS, 'albumArtURI')
+
+    @_lazy
+    def resources(self):
+        """Tuple of the DidlResources"""
+        return tuple(DidlResource(element) for element in self._element.iter(_RES_TAG))
+
+    @property
+    def uri(self):
+        """URI of the first resource or None"""
+        return self.resources[0].uri if self.resources else None
+
+    @property
+    def duration(self):
+        """duration of the first resource or None"""
+        return self.resources[0].duration if self.resources else None
+
+    def get(self, namespace, tag):
+        """Returns the text of any other child element, e.g. get(UPNP_NS, 'originalTrackNumber')"""
+        return self._text(namespace, tag)
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r})'.format(type(self).__name__, self.id, self.title)
+
+
+class DidlContainer(DidlObject):
+    """A DIDL-Lite container"""
+    __slots__ = ()
+
+    @property
+    def child_count(self):
+        """childCount or None if the server does not report it"""
+        child_count = self._element.get('childCount')
+        return int(child_count) if child_count else None
+
+    @property
+    def searchable(self):
+        return self._element.get('searchable') in ('1', 'true')
+
+
+class DidlItem(DidlObject):
+    """A DIDL-Lite item"""
+    __slots__ = ()
+
+    @property
+    def ref_id(self):
+        return self._element.get('refID')
+
+
+def didlObjectFromElement(element):
+    """Returns the DidlContainer or DidlItem of a container or item element, otherwise None"""
+    if element.tag == _CONTAINER_TAG:
+        return DidlContainer(element)
+    if element.tag == _ITEM_TAG:
+        return DidlItem(element)
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def parseDidl(metadata):
+    """Parse a DIDL-Lite document into a tuple of DidlContainers and DidlItems
+
+    The result is memoized per metadata string, the returned objects are shared and read-only
+    """
+    if not metadata:
+        return ()
+    try:
+        root = ElementTree.fromstring(metadata)
+    except ElementTree.ParseError:
+        return ()
+    objects = (didlObjectFromElement(element) for element in root)
+    return tuple(didl_object for didl_object in objects if didl_object is not None)
+
+
+def parseDidlObject(metadata):
+    """Returns the first object of a DIDL-Lite document like TrackMetaData or None"""
+    objects = parseDidl(metadata)
+    return objects[0] if objects else None
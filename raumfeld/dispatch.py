@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous delivery of change notifications to any number of listeners
+
+Every listener has its own bounded queue which is drained on a shared
+executor, so a slow callback only delays its own notifications and never the
+thread which publishes them. When a queue is full, its overflow policy decides
+whether the queued events are coalesced into one or the oldest is dropped.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+COALESCE = 'coalesce'
+DROP_OLDEST = 'drop-oldest'
+
+
+def _keepNewest(old_event, new_event):
+    return new_event
+
+
+class Listener(object):
+    """Bounded queue of events for one callback; the events are delivered in order, one at a time"""
+
+    def __init__(self, callback, executor, maxsize=16, policy=COALESCE, merge=None):
+        """
+        :param callback: function called with every event
+        :param executor: executor the callback is run on
+        :param maxsize: number of queued events before the overflow policy applies
+        :param policy: COALESCE merges all queued events into one, DROP_OLDEST drops the oldest
+        :param merge: function(old_event, new_event) used to coalesce, keeps the newest by default
+        """
+        if policy not in (COALESCE, DROP_OLDEST):
+            raise ValueError("Unknown overflow policy {0!r}".format(policy))
+        self._callback = callback
+        self._executor = executor
+        self._maxsize = max(maxsize, 1)
+        self._policy = policy
+        self._merge = merge or _keepNewest
+        self._queue = deque()  # (event, time published)
+        self._lock = threading.Lock()
+        self._running = False  # a drain task is submitted or running
+        self._closed = False
+        self._delivered = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._errors = 0
+        self._latencyTotal = 0.0
+        self._latencyMax = 0.0
+        self._durationMax = 0.0
+
+    @property
+    def stats(self):
+        """Returns a dict with the counters and the latencies (publish to callback) in seconds"""
+        with self._lock:
+            return {'queued': len(self._queue),
+                    'delivered': self._delivered,
+                    'dropped': self._dropped,
+                    'coalesced': self._coalesced,
+                    'errors': self._errors,
+                    'latency_avg': self._latencyTotal / self._delivered if self._delivered else 0.0,
+                    'latency_max': self._latencyMax,
+                    'duration_max': self._durationMax}
+
+    def publish(self, event):
+        """Queue the event; never blocks"""
+        now = time.monotonic()
+        with self._lock:
+            if self._closed:
+                return
+            if len(self._queue) >= self._maxsize:
+                if self._policy == DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    # Merge everything into one event, it keeps the time of the oldest
+                    merged, published = self._queue.popleft()
+                    while self._queue:
+                        merged = self._merge(merged, self._queue.popleft()[0])
+                    event = self._merge(merged, event)
+                    now = published
+                    self._coalesced += self._maxsize
+            self._queue.append((event, now))
+            if self._running:
+                return
+            self._running = True
+        self._executor.submit(self._drain)
+
+    def close(self):
+        """Drop the queued events and stop the delivery"""
+        with self._lock:
+            self._closed = True
+            self._queue.clear()
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._queue or self._closed:
+                    self._running = False
+                    return
+                event, published = self._queue.popleft()
+            started = time.monotonic()
+            try:
+                self._callback(event)
+            except Exception:
+                logging.exception("Change listener {0!r} failed".format(self._callback))
+                with self._lock:
+                    self._errors += 1
+            finished = time.monotonic()
+            with self._lock:
+                self._delivered += 1
+                latency = started - published
+                self._latencyTotal += latency
+                self._latencyMax = max(self._latencyMax, latency)
+                self._durationMax = max(self._durationMax, finished - started)
+
+
+class Dispatcher(object):
+    """Publishes events to a set of Listeners"""
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._listeners = ()  # replaced on change, so publish needs no lock
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._listeners)
+
+    @property
+    def listeners(self):
+        return self._listeners
+
+    def add(self, callback, maxsize=16, policy=COALESCE, merge=None):
+        """Returns the new Listener for the callback"""
+        listener = Listener(callback, self._executor, maxsize, policy, merge)
+        with self._lock:
+            self._listeners = self._listeners + (listener,)
+        return listener
+
+    def remove(self, listener):
+        listener.close()
+        with self._lock:
+            self._listeners = tuple(other for other in self._listeners if other is not listener)
+
+    def publish(self, event):
+        for listener in self._listeners:
+            listener.publish(event)
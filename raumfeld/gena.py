@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+UPnP GENA event subscriptions
+
+The EventManager subscribes to the RenderingControl and AVTransport services
+of the zones and renderers and receives their NOTIFY requests on a small
+local HTTP server. The evented state variables (the content of LastChange) are
+kept per device and service, so reading the volume or the transport state does
+not need a request to the device. Subscriptions are renewed in the background
+before they expire and are set up again after missed events or errors.
+"""
+
+import http.client
+import http.server
+import logging
+import socket
+import threading
+import time
+import urllib.parse
+from itertools import count
+from types import MappingProxyType
+from xml.etree import ElementTree
+
+_EVENT_NS = 'urn:schemas-upnp-org:event-1-0'
+
+
+def parseLastChange(last_change):
+    """Parse the value of a LastChange variable into a dict of state variables
+
+    Only the Master channel of channel dependent variables like Volume is kept
+    """
+    variables = {}
+    if not last_change or not last_change.strip():
+        return variables
+    for instance in ElementTree.fromstring(last_change):
+        for variable in instance:
+            channel = variable.get('channel')
+            if channel is not None and channel != 'Master':
+                continue
+            variables[variable.tag.rpartition('}')[2]] = variable.get('val', '')
+    return variables
+
+
+def parsePropertySet(body):
+    """Parse the body of a NOTIFY request into a dict of state variables; LastChange is expanded"""
+    variables = {}
+    for prop in ElementTree.fromstring(body).iter('{%s}property' % _EVENT_NS):
+        for variable in prop:
+            name = variable.tag.rpartition('}')[2]
+            if name == 'LastChange':
+                variables.update(parseLastChange(variable.text))
+            else:
+                variables[name] = variable.text or ''
+    return variables
+
+
+def _parseTimeout(value, default):
+    """Returns the seconds of a TIMEOUT header like 'Second-300'"""
+    try:
+        return int(value.rpartition('-')[2])
+    except (AttributeError, ValueError):
+        return default
+
+
+class _Subscription(object):
+    """State of the subscription to one service of one device"""
+
+    def __init__(self, key, url):
+        self.key = key  # (udn, service)
+        self.url = url  # event subscription URL
+        self.path = None  # path of our callback URL, a new one for every SUBSCRIBE
+        self.sid = None
+        self.seq = None  # SEQ of the last event received
+        self.resubscribe = False  # cancel the current subscription and subscribe again
+        self.expires = 0.0
+        self.due = 0.0  # time of the next subscribe or renew request
+
+
+class _NotifyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_NOTIFY(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status = self.server.manager._notify(self.path, self.headers.get('SID'),
+                                             self.headers.get('SEQ'), body)
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug('NOTIFY server: ' + format % args)
+
+
+class EventManager(object):
+    """Keeps subscriptions to a set of services and the state variables they report"""
+
+    def __init__(self, pool, timeout=300, address='', port=0, retry_interval=30.0):
+        """
+        :param pool: ConnectionPool the SUBSCRIBE requests are sent through
+        :param timeout: requested subscription duration in seconds
+        :param address: address the NOTIFY server listens on, all interfaces by default
+        :param port: port of the NOTIFY server, any free port by default
+        :param retry_interval: seconds until a failed subscription is tried again
+        """
+        self._pool = pool
+        self._timeout = timeout
+        self._retryInterval = retry_interval
+        self._server = http.server.ThreadingHTTPServer((address, port), _NotifyHandler)
+        self._server.daemon_threads = True
+        self._server.manager = self
+        self._wanted = {}  # (udn, service) -> event subscription URL
+        self._subscriptions = {}  # (udn, service) -> _Subscription
+        self._subscriptionsByPath = {}  # callback path -> _Subscription
+        self._states = {}  # (udn, service) -> read-only dict of the state variables
+        self._paths = count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._events = 0
+        self._failures = 0
+
+    @property
+    def port(self):
+        """Port of the NOTIFY server"""
+        return self._server.server_address[1]
+
+    @property
+    def stats(self):
+        """Returns a dict with the number of active subscriptions, received events and failures"""
+        with self._lock:
+            return {'subscriptions': sum(1 for subscription in self._subscriptions.values()
+                                         if subscription.sid is not None),
+                    'events': self._events,
+                    'failures': self._failures}
+
+    def start(self):
+        """Start the NOTIFY server and the thread which subscribes and renews"""
+        self._running = True
+        threading.Thread(target=self._server.serve_forever, name='raumfeld-notify',
+                         daemon=True).start()
+        threading.Thread(target=self._run, name='raumfeld-subscriptions', daemon=True).start()
+
+    def stop(self):
+        """Cancel all subscriptions and stop the NOTIFY server"""
+        self._running = False
+        self._wakeup.set()
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+            self._subscriptionsByPath.clear()
+            self._states.clear()
+        for subscription in subscriptions:
+            self._unsubscribe(subscription)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def setTargets(self, targets):
+        """Set the services to subscribe to as dict (udn, service) -> event subscription URL"""
+        with self._lock:
+            self._wanted = dict(targets)
+        self._wakeup.set()
+
+    def getState(self, udn, service):
+        """Returns the read-only dict of the state variables or None if they are not known"""
+        key = (udn, service)
+        with self._lock:
+            subscription = self._subscriptions.get(key)
+            if subscription is None or subscription.sid is None or \
+                    subscription.expires <= time.monotonic():
+                return None
+            return self._states.get(key)
+
+    def _run(self):
+        while self._running:
+            self._wakeup.clear()
+            timeout = self._maintain()
+            self._wakeup.wait(timeout)
+
+    def _maintain(self):
+        """Subscribe, renew and unsubscribe as needed; returns the seconds until the next run"""
+        now = time.monotonic()
+        with self._lock:
+            removed = [subscription for key, subscription in self._subscriptions.items()
+                       if self._wanted.get(key) != subscription.url]
+            for subscription in removed:
+                del self._subscriptions[subscription.key]
+                self._subscriptionsByPath.pop(subscription.path, None)
+                self._states.pop(subscription.key, None)
+            for key, url in self._wanted.items():
+                if key not in self._subscriptions:
+                    self._subscriptions[key] = _Subscription(key, url)
+            due = [subscription for subscription in self._subscriptions.values()
+                   if subscription.due <= now]
+
+        for subscription in removed:
+            self._unsubscribe(subscription)
+        for subscription in due:
+            if not self._running:
+                break
+            self._subscribe(subscription)
+
+        with self._lock:
+            next_due = min((subscription.due for subscription in self._subscriptions.values()),
+                           default=None)
+        return None if next_due is None else max(next_due - time.monotonic(), 0.0)
+
+    def _subscribe(self, subscription):
+        """Renew the subscription or subscribe if there is none"""
+        if subscription.resubscribe:
+            self._unsubscribe(subscription)
+            with self._lock:
+                subscription.sid = None
+                subscription.resubscribe = False
+        if subscription.sid is None:
+            with self._lock:
+                # Every subscription gets its own callback path, so late events of a cancelled
+                # subscription are rejected even before the new SID is known
+                self._subscriptionsByPath.pop(subscription.path, None)
+                subscription.path = '/{0}'.format(next(self._paths))
+                subscription.seq = None
+                self._subscriptionsByPath[subscription.path] = subscription
+        try:
+            if subscription.sid is not None:
+                headers = {'SID': subscription.sid, 'TIMEOUT': 'Second-{0}'.format(self._timeout)}
+            else:
+                headers = {'CALLBACK': '<{0}>'.format(self._callbackURL(subscription)),
+                           'NT': 'upnp:event', 'TIMEOUT': 'Second-{0}'.format(self._timeout)}
+            status, response_headers, _ = self._pool.request(subscription.url, 'SUBSCRIBE',
+                                                             None, headers)
+        except (OSError, http.client.HTTPException) as e:
+            status, response_headers = None, None
+            logging.debug("SUBSCRIBE {0} failed: {1}".format(subscription.url, e))
+
+        now = time.monotonic()
+        with self._lock:
+            if status == 200 and response_headers.get('SID'):
+                timeout = _parseTimeout(response_headers.get('TIMEOUT'), self._timeout)
+                subscription.sid = response_headers.get('SID')
+                subscription.expires = now + timeout
+                subscription.due = now + timeout / 2
+                return
+            self._failures += 1
+            if subscription.sid is not None and status is not None:
+                # The device does not know the SID anymore (e.g. after a reboot): subscribe anew
+                logging.info("Renewing {0} failed with {1}, subscribing again".format(
+                    subscription.url, status))
+                subscription.sid = None
+                self._states.pop(subscription.key, None)
+                subscription.due = now
+            else:
+                logging.info("Subscribing to {0} failed".format(subscription.url))
+                subscription.due = now + self._retryInterval
+
+    def _unsubscribe(self, subscription):
+        if subscription.sid is None:
+            return
+        try:
+            self._pool.request(subscription.url, 'UNSUBSCRIBE', None, {'SID': subscription.sid})
+        except (OSError, http.client.HTTPException) as e:
+            logging.debug("UNSUBSCRIBE {0} failed: {1}".format(subscription.url, e))
+
+    def _callbackURL(self, subscription):
+        address = self._server.server_address[0]
+        if address in ('', '0.0.0.0'):
+            # Use the address of the interface the device is reached through
+            host = urllib.parse.urlparse(subscription.url).hostname
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                probe.connect((host, 1900))
+                address = probe.getsockname()[0]
+        return 'http://{0}:{1}{2}'.format(address, self.port, subscription.path)
+
+    def _notify(self, path, sid, seq, body):
+        """Handle a NOTIFY request and return the HTTP status of the response"""
+        try:
+            seq = int(seq)
+            variables = parsePropertySet(body)
+        except (TypeError, ValueError, ElementTree.ParseError):
+            return 400
+        with self._lock:
+            subscription = self._subscriptionsByPath.get(path)
+            if subscription is None or (subscription.sid is not None and sid != subscription.sid):
+                return 412
+            self._events += 1
+            if seq == 0:
+                # The initial event contains all evented variables
+                state = {}
+            elif subscription.seq is None or seq != subscription.seq + 1:
+                # Missed an event: the state is incomplete until a new subscription reports all
+                logging.info("Missed events of {0}, subscribing again".format(subscription.url))
+                self._states.pop(subscription.key, None)
+                subscription.resubscribe = True
+                subscription.due = 0.0
+                self._wakeup.set()
+                return 200
+            else:
+                state = dict(self._states.get(subscription.key, {}))
+            state.update(variables)
+            subscription.seq = seq
+            self._states[subscription.key] = MappingProxyType(state)
+        return 200
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Reconnect policy and health state of the connection to the Raumfeld host
+
+The long-poll threads report every result to HostHealth. Failed requests are
+retried after exponentially growing, jittered delays, so a recovering host is
+not hit by all clients at the same moment. After a number of consecutive
+failures the circuit opens: the host counts as disconnected and only one
+poller keeps probing it until a request succeeds again.
+"""
+
+import logging
+import random
+import threading
+
+CONNECTED = 'connected'
+DEGRADED = 'degraded'  # some requests failed, but fewer than the failure threshold in a row
+DISCONNECTED = 'disconnected'
+
+
+class ReconnectPolicy(object):
+    """Exponential backoff with jitter"""
+
+    def __init__(self, initial_delay=1.0, max_delay=60.0, factor=2.0, jitter=0.5):
+        """
+        :param initial_delay: seconds to wait after the first failure
+        :param max_delay: upper limit of the delay
+        :param factor: growth of the delay with every further failure
+        :param jitter: fraction of the delay which is randomly subtracted (0 disables the jitter)
+        """
+        self.configure(initial_delay, max_delay, factor, jitter)
+
+    def configure(self, initial_delay=None, max_delay=None, factor=None, jitter=None):
+        if initial_delay is not None:
+            self.initial_delay = initial_delay
+        if max_delay is not None:
+            self.max_delay = max_delay
+        if factor is not None:
+            self.factor = factor
+        if jitter is not None:
+            self.jitter = min(max(jitter, 0.0), 1.0)
+
+    def delay(self, failures):
+        """Returns the seconds to wait after the given number of consecutive failures"""
+        delay = min(self.max_delay, self.initial_delay * self.factor ** max(failures - 1, 0))
+        return delay * (1.0 - self.jitter * random.random())
+
+
+class HostHealth(object):
+    """Circuit breaker state of the host, fed with the results of the pollers"""
+
+    def __init__(self, failure_threshold=3, on_change=None):
+        """
+        :param failure_threshold: consecutive failures of one poller which open the circuit
+        :param on_change: function called with the new state after every state change
+        """
+        self.failure_threshold = failure_threshold
+        self._onChange = on_change
+        self._failures = {}  # poller name -> consecutive failures
+        self._state = DISCONNECTED  # until the first request succeeded
+        self._probe = None  # the only poller sending requests while the circuit is open
+        self._closed = threading.Event()
+        self._closed.set()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def failures(self, poller):
+        """Returns the number of consecutive failures of the poller"""
+        with self._lock:
+            return self._failures.get(poller, 0)
+
+    def success(self, poller):
+        with self._lock:
+            if self._state == DISCONNECTED:
+                # The host answers again, the other pollers do not need to find out on their own
+                self._failures = dict.fromkeys(self._failures, 0)
+            self._failures[poller] = 0
+            self._update()
+
+    def failure(self, poller):
+        with self._lock:
+            self._failures[poller] = self._failures.get(poller, 0) + 1
+            self._update()
+            if self._state == DISCONNECTED and self._probe is None:
+                self._probe = poller
+
+    def mayRequest(self, poller):
+        """False while the circuit is open and another poller probes the host"""
+        with self._lock:
+            return self._state != DISCONNECTED or self._probe in (None, poller)
+
+    def waitUntilConnected(self, timeout=None):
+        """Wait until the circuit is closed again; returns False on timeout"""
+        return self._closed.wait(timeout)
+
+    def _update(self):
+        failures = self._failures.values()
+        if any(count >= self.failure_threshold for count in failures):
+            state = DISCONNECTED
+        elif any(failures):
+            state = DEGRADED
+        else:
+            state = CONNECTED
+        if state == DISCONNECTED:
+            self._closed.clear()
+        else:
+            self._closed.set()
+            self._probe = None
+        if state != self._state:
+            if state == CONNECTED:
+                logging.info("Connection to the host: {0}".format(state))
+            else:
+                logging.warning("Connection to the host: {0}".format(state))
+            self._state = state
+            if self._onChange is not None:
+                self._onChange(state)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Lookup of zones and rooms by their names
+
+Names are compared normalized: case-folded, with the umlauts written out and
+other accents removed, so "küche", "Kueche" and "KUCHE" all find the room
+"Küche". An index is built once per TopologySnapshot; exact matches are a dict
+lookup and prefix matches a binary search over the sorted names. Matches are
+ranked exact before prefix before substring, then by the shorter name, the name
+and the UDN, so the same query always returns the same order.
+"""
+
+import unicodedata
+from bisect import bisect_left
+
+_EXACT = 0
+_PREFIX = 1
+_SUBSTRING = 2
+
+_UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+
+
+def _stripAccents(name):
+    return ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+
+
+def normalizeName(name):
+    """Returns the name case-folded, with the umlauts written out and other accents removed"""
+    name = unicodedata.normalize('NFC', name).casefold().translate(_UMLAUTS)
+    return ' '.join(_stripAccents(name).split())
+
+
+def _nameKeys(name):
+    """The normalized name and, if it differs, the name with the umlauts reduced to the vowel"""
+    key = normalizeName(name)
+    plain = ' '.join(_stripAccents(unicodedata.normalize('NFC', name).casefold()).split())
+    return (key,) if plain == key else (key, plain)
+
+
+class NameIndex(object):
+    """Index of the normalized names of zones or rooms, i.e. elements with Name and UDN"""
+
+    def __init__(self, elements):
+        self._elements = {}  # key -> list of elements with that key
+        for element in elements:
+            for key in _nameKeys(element.Name or ''):
+                self._elements.setdefault(key, []).append(element)
+        self._keys = sorted(self._elements)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def find(self, name):
+        """Returns all elements whose name contains name, best matches first"""
+        return self._search(name, False)
+
+    def findFirst(self, name):
+        """Returns the best match for name or None
+
+        Prefix matches are only searched without an exact match, substrings only without both
+        """
+        matches = self._search(name, True)
+        return matches[0] if matches else None
+
+    def _search(self, name, first):
+        ranks = {}  # id(element) -> (rank, element)
+
+        def add(match, key):
+            for element in self._elements[key]:
+                rank = (match, len(key), key, element.UDN)
+                current = ranks.get(id(element))
+                if current is None or rank < current[0]:
+                    ranks[id(element)] = (rank, element)
+
+        queries = _nameKeys(name)
+        for query in queries:
+            if query in self._elements:
+                add(_EXACT, query)
+        if not (first and ranks):
+            for query in queries:
+                position = bisect_left(self._keys, query)
+                while position < len(self._keys) and self._keys[position].startswith(query):
+                    if self._keys[position] != query:
+                        add(_PREFIX, self._keys[position])
+                    position += 1
+        if not (first and ranks):
+            for key in self._keys:
+                if any(query in key and not key.startswith(query) for query in queries):
+                    add(_SUBSTRING, key)
+        return [element for _, element in sorted(ranks.values(), key=lambda entry: entry[0])]
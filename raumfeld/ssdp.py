@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+SSDP discovery of Raumfeld hosts and devices
+
+One search sends an M-SEARCH for each wanted service type and collects the
+answers of all devices, deduplicated by their USN. Instead of always waiting
+for a fixed timeout, the search ends as soon as the wanted service type
+answered, or once no new device answered for a short quiet period. Answers
+are cached for the max-age the devices announce, so repeated searches for a
+known host return without any network traffic. discoverAsync is the asyncio
+variant of discover.
+"""
+
+import asyncio
+import socket
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+
+SSDP_GROUP = ('239.255.255.250', 1900)
+
+CONFIG_DEVICE = 'urn:schemas-raumfeld-com:device:ConfigDevice:1'  # the Raumfeld host
+MEDIA_RENDERER = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+MEDIA_SERVER = 'urn:schemas-upnp-org:device:MediaServer:1'
+ALL_TARGETS = (CONFIG_DEVICE, MEDIA_RENDERER, MEDIA_SERVER)
+
+_SEARCH_REPEATS = 2  # UDP may be lost, so every M-SEARCH is sent more than once
+_DEFAULT_MAX_AGE = 1800
+
+
+class SsdpResponse(namedtuple('SsdpResponse', ['usn', 'st', 'location', 'server', 'max_age',
+                                               'address', 'expires'])):
+    """Answer of one device to an M-SEARCH
+
+    address is the IP address the answer came from, expires the time.monotonic() when the
+    answer is outdated according to its max-age
+    """
+    __slots__ = ()
+
+    @property
+    def host(self):
+        """IP address or host name of the location"""
+        return urllib.parse.urlparse(self.location).hostname
+
+
+def buildSearchRequest(st, mx=1, group=SSDP_GROUP):
+    """Returns the M-SEARCH request for the service type st as bytes"""
+    return '\r\n'.join(['M-SEARCH * HTTP/1.1',
+                        'HOST: {0}:{1}'.format(*group),
+                        'MAN: "ssdp:discover"',
+                        'MX: {0}'.format(mx),
+                        'ST: {0}'.format(st), '', '']).encode('utf-8')
+
+
+def parseSearchResponse(data, address):
+    """Returns the SsdpResponse of a datagram or None if it is no valid answer to an M-SEARCH"""
+    lines = data.decode('utf-8', 'replace').split('\r\n')
+    if not lines[0].startswith('HTTP/1.') or ' 200' not in lines[0]:
+        return None
+    headers = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+    if not headers.get('location') or not headers.get('usn'):
+        return None
+    max_age = _DEFAULT_MAX_AGE
+    for directive in headers.get('cache-control', '').split(','):
+        name, _, value = directive.partition('=')
+        if name.strip().lower() == 'max-age':
+            try:
+                max_age = int(value)
+            except ValueError:
+                pass
+    return SsdpResponse(headers['usn'], headers.get('st', ''), headers['location'],
+                        headers.get('server', ''), max_age, address[0],
+                        time.monotonic() + max_age)
+
+
+class SsdpCache(object):
+    """Answers of the devices, each kept until its max-age expired"""
+
+    def __init__(self):
+        self._responses = {}  # usn -> SsdpResponse
+        self._lock = threading.Lock()
+
+    def add(self, response):
+        with self._lock:
+            self._responses[response.usn] = response
+
+    def get(self, targets):
+        """Returns the valid answers for the given service types"""
+        now = time.monotonic()
+        with self._lock:
+            for usn in [usn for usn, response in self._responses.items() if response.expires <= now]:
+                del self._responses[usn]
+            return [response for response in self._responses.values() if response.st in targets]
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+
+
+class _SearchWindow(object):
+    """Decides how long a search keeps collecting answers; shared by discover and discoverAsync"""
+
+    def __init__(self, timeout, wanted, quiet):
+        self._deadline = time.monotonic() + timeout
+        self._wanted = wanted
+        self._quiet = quiet
+        self._quietUntil = None  # end of the quiet period after the last new answer
+        self._done = False
+        self.responses = {}  # usn -> SsdpResponse, in the order of the answers
+
+    def add(self, response):
+        if response.usn not in self.responses:
+            self._quietUntil = time.monotonic() + self._quiet
+        self.responses[response.usn] = response
+        if self._wanted is not None and response.st == self._wanted:
+            self._done = True
+
+    def remaining(self):
+        """Returns the seconds to wait for more answers or None if the search is finished"""
+        if self._done:
+            return None
+        until = self._deadline
+        if self._quietUntil is not None:
+            until = min(until, self._quietUntil)
+        left = until - time.monotonic()
+        return left if left > 0 else None
+
+
+__cache = SsdpCache()
+
+
+def getDiscoveryCache():
+    """Returns the SsdpCache shared by all searches"""
+    return __cache
+
+
+def _createSearchSocket(group):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+    sock.bind(('', 0))
+    return sock
+
+
+def _sendSearches(send, targets, mx, group):
+    for _ in range(_SEARCH_REPEATS):
+        for st in targets:
+            send(buildSearchRequest(st, mx, group))
+
+
+def discover(targets=ALL_TARGETS, timeout=3.0, wanted=None, quiet=0.5, mx=1, useCache=True,
+             group=SSDP_GROUP):
+    """Search for devices and return their SsdpResponses, one per USN
+
+    :param targets: service types to search for
+    :param timeout: maximum seconds to wait for answers
+    :param wanted: service type after whose first answer the search ends at once
+    :param quiet: the search ends when no new device answered for these seconds
+    :param mx: seconds the devices may delay their answers
+    :param useCache: return the cached answers without searching if wanted is among them
+    :param group: address the searches are sent to
+    """
+    cache = getDiscoveryCache()
+    if useCache and wanted is not None:
+        cached = cache.get(targets)
+        if any(response.st == wanted for response in cached):
+            return cached
+
+    window = _SearchWindow(timeout, wanted, quiet)
+    with _createSearchSocket(group) as sock:
+        _sendSearches(lambda request: sock.sendto(request, group), targets, mx, group)
+        while True:
+            left = window.remaining()
+            if left is None:
+                break
+            sock.settimeout(left)
+            try:
+                data, address = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            response = parseSearchResponse(data, address)
+            if response is not None and response.st in targets:
+                cache.add(response)
+                window.add(response)
+    return list(window.responses.values())
+
+
+class _SearchProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def datagram_received(self, data, address):
+        self._queue.put_nowait((data, address))
+
+
+async def discoverAsync(targets=ALL_TARGETS, timeout=3.0, wanted=None, quiet=0.5, mx=1,
+                        useCache=True, group=SSDP_GROUP):
+    """Coroutine variant of discover"""
+    cache = getDiscoveryCache()
+    if useCache and wanted is not None:
+        cached = cache.get(targets)
+        if any(response.st == wanted for response in cached):
+            return cached
+
+    window = _SearchWindow(timeout, wanted, quiet)
+    queue = asyncio.Queue()
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: _SearchProtocol(queue), sock=_createSearchSocket(group))
+    try:
+        _sendSearches(lambda request: transport.sendto(request, group), targets, mx, group)
+        while True:
+            left = window.remaining()
+            if left is None:
+                break
+            try:
+                data, address = await asyncio.wait_for(queue.get(), left)
+            except asyncio.TimeoutError:
+                continue
+            response = parseSearchResponse(data, address)
+            if response is not None and response.st in targets:
+                cache.add(response)
+                window.add(response)
+    finally:
+        transport.close()
+    return list(window.responses.values())
+
+
+def discoverHost(timeout=3.0, useCache=True, group=SSDP_GROUP):
+    """Returns the IP address of the first Raumfeld host which answers or "" if none is found"""
+    for response in discover((CONFIG_DEVICE,), timeout, wanted=CONFIG_DEVICE, useCache=useCache,
+                             group=group):
+        return response.host
+    return ""
+
+
+def discoverHosts(timeout=3.0, quiet=0.5, group=SSDP_GROUP):
+    """Returns the IP addresses of all Raumfeld hosts which answer"""
+    hosts = []
+    for response in discover((CONFIG_DEVICE,), timeout, quiet=quiet, useCache=False, group=group):
+        if response.host not in hosts:
+            hosts.append(response.host)
+    return hosts
+
+
+async def discoverHostAsync(timeout=3.0, useCache=True, group=SSDP_GROUP):
+    """Coroutine variant of discoverHost"""
+    for response in await discoverAsync((CONFIG_DEVICE,), timeout, wanted=CONFIG_DEVICE,
+                                        useCache=useCache, group=group):
+        return response.host
+    return ""
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Compact records of the Raumfeld topology and the parsers creating them
+
+The listDevices and getZones responses of the host are parsed incrementally
+with ElementTree's iterparse, so only the small immutable records below are
+kept and no DOM of the whole response stays in memory.
+
+The records are combined to a TopologyState; two states can be compared with
+diffTopology and the resulting objects are published as a TopologySnapshot.
+"""
+
+from collections import namedtuple
+from types import MappingProxyType
+from xml.etree import ElementTree
+
+DeviceRecord = namedtuple('DeviceRecord', ['udn', 'name', 'location', 'type'])
+ZoneRecord = namedtuple('ZoneRecord', ['udn', 'rooms'])
+RoomRecord = namedtuple('RoomRecord', ['udn', 'name', 'renderers'])
+RendererRecord = namedtuple('RendererRecord', ['udn', 'name'])
+
+
+def parseDevices(source):
+    """Parse a listDevices response (file-like object or path) into a tuple of DeviceRecords"""
+    devices = []
+    stack = []
+    for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            continue
+        stack.pop()
+        if element.tag == 'device':
+            devices.append(DeviceRecord(element.get('udn'), element.text or '',
+                                        element.get('location'), element.get('type')))
+            # Drop the element right away, only the record is kept
+            stack[-1].remove(element)
+    return tuple(devices)
+
+
+def parseZones(source):
+    """Parse a getZones response (file-like object or path)
+
+    Returns the tuple (zones, unassigned_rooms) of ZoneRecords and RoomRecords
+    """
+    zones = []
+    unassigned_rooms = []
+    rooms = None  # rooms of the zone which is currently parsed
+    renderers = None  # renderers of the room which is currently parsed
+    in_unassigned = False
+    stack = []
+    for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            stack.append(element)
+            if tag == 'zone':
+                rooms = []
+            elif tag == 'room':
+                renderers = []
+            elif tag == 'unassignedRooms':
+                in_unassigned = True
+            continue
+
+        stack.pop()
+        if tag == 'renderer':
+            if renderers is not None:
+                renderers.append(RendererRecord(element.get('udn'), element.get('name')))
+        elif tag == 'room':
+            room = RoomRecord(element.get('udn'), element.get('name'), tuple(renderers))
+            renderers = None
+            if in_unassigned:
+                unassigned_rooms.append(room)
+                stack[-1].remove(element)
+            elif rooms is not None:
+                rooms.append(room)
+        elif tag == 'zone':
+            zones.append(ZoneRecord(element.get('udn'), tuple(rooms)))
+            rooms = None
+            stack[-1].remove(element)
+        elif tag == 'unassignedRooms':
+            in_unassigned = False
+    return tuple(zones), tuple(unassigned_rooms)
+
+
+DeviceList = namedtuple('DeviceList', ['version', 'update_id', 'devices', 'devices_by_udn'])
+DeviceList.__doc__ = """One listDevices response: the tuple of DeviceRecords and a dict UDN -> DeviceRecord
+
+version counts the responses of this process, update_id is the updateID of the host"""
+ZoneList = namedtuple('ZoneList', ['version', 'update_id', 'zones', 'unassigned'])
+ZoneList.__doc__ = """One getZones response: the tuples of ZoneRecords and unassigned RoomRecords"""
+
+
+ZoneState = namedtuple('ZoneState', ['name', 'location', 'rooms'])  # rooms: tuple of room UDNs
+RoomState = namedtuple('RoomState', ['name', 'zone', 'renderers'])  # zone: UDN or None if unassigned
+RendererState = namedtuple('RendererState', ['name', 'location', 'room'])
+TopologyState = namedtuple('TopologyState', ['zones', 'unassigned', 'rooms', 'renderers', 'unresolved'])
+TopologyState.__doc__ = """Flat description of the topology built from the getZones and listDevices records
+
+zones, rooms and renderers map the UDN to ZoneState, RoomState and RendererState,
+unassigned is the tuple of unassigned room UDNs and unresolved the tuple of UDNs
+which were referenced by getZones but are missing in listDevices"""
+
+EMPTY_TOPOLOGY = TopologyState({}, (), {}, {}, ())
+
+
+def topologyStateToDict(state):
+    """Returns the TopologyState as dict of plain lists and dicts, e.g. to store it as JSON"""
+    return {'zones': {udn: list(zone) for udn, zone in state.zones.items()},
+            'unassigned': list(state.unassigned),
+            'rooms': {udn: list(room) for udn, room in state.rooms.items()},
+            'renderers': {udn: list(renderer) for udn, renderer in state.renderers.items()},
+            'unresolved': list(state.unresolved)}
+
+
+def topologyStateFromDict(data):
+    """Returns the TopologyState of a dict created by topologyStateToDict"""
+    return TopologyState(
+        {udn: ZoneState(name, location, tuple(rooms))
+         for udn, (name, location, rooms) in data['zones'].items()},
+        tuple(data['unassigned']),
+        {udn: RoomState(name, zone, tuple(renderers))
+         for udn, (name, zone, renderers) in data['rooms'].items()},
+        {udn: RendererState(name, location, room)
+         for udn, (name, location, room) in data['renderers'].items()},
+        tuple(data['unresolved']))
+
+
+class TopologyDiff(namedtuple('TopologyDiff', [
+        'zones_added', 'zones_removed', 'zones_changed',
+        'rooms_added', 'rooms_removed', 'rooms_moved', 'rooms_changed',
+        'renderers_added', 'renderers_removed', 'renderers_moved', 'renderers_changed'])):
+    """Structural difference between two TopologyStates
+
+    All fields are tuples of UDNs, except rooms_moved and renderers_moved which contain
+    (udn, old_parent_udn, new_parent_udn) tuples. The parent of an unassigned room is None.
+    *_changed lists the elements whose name or location changed.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return any(self)
+
+
+def buildTopologyState(zone_records, unassigned_records, devices_by_udn):
+    """Combine the getZones records with the DeviceRecords (dict UDN -> DeviceRecord) of listDevices"""
+    zones = {}
+    rooms = {}
+    renderers = {}
+    unresolved = []
+
+    def addRoom(room_record, zone_udn):
+        renderer_udns = []
+        for renderer_record in room_record.renderers:
+            device = devices_by_udn.get(renderer_record.udn)
+            if device is None:
+                unresolved.append(renderer_record.udn)
+                continue
+            renderers[renderer_record.udn] = RendererState(renderer_record.name, device.location,
+                                                           room_record.udn)
+            renderer_udns.append(renderer_record.udn)
+        rooms[room_record.udn] = RoomState(room_record.name, zone_udn, tuple(renderer_udns))
+        return room_record.udn
+
+    for zone_record in zone_records:
+        device = devices_by_udn.get(zone_record.udn)
+        if device is None:
+            unresolved.append(zone_record.udn)
+            continue
+        zones[zone_record.udn] = ZoneState(device.name, device.location, tuple(
+            addRoom(room_record, zone_record.udn) for room_record in zone_record.rooms))
+    unassigned = tuple(addRoom(room_record, None) for room_record in unassigned_records)
+    return TopologyState(zones, unassigned, rooms, renderers, tuple(unresolved))
+
+
+def diffTopology(old, new):
+    """Returns the TopologyDiff needed to get from the TopologyState old to new"""
+    def onlyIn(items, other_items):
+        return tuple(udn for udn in items if udn not in other_items)
+
+    def moved(old_items, new_items, parent):
+        return tuple((udn, getattr(old_items[udn], parent), getattr(item, parent))
+                     for udn, item in new_items.items()
+                     if udn in old_items and getattr(old_items[udn], parent) != getattr(item, parent))
+
+    def changed(old_items, new_items, fields):
+        return tuple(udn for udn, item in new_items.items()
+                     if udn in old_items and
+                     any(getattr(old_items[udn], field) != getattr(item, field) for field in fields))
+
+    return TopologyDiff(
+        zones_added=onlyIn(new.zones, old.zones),
+        zones_removed=onlyIn(old.zones, new.zones),
+        zones_changed=changed(old.zones, new.zones, ('name', 'location')),
+        rooms_added=onlyIn(new.rooms, old.rooms),
+        rooms_removed=onlyIn(old.rooms, new.rooms),
+        rooms_moved=moved(old.rooms, new.rooms, 'zone'),
+        rooms_changed=changed(old.rooms, new.rooms, ('name',)),
+        renderers_added=onlyIn(new.renderers, old.renderers),
+        renderers_removed=onlyIn(old.renderers, new.renderers),
+        renderers_moved=moved(old.renderers, new.renderers, 'room'),
+        renderers_changed=changed(old.renderers, new.renderers, ('name', 'location')))
+
+
+TopologySnapshot = namedtuple('TopologySnapshot', [
+    'zones', 'unassigned_rooms', 'zones_by_udn', 'rooms_by_udn', 'renderers_by_udn',
+    'zone_by_room_udn', 'room_by_renderer_udn', 'state', 'stale', 'version'],
+    defaults=(False, 0))
+TopologySnapshot.__doc__ = """Immutable view of the Zone, Room and Renderer objects
+
+zones and unassigned_rooms are tuples, the *_by_udn fields are read-only mappings and
+state is the TopologyState the snapshot was built from. A new snapshot is published
+for every change and the objects of a published snapshot are never modified: an element
+which changed, or whose rooms or renderers changed, is a new object in the new snapshot.
+So a reader holding a snapshot always sees a consistent topology. stale is True while
+the snapshot was loaded from disk and not yet confirmed by the host. version counts the
+changes of the topology: every snapshot with a new state gets the next number."""
+
+EMPTY_SNAPSHOT = TopologySnapshot((), (), MappingProxyType({}), MappingProxyType({}),
+                                  MappingProxyType({}), MappingProxyType({}),
+                                  MappingProxyType({}), EMPTY_TOPOLOGY)
+
+
+def applyTopologyDiff(snapshot, new, diff, zone_class, room_class, renderer_class):
+    """Returns a new TopologySnapshot for the TopologyState new by applying the diff to the snapshot
+
+    The data of the given snapshot is copied before it is modified (copy-on-write) and its
+    objects are left untouched. New objects are created with the given classes for the elements
+    which were added or changed and for the rooms and zones containing any of them; a new
+    renderer or zone at the same location takes over the SOAP clients of the one it replaces.
+    The other elements are shared with the given snapshot.
+    """
+    old = snapshot.state
+    zones_by_udn = dict(snapshot.zones_by_udn)
+    rooms_by_udn = dict(snapshot.rooms_by_udn)
+    renderers_by_udn = dict(snapshot.renderers_by_udn)
+    zone_by_room_udn = dict(snapshot.zone_by_room_udn)
+    room_by_renderer_udn = dict(snapshot.room_by_renderer_udn)
+
+    # Remove what no longer exists
+    for udn in diff.renderers_removed:
+        del renderers_by_udn[udn]
+        del room_by_renderer_udn[udn]
+    for udn in diff.rooms_removed:
+        del rooms_by_udn[udn]
+        zone_by_room_udn.pop(udn, None)
+    for udn, _, new_zone_udn in diff.rooms_moved:
+        if new_zone_udn is None:
+            del zone_by_room_udn[udn]
+    for udn in diff.zones_removed:
+        del zones_by_udn[udn]
+
+    # Replace the renderers, then the rooms containing a replaced renderer, then the zones
+    # containing a replaced room
+    new_renderers = set(diff.renderers_added) | set(diff.renderers_changed)
+    for udn in new_renderers:
+        renderer_state = new.renderers[udn]
+        renderer = renderer_class(renderer_state.name, udn, renderer_state.location)
+        if udn in renderers_by_udn:
+            renderer._inherit(renderers_by_udn[udn])
+        renderers_by_udn[udn] = renderer
+
+    new_rooms = set(diff.rooms_added) | set(diff.rooms_changed)
+    new_rooms.update(udn for udn, room_state in new.rooms.items()
+                     if udn in old.rooms and (old.rooms[udn].renderers != room_state.renderers or
+                                              not new_renderers.isdisjoint(room_state.renderers)))
+    for udn in new_rooms:
+        room_state = new.rooms[udn]
+        room = room_class(room_state.name, udn)
+        room._setRenderers([renderers_by_udn[renderer_udn]
+                            for renderer_udn in room_state.renderers])
+        rooms_by_udn[udn] = room
+        for renderer_udn in room_state.renderers:
+            room_by_renderer_udn[renderer_udn] = room
+
+    new_zones = set(diff.zones_added) | set(diff.zones_changed)
+    new_zones.update(udn for udn, zone_state in new.zones.items()
+                     if udn in old.zones and (old.zones[udn].rooms != zone_state.rooms or
+                                              not new_rooms.isdisjoint(zone_state.rooms)))
+    for udn in new_zones:
+        zone_state = new.zones[udn]
+        zone = zone_class(zone_state.name, udn, zone_state.location)
+        if udn in zones_by_udn:
+            zone._inherit(zones_by_udn[udn])
+        zone._setRooms([rooms_by_udn[room_udn] for room_udn in zone_state.rooms])
+        zones_by_udn[udn] = zone
+        for room_udn in zone_state.rooms:
+            zone_by_room_udn[room_udn] = zone
+
+    # Replace only the tuples whose members or order changed
+    zones = snapshot.zones
+    if tuple(old.zones) != tuple(new.zones) or new_zones:
+        zones = tuple(zones_by_udn[udn] for udn in new.zones)
+    unassigned_rooms = snapshot.unassigned_rooms
+    if old.unassigned != new.unassigned or not new_rooms.isdisjoint(new.unassigned):
+        unassigned_rooms = tuple(rooms_by_udn[udn] for udn in new.unassigned)
+
+    return TopologySnapshot(zones, unassigned_rooms, MappingProxyType(zones_by_udn),
+                            MappingProxyType(rooms_by_udn), MappingProxyType(renderers_by_udn),
+                            MappingProxyType(zone_by_room_udn),
+                            MappingProxyType(room_by_renderer_udn), new,
+                            version=snapshot.version + 1)
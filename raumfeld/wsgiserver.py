@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent WSGI server for HTTP front-ends like RaumfeldControl
+
+The connections are handled by an asyncio event loop: reading requests,
+keeping idle keep-alive connections open and writing responses needs no
+thread. Only the WSGI application itself is called on a bounded pool of worker
+threads, so a slow SOAP call occupies one worker instead of blocking every
+other client. Paths which mostly wait, like long-polls and event streams, can
+be served by async routes: coroutines running on the event loop itself.
+"""
+
+import asyncio
+import io
+import logging
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+
+_MAX_HEADER_LINES = 100
+_MAX_LINE = 65536
+_REQUEST_TIMEOUT = 30.0  # for the first request of a connection if keep-alive is disabled
+
+
+class _BadRequest(Exception):
+
+    def __init__(self, status, message=''):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def _encodeHead(version, status, headers, content_length, keep_alive):
+    """Returns the status line and headers; without content_length the body ends with the connection"""
+    lines = ['{0} {1}'.format(version, status), 'Date: {0}'.format(formatdate(usegmt=True))]
+    lines.extend('{0}: {1}'.format(name, value) for name, value in headers)
+    if content_length is not None:
+        lines.append('Content-Length: {0}'.format(content_length))
+    if not keep_alive:
+        lines.append('Connection: close')
+    elif version == 'HTTP/1.0':
+        lines.append('Connection: keep-alive')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+class AsyncResponse(object):
+    """Response of an async route: send() a complete response or start() a stream and write()"""
+
+    def __init__(self, writer, version, keep_alive):
+        self._writer = writer
+        self._version = version
+        self.keep_alive = keep_alive
+        self.started = False
+
+    async def send(self, status, headers, body=b''):
+        """Send a complete response, the connection is kept alive"""
+        self.started = True
+        self._writer.write(_encodeHead(self._version, status, headers, len(body), self.keep_alive)
+                           + body)
+        await self._writer.drain()
+
+    async def start(self, status, headers):
+        """Start a response whose body ends when the connection is closed, e.g. an event stream"""
+        self.started = True
+        self.keep_alive = False
+        self._writer.write(_encodeHead(self._version, status, headers, None, False))
+        await self._writer.drain()
+
+    async def write(self, data):
+        """Write a part of a started response; raises ConnectionError if the client is gone"""
+        self._writer.write(data)
+        await self._writer.drain()
+
+
+class WSGIServer(object):
+    """HTTP/1.1 server with keep-alive which runs a WSGI application on a pool of worker threads
+
+    Responses of the application are collected completely before they are sent, so they get a
+    Content-Length and the connection can be kept alive; streams are served by async routes.
+    """
+
+    def __init__(self, app, host='0.0.0.0', port=8080, workers=32, keep_alive=30.0,
+                 max_body=1024 * 1024, async_routes=None):
+        """
+        :param app: WSGI application
+        :param workers: number of threads the application is called on
+        :param keep_alive: seconds an idle connection is kept open, 0 closes it after each response
+        :param max_body: maximum size of a request body in bytes
+        :param async_routes: dict path -> coroutine function(environ, AsyncResponse) which serves
+            the requests of the path on the event loop instead of the application
+        """
+        self._app = app
+        self._asyncRoutes = dict(async_routes or {})
+        self._host = host
+        self._port = port
+        self._keepAlive = keep_alive
+        self._maxBody = max_body
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='raumfeld-wsgi')
+        self._loop = None
+        self._server = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._requests = 0
+        self._active = 0
+
+    @property
+    def port(self):
+        """Port the server listens on, known once it was started"""
+        return self._port
+
+    @property
+    def stats(self):
+        """Returns a dict with the open connections, handled requests and running application calls"""
+        with self._lock:
+            return {'connections': self._connections,
+                    'requests': self._requests,
+                    'active': self._active}
+
+    def addAsyncRoute(self, path, handler):
+        """Serve the path with the coroutine function handler(environ, AsyncResponse)"""
+        self._asyncRoutes[path] = handler
+
+    def serve_forever(self):
+        """Run the server in the calling thread until stop() is called"""
+        asyncio.run(self._serve())
+
+    def start(self):
+        """Run the server in a background thread; returns once it accepts connections"""
+        threading.Thread(target=self.serve_forever, name='raumfeld-wsgi-server',
+                         daemon=True).start()
+        self._started.wait()
+
+    def stop(self):
+        """Stop accepting connections and end serve_forever()"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self._host, self._port,
+                                                  limit=_MAX_LINE)
+        self._port = self._server.sockets[0].getsockname()[1]
+        logging.info("WSGI server listening on {0}:{1}".format(self._host, self._port))
+        self._started.set()
+        try:
+            async with self._server:
+                await self._server.wait_closed()
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def _handle(self, reader, writer):
+        """Serve the requests of one connection"""
+        with self._lock:
+            self._connections += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(self._readRequest(reader, writer),
+                                                     self._keepAlive or _REQUEST_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError,
+                        ValueError):
+                    # idle timeout, closed connection or a line longer than the stream limit
+                    break
+                except _BadRequest as e:
+                    body = str(e).encode('utf-8')
+                    writer.write(_encodeHead(
+                        'HTTP/1.1', '{0} {1}'.format(e.status, HTTPStatus(e.status).phrase),
+                        [], len(body), False) + body)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                environ, version, keep_alive = request
+                keep_alive = keep_alive and self._keepAlive > 0
+                handler = self._asyncRoutes.get(environ['PATH_INFO'])
+                if handler is not None:
+                    with self._lock:
+                        self._requests += 1
+                    keep_alive = await self._callAsyncRoute(handler, environ, writer, version,
+                                                            keep_alive)
+                    continue
+                with self._lock:
+                    self._requests += 1
+                    self._active += 1
+                try:
+                    status, headers, body = await self._loop.run_in_executor(
+                        self._executor, self._callApplication, environ)
+                finally:
+                    with self._lock:
+                        self._active -= 1
+                if environ['REQUEST_METHOD'] == 'HEAD':
+                    # Without a body the Content-Length of the application, if any, is kept
+                    writer.write(_encodeHead(version, status, headers, len(body) or None,
+                                             keep_alive))
+                    await writer.drain()
+                    continue
+                writer.write(_encodeHead(version, status, headers, len(body), keep_alive) + body)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            with self._lock:
+                self._connections -= 1
+            writer.close()
+
+    async def _callAsyncRoute(self, handler, environ, writer, version, keep_alive):
+        """Run an async route; returns whether the connection can be kept alive"""
+        response = AsyncResponse(writer, version, keep_alive)
+        try:
+            await handler(environ, response)
+        except ConnectionError:
+            raise
+        except Exception:
+            logging.exception("Error in the async route {0}".format(environ['PATH_INFO']))
+            if response.started:
+                return False
+        if not response.started:
+            await response.send('500 Internal Server Error', [('Content-Type', 'text/plain')],
+                                b'Internal Server Error')
+        return response.keep_alive
+
+    async def _readRequest(self, reader, writer):
+        """Returns the tuple (environ, HTTP version, keep_alive) or None if the client closed"""
+        request_line = await reader.readline()
+        while request_line in (b'\r\n', b'\n'):  # tolerated between requests
+            request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise _BadRequest(400, "Invalid request line")
+        if version not in ('HTTP/1.0', 'HTTP/1.1'):
+            raise _BadRequest(505)
+
+        headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= _MAX_HEADER_LINES:
+                raise _BadRequest(431)
+            name, separator, value = line.decode('latin-1').partition(':')
+            if not separator:
+                raise _BadRequest(400, "Invalid header line")
+            headers.append((name.strip(), value.strip()))
+
+        environ = self._baseEnviron(writer)
+        path, _, query = target.partition('?')
+        environ.update({'REQUEST_METHOD': method,
+                        'PATH_INFO': urllib.parse.unquote(path, 'latin-1'),
+                        'QUERY_STRING': query,
+                        'SERVER_PROTOCOL': version})
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = environ[key] + ',' + value if key in environ else value
+
+        if environ.get('HTTP_TRANSFER_ENCODING', '').lower() not in ('', 'identity'):
+            raise _BadRequest(501, "Chunked request bodies are not supported")
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise _BadRequest(400, "Invalid Content-Length")
+        if length > self._maxBody:
+            raise _BadRequest(413)
+        if environ.get('HTTP_EXPECT', '').lower() == '100-continue' and length:
+            writer.write('{0} 100 Continue\r\n\r\n'.format(version).encode('latin-1'))
+        environ['wsgi.input'] = io.BytesIO(await reader.readexactly(length) if length else b'')
+
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+        return environ, version, keep_alive
+
+    def _baseEnviron(self, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        return {'SCRIPT_NAME': '',
+                'SERVER_NAME': self._host,
+                'SERVER_PORT': str(self._port),
+                'REMOTE_ADDR': peer[0],
+                'REMOTE_PORT': str(peer[1]),
+                'wsgi.version': (1, 0),
+                'wsgi.url_scheme': 'http',
+                'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False}
+
+    def _callApplication(self, environ):
+        """Call the application on a worker thread; returns the tuple (status, headers, body)"""
+        response = []
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            # Nothing is sent before the application returned, so the headers can always be replaced
+            response[:] = [status, list(headers)]
+            return chunks.append
+
+        try:
+            result = self._app(environ, start_response)
+            try:
+                chunks.extend(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            if not response:
+                raise RuntimeError("The application did not call start_response")
+            status, headers = response
+        except Exception:
+            logging.exception("Error in the WSGI application")
+            return '500 Internal Server Error', [('Content-Type', 'text/plain')], \
+                b'Internal Server Error'
+        # The body is sent with its Content-Length, drop what conflicts with it. The application
+        # answers HEAD without a body, but with the Content-Length of the GET response
+        body = b''.join(chunks)
+        dropped = ('transfer-encoding', 'connection')
+        if body or environ['REQUEST_METHOD'] != 'HEAD':
+            dropped += ('content-length',)
+        headers = [(name, value) for name, value in headers if name.lower() not in dropped]
+        return status, headers, body
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Tests of POST /batch of RaumfeldControl"""
+
+import io
+import json
+import os
+import sys
+
+import bottle
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import raumfeld  # noqa: E402
+import RaumfeldControl  # noqa: E402,F401 - registers the routes
+from raumfeld.topology import buildTopologyState, parseDevices, parseZones  # noqa: E402
+
+RENDERER = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+DEVICES = ('<?xml version="1.0" encoding="utf-8"?><devices>'
+           '<device location="http://127.0.0.1:9/zone.xml" type="{0}" udn="uuid:zone-0">'
+           'Zone</device>'
+           '<device location="http://127.0.0.1:9/speaker.xml" type="{0}" udn="uuid:renderer-0">'
+           'Speaker</device></devices>').format(RENDERER).encode('utf-8')
+ZONES = (b'<?xml version="1.0" encoding="utf-8"?><zoneConfig><zones><zone udn="uuid:zone-0">'
+         b'<room name="Kitchen" udn="uuid:room-0"><renderer name="Speaker" udn="uuid:renderer-0"/>'
+         b'</room></zone></zones><unassignedRooms/></zoneConfig>')
+
+
+@pytest.fixture(scope='module', autouse=True)
+def topology():
+    zones, unassigned = parseZones(io.BytesIO(ZONES))
+    devices = {device.udn: device for device in parseDevices(io.BytesIO(DEVICES))}
+    raumfeld.getDefaultSystem()._publishTopologyState(
+        buildTopologyState(zones, unassigned, devices))
+
+
+def post(path, body):
+    body = body.encode('utf-8')
+    environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080', 'SERVER_PROTOCOL': 'HTTP/1.1',
+               'CONTENT_LENGTH': str(len(body)), 'CONTENT_TYPE': 'application/json',
+               'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr,
+               'wsgi.url_scheme': 'http'}
+    status = []
+    data = b''.join(bottle.default_app()(
+        environ, lambda status_line, headers, exc_info=None: status.append(status_line)))
+    return int(status[0].split()[0]), data
+
+
+def test_batch():
+    status, data = post('/batch', json.dumps([{'room': 'Kitchen', 'action': 'zone'},
+                                              {'room': 'uuid:room-0', 'action': 'zone'}]))
+    assert status == 200
+    zone = {'success': True, 'data': {'udn': 'uuid:zone-0', 'name': 'Zone'}}
+    assert json.loads(data.decode('utf-8')) == {'success': True, 'data': [zone, zone]}
+
+
+def test_malformed_operation():
+    operations = [{'zone': 'uuid:zone-0', 'action': ['pause']},
+                  {'zone': 0, 'action': 'pause'},
+                  {'room': 'Kitchen', 'action': 'zone', 'group': True},
+                  {'room': 'Nowhere', 'action': 'zone'},
+                  {'action': 'pause'},
+                  {'room': 'Kitchen', 'action': 'zone'}]
+    status, data = post('/batch', json.dumps({'operations': operations, 'timeout': 5}))
+    assert status == 200
+    result = json.loads(data.decode('utf-8'))
+    assert not result['success']
+    assert [operation['success'] for operation in result['data']] == [False] * 5 + [True]
+
+
+@pytest.mark.parametrize('timeout', ['true', '-1', 'NaN', 'Infinity', '"5"'])
+def test_bad_timeout(timeout):
+    status, _ = post('/batch', '{"operations": [], "timeout": ' + timeout + '}')
+    assert status == 400
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Tests of the concurrent bulk operations of a RaumfeldSystem"""
+
+import threading
+import time
+
+import pytest
+
+import raumfeld
+from raumfeld.deadline import CancelledError, Cancellation
+from raumfeld.topology import (DeviceRecord, RendererRecord, RoomRecord, ZoneRecord,
+                               buildTopologyState)
+
+MEDIA_RENDERER = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+
+
+class FakeZone(object):
+    """Records the operations called on it"""
+
+    def __init__(self, udn):
+        self.UDN = udn
+        self.operations = []
+        self.volume = 0
+
+    def pause(self):
+        self.operations.append('pause')
+
+    def stop(self):
+        self.operations.append('stop')
+
+
+@pytest.fixture
+def system():
+    raumfeld_system = raumfeld.RaumfeldSystem('127.0.0.1')
+    yield raumfeld_system
+    raumfeld_system.close()
+
+
+def test_targets_run_concurrently(system):
+    targets = ['a', 'b', 'c', 'd']
+    barrier = threading.Barrier(len(targets))
+
+    def function(target):
+        # Only returns if all targets run at the same time
+        barrier.wait(5)
+        return target.upper()
+    results = system.runConcurrently([FakeZone(udn) for udn in targets],
+                                     lambda zone: function(zone.UDN))
+    assert [result.result for result in results] == ['A', 'B', 'C', 'D']
+    assert all(result.success for result in results)
+
+
+def test_errors_are_returned(system):
+    zones = [FakeZone('a'), FakeZone('b')]
+
+    def function(zone):
+        if zone.UDN == 'b':
+            raise ValueError('broken')
+        return zone.UDN
+    ok, failed = system.runConcurrently(zones, function)
+    assert (ok.target, ok.result, ok.error) == (zones[0], 'a', None)
+    assert failed.target is zones[1] and not failed.success
+    assert isinstance(failed.error, ValueError)
+
+
+def test_udn_targets(system):
+    device = DeviceRecord('uuid:zone-1', 'Wohnzimmer', 'http://127.0.0.1:9/zone.xml',
+                          MEDIA_RENDERER)
+    speaker = DeviceRecord('uuid:speaker-1', 'Speaker', 'http://127.0.0.1:9/speaker.xml',
+                           MEDIA_RENDERER)
+    system._publishTopologyState(buildTopologyState(
+        [ZoneRecord('uuid:zone-1', (RoomRecord('uuid:room-1', 'Bad', (
+            RendererRecord('uuid:speaker-1', 'Speaker'),)),))], [],
+        {device.udn: device, speaker.udn: speaker}))
+    results = system.runConcurrently(['uuid:zone-1', 'uuid:room-1', 'uuid:speaker-1',
+                                      'uuid:unknown'], lambda target: type(target).__name__)
+    assert [result.result for result in results[:3]] == ['Zone', 'Room', 'Renderer']
+    assert results[0].target == 'uuid:zone-1'
+    assert isinstance(results[3].error, KeyError)
+
+
+def test_timeout(system):
+    release = threading.Event()
+
+    def function(zone):
+        if zone.UDN == 'slow':
+            release.wait(5)
+        return zone.UDN
+    start = time.monotonic()
+    fast, slow = system.runConcurrently([FakeZone('fast'), FakeZone('slow')], function,
+                                        timeout=0.2)
+    release.set()
+    assert time.monotonic() - start < 2
+    assert fast.result == 'fast'
+    assert isinstance(slow.error, TimeoutError)
+
+
+def test_cancellation(system):
+    cancellation = Cancellation()
+    release = threading.Event()
+    threading.Timer(0.1, cancellation.cancel).start()
+    results = system.runConcurrently([FakeZone('a')], lambda zone: release.wait(5),
+                                     cancellation=cancellation)
+    release.set()
+    assert isinstance(results[0].error, CancelledError)
+
+
+def test_volumes_and_transport(system):
+    zones = [FakeZone('a'), FakeZone('b')]
+    results = system.setVolumes({zones[0]: 20, zones[1]: 30})
+    assert all(result.success for result in results)
+    assert [zone.volume for zone in zones] == [20, 30]
+    system.pauseZones(zones)
+    system.stopZones(zones[1:])
+    assert [zone.operations for zone in zones] == [['pause'], ['pause', 'stop']]
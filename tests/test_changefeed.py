@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Tests of the versioned change feed and its cursors"""
+
+import asyncio
+import threading
+
+import pytest
+
+from raumfeld.changefeed import ChangeFeed
+
+
+def test_changes_since():
+    feed = ChangeFeed(maxlen=2)
+    assert feed.changesSince(0) == (0, [])
+    for version in (1, 2, 3):
+        feed.publish(version, 'diff {0}'.format(version))
+    assert feed.changesSince(1) == (3, [(2, 'diff 2'), (3, 'diff 3')])
+    assert feed.changesSince(3) == (3, [])
+    # Version 1 is no longer kept, 7 was never published
+    assert feed.changesSince(0) == (3, None)
+    assert feed.changesSince(7) == (3, None)
+    assert feed.changesSince(None) == (3, None)
+
+
+def test_cursor():
+    feed = ChangeFeed()
+    feed.publish(1, 'diff 1')
+    assert feed.cursor() == '{0}:1'.format(feed.epoch)
+    assert feed.versionOf(feed.cursor()) == 1
+    assert feed.versionOf(feed.cursor(0)) == 0
+    for invalid in ('', '1', 'x:', 'x:-1', 'x:1.5'):
+        with pytest.raises(ValueError):
+            feed.versionOf(invalid)
+
+
+def test_cursor_of_another_process():
+    feed, restarted = ChangeFeed(), ChangeFeed()
+    assert feed.epoch != restarted.epoch
+    for version in (1, 2):
+        feed.publish(version, 'diff {0}'.format(version))
+    restarted.publish(1, 'other diff')
+    restarted.publish(2, 'other diff')
+    restarted.publish(3, 'other diff')
+    # The version 2 of the old process is older than 3, but not the same change
+    since = restarted.versionOf(feed.cursor())
+    assert since is None
+    assert restarted.changesSince(since) == (3, None)
+
+
+def test_wait():
+    feed = ChangeFeed()
+    threading.Timer(0.05, feed.publish, (1, 'diff 1')).start()
+    assert feed.wait(0, 5) == 1
+    assert feed.wait(1, 0.01) == 1
+
+    async def waitAsync():
+        asyncio.get_running_loop().call_later(0.05, feed.publish, 2, 'diff 2')
+        return await feed.waitAsync(1, 5)
+    assert asyncio.run(waitAsync()) == 2
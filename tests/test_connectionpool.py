@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Tests of the stale connection handling of the ConnectionPool against a local HTTP responder"""
+
+import http.client
+import socketserver
+import threading
+import time
+
+import pytest
+
+from raumfeld.connectionpool import ConnectionPool
+
+
+class Responder(socketserver.ThreadingTCPServer):
+    """Keep-alive HTTP responder
+
+    behaviour(connection, request), both counting from 1, returns 'answer', 'drop' to close the
+    connection without an answer or 'close' to close it after the answer, like an idle timeout
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.requests = []  # (connection, method, path)
+        self.connections = 0
+        self.lock = threading.Lock()
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), Handler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/ctrl'.format(self.server_address[1])
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+            connection = self.server.connections
+        request = 0
+        while True:
+            request_line = self.rfile.readline()
+            if not request_line:
+                return
+            length = 0
+            while True:
+                line = self.rfile.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            self.rfile.read(length)
+            request += 1
+            method, path = request_line.decode('latin-1').split()[:2]
+            with self.server.lock:
+                self.server.requests.append((connection, method, path))
+            action = self.server.behaviour(connection, request)
+            if action == 'drop':
+                return
+            self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            if action == 'close':
+                return
+
+
+@pytest.fixture
+def responder():
+    servers = []
+
+    def start(behaviour=lambda connection, request: 'answer'):
+        server = Responder(behaviour)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_reuses_connections(responder):
+    server = responder()
+    pool = ConnectionPool()
+    for _ in range(3):
+        assert pool.request(server.url, 'POST', b'x')[2] == b'ok'
+    assert pool.stats['created'] == 1
+    assert pool.stats['reused'] == 2
+
+
+def test_idle_connection_closed_by_the_device_is_replaced(responder):
+    server = responder(lambda connection, request: 'close' if connection == 1 else 'answer')
+    pool = ConnectionPool()
+    pool.request(server.url, 'POST', b'x')
+    time.sleep(0.1)
+    # The closed connection is detected before the request is sent on it
+    assert pool.request(server.url, 'POST', b'x')[2] == b'ok'
+    assert [connection for connection, _, _ in server.requests] == [1, 2]
+    assert pool.stats['reused'] == 0
+
+
+def test_post_is_not_sent_twice(responder):
+    # The device receives the second request on the reused connection but closes it unanswered
+    server = responder(lambda connection, request:
+                       'drop' if (connection, request) == (1, 2) else 'answer')
+    pool = ConnectionPool()
+    pool.request(server.url, 'POST', b'x')
+    with pytest.raises(http.client.RemoteDisconnected):
+        pool.request(server.url, 'POST', b'SetVolume')
+    assert [method for _, method, _ in server.requests] == ['POST', 'POST']
+
+
+def test_get_is_retried_on_a_new_connection(responder):
+    server = responder(lambda connection, request:
+                       'drop' if (connection, request) == (1, 2) else 'answer')
+    pool = ConnectionPool()
+    pool.request(server.url)
+    assert pool.request(server.url)[2] == b'ok'
+    assert [connection for connection, _, _ in server.requests] == [1, 1, 2]
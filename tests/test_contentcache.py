@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Tests of the ContentDirectoryCache and the cached browse of the MediaServer"""
+
+import time
+import types
+
+import pytest
+
+import raumfeld
+from raumfeld.contentcache import ContentDirectoryCache
+
+
+class FakeContentDirectory(object):
+    """ContentDirectory SoapClient counting the Browse requests
+
+    Containers are a dict container ID -> (UpdateID, Result)
+    """
+
+    def __init__(self):
+        self.system_update_id = '1'
+        self.containers = {'0/Favorites': ('7', '<DIDL-Lite>favourites</DIDL-Lite>')}
+        self.browses = 0
+
+    def GetSystemUpdateID(self):
+        return types.SimpleNamespace(Id=self.system_update_id)
+
+    def Browse(self, ObjectID, BrowseFlag, Filter, StartingIndex, RequestedCount, SortCriteria):
+        self.browses += 1
+        update_id, result = self.containers[ObjectID]
+        return types.SimpleNamespace(Result=result, NumberReturned='1', UpdateID=update_id)
+
+
+@pytest.fixture
+def mediaServer():
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    system.configureContentDirectoryCache(systemUpdateInterval=0)
+    server = raumfeld.MediaServer('uuid:media-server', 'http://127.0.0.1:9/ms.xml', system)
+    server._soapClients = {'ContentDirectory': FakeContentDirectory()}
+    yield server
+    system.close()
+
+
+def test_browse_is_cached(mediaServer):
+    contentDirectory = mediaServer._soapClients['ContentDirectory']
+    for _ in range(3):
+        assert mediaServer.browse_children('0/Favorites') == \
+            ('<DIDL-Lite>favourites</DIDL-Lite>', '1')
+    assert contentDirectory.browses == 1
+    # Other arguments are another entry
+    mediaServer.browse_children('0/Favorites', starting_index='25')
+    assert contentDirectory.browses == 2
+
+
+def test_system_update_id_change_invalidates(mediaServer):
+    contentDirectory = mediaServer._soapClients['ContentDirectory']
+    mediaServer.browse_children('0/Favorites')
+    contentDirectory.system_update_id = '2'
+    contentDirectory.containers['0/Favorites'] = ('8', '<DIDL-Lite>changed</DIDL-Lite>')
+    assert mediaServer.browse_children('0/Favorites')[0] == '<DIDL-Lite>changed</DIDL-Lite>'
+    assert contentDirectory.browses == 2
+    assert mediaServer._system.getContentDirectoryCacheStats()['invalidations'] == 1
+
+
+def test_container_update_id_invalidates():
+    cache = ContentDirectoryCache()
+    cache.put(('0/Favorites', 'first page'), 'a', '7')
+    cache.put(('0/Favorites', 'second page'), 'b', '7')
+    cache.put(('0/Radio', 'first page'), 'c', '3')
+    # A response with a new UpdateID of the container drops the other pages
+    cache.put(('0/Favorites', 'first page'), 'A', '8')
+    assert cache.get(('0/Favorites', 'second page')) is None
+    assert cache.get(('0/Favorites', 'first page')) == 'A'
+    cache.containerUpdated('0/Favorites', '8')
+    assert cache.get(('0/Favorites', 'first page')) == 'A'
+    cache.containerUpdated('0/Favorites', '9')
+    assert cache.get(('0/Favorites', 'first page')) is None
+    assert cache.get(('0/Radio', 'first page')) == 'c'
+    assert cache.stats['invalidations'] == 3
+
+
+def test_system_update_id():
+    cache = ContentDirectoryCache(system_update_interval=60)
+    assert cache.systemUpdateCheckDue()
+    cache.systemUpdated('1')
+    cache.put(('0/Favorites',), 'a')
+    assert not cache.systemUpdateCheckDue()
+    cache.systemUpdated('1')
+    assert cache.get(('0/Favorites',)) == 'a'
+    cache.systemUpdated('2')
+    assert cache.get(('0/Favorites',)) is None
+
+
+def test_ttl_and_memory_cap():
+    cache = ContentDirectoryCache(ttl=0.05)
+    cache.put(('0/Favorites',), 'a')
+    assert cache.get(('0/Favorites',)) == 'a'
+    time.sleep(0.1)
+    assert cache.get(('0/Favorites',)) is None
+
+    value = 'x' * 1000
+    cache = ContentDirectoryCache(max_bytes=3500)
+    for container in ('a', 'b', 'c'):
+        cache.put((container,), value)
+    cache.get(('a',))  # the least recently used is b now
+    cache.put(('d',), value)
+    assert [cache.get((container,)) is not None for container in 'abcd'] == \
+        [True, False, True, True]
+    assert cache.stats['evictions'] == 1
+    assert cache.stats['size'] <= 3500
+    # Too large to be cached at all
+    cache.put(('e',), 'x' * 5000)
+    assert cache.get(('e',)) is None
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Tests of the deadlines and cancellation of the network operations"""
+
+import asyncio
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import raumfeld
+from raumfeld import aio
+from raumfeld.deadline import (CancelledError, Cancellation, deadline, getDefaultTimeout,
+                               remaining, runInContext, setDefaultTimeout, withTimeout)
+
+
+@pytest.fixture
+def silentHost():
+    """Port of a host which accepts connections but never answers"""
+    with socket.socket() as silent:
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(8)
+        yield silent.getsockname()[1]
+
+
+def test_nested_deadlines():
+    assert remaining() == getDefaultTimeout()
+    with deadline(10):
+        assert 9 < remaining() <= 10
+        with deadline(1):
+            assert remaining() <= 1
+        # An inner scope can not extend the deadline
+        with deadline(100):
+            assert remaining() <= 10
+        with deadline(None):
+            assert remaining() <= 10
+    assert remaining() == getDefaultTimeout()
+
+
+def test_default_timeout():
+    previous = getDefaultTimeout()
+    setDefaultTimeout(5)
+    try:
+        assert remaining() == 5
+    finally:
+        setDefaultTimeout(previous)
+
+
+def test_expired_and_cancelled():
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(TimeoutError):
+            remaining()
+    cancellation = Cancellation()
+    with deadline(cancellation=cancellation):
+        remaining()
+        cancellation.cancel()
+        assert cancellation.cancelled and cancellation.future.done()
+        with pytest.raises(CancelledError):
+            remaining()
+    remaining()
+
+
+def test_with_timeout():
+    @withTimeout
+    def operation(value):
+        return value, remaining()
+    assert operation('a') == ('a', getDefaultTimeout())
+    value, left = operation('b', timeout=2)
+    assert value == 'b' and left <= 2
+
+
+def test_propagation_to_threads_and_tasks():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with deadline(2):
+            inherited = executor.submit(runInContext(remaining)).result()
+            plain = executor.submit(remaining).result()
+    assert inherited <= 2
+    assert plain == getDefaultTimeout()
+
+    async def run():
+        with deadline(3):
+            return await asyncio.ensure_future(asyncio.sleep(0, remaining()))
+    assert asyncio.run(run()) <= 3
+
+
+def test_bulk_operations_run_with_the_deadline():
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    try:
+        results = system.runConcurrently([object()], lambda target: remaining(), timeout=2)
+    finally:
+        system.close()
+    assert results[0].success and results[0].result <= 2
+
+
+def test_soap_call_to_a_silent_device(silentHost):
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    renderer = raumfeld.Renderer('Speaker', 'uuid:renderer-1',
+                                 'http://127.0.0.1:{0}/speaker.xml'.format(silentHost), system)
+    start = time.monotonic()
+    try:
+        with pytest.raises(TimeoutError):
+            renderer.pause(timeout=0.3)
+    finally:
+        system.close()
+    # The description request and the SOAP request share the deadline
+    assert time.monotonic() - start < 1.5
+
+
+def test_aio_call_to_a_silent_device(silentHost):
+    renderer = aio.Renderer('Speaker', 'uuid:renderer-1',
+                            'http://127.0.0.1:{0}/speaker.xml'.format(silentHost))
+
+    async def run():
+        with deadline(0.3):
+            await renderer.pause()
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
+    assert time.monotonic() - start < 1.5
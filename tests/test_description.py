@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Tests of the device descriptions: one fetch per location and the control URLs taken from them"""
+
+import asyncio
+import http.server
+import threading
+import time
+
+import pytest
+
+import raumfeld
+from raumfeld import aio
+from raumfeld.description import DescriptionCache
+
+DESCRIPTION = b'''<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0"><device>
+<UDN>uuid:renderer-1</UDN><friendlyName>Speaker</friendlyName><serviceList>
+<service><serviceType>urn:schemas-upnp-org:service:RenderingControl:1</serviceType>
+<serviceId>urn:upnp-org:serviceId:RenderingControl</serviceId>
+<controlURL>/described/rc</controlURL><eventSubURL>/described/rc/evt</eventSubURL></service>
+<service><serviceType>urn:schemas-upnp-org:service:AVTransport:1</serviceType>
+<serviceId>urn:upnp-org:serviceId:AVTransport</serviceId>
+<controlURL>/described/avt</controlURL><eventSubURL>/described/avt/evt</eventSubURL></service>
+</serviceList></device></root>'''
+
+
+class FakePool(object):
+    """request() of a ConnectionPool answering with the description after a delay
+
+    The first failures requests raise ConnectionRefusedError. Records the number of requests
+    and the most running at the same time.
+    """
+
+    def __init__(self, failures=0, delay=0.05):
+        self.failures = failures
+        self.delay = delay
+        self.requests = 0
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+
+    def request(self, url, method='GET', body=None, headers=None, timeout=None):
+        with self.lock:
+            self.requests += 1
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            failed = self.requests <= self.failures
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        if failed:
+            raise ConnectionRefusedError()
+        return 200, {}, DESCRIPTION
+
+
+def getConcurrently(cache, location, count=5, interval=0):
+    """Returns the UDNs or errors of count concurrent gets, started every interval seconds"""
+    results = []
+
+    def get():
+        try:
+            results.append(cache.get(location).udn)
+        except OSError as e:
+            results.append(e)
+    threads = [threading.Thread(target=get) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(interval)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_one_fetch_for_concurrent_requests():
+    pool = FakePool()
+    cache = DescriptionCache(pool)
+    assert getConcurrently(cache, 'http://127.0.0.1:9/speaker.xml') == ['uuid:renderer-1'] * 5
+    assert pool.requests == 1
+    assert cache.stats['entries'] == 1
+
+
+def test_failed_fetches_are_retried_one_at_a_time():
+    pool = FakePool(failures=2)
+    cache = DescriptionCache(pool)
+    # Some requests only start while the first retry is running
+    results = getConcurrently(cache, 'http://127.0.0.1:9/speaker.xml', interval=0.02)
+    assert [isinstance(result, ConnectionRefusedError) for result in results] == \
+        [True, True, False, False, False]
+    assert (pool.requests, pool.most_running) == (3, 1)
+
+
+def test_default_paths_are_not_kept_after_a_failed_fetch():
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    pool = FakePool(failures=1, delay=0)
+    system._descriptionCache = DescriptionCache(pool)
+    renderer = raumfeld.Renderer('Speaker', 'uuid:renderer-1', 'http://127.0.0.1:9/speaker.xml',
+                                 system)
+    assert renderer._renderingControl.location == 'http://127.0.0.1:9/RenderingControl/ctrl'
+    assert renderer._renderingControl.location == 'http://127.0.0.1:9/described/rc'
+    assert renderer._avTransport.location == 'http://127.0.0.1:9/described/avt'
+    assert pool.requests == 2
+    system.close()
+
+
+class DescriptionServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), DescriptionHandler)
+        self.requests = 0
+
+    @property
+    def location(self):
+        return 'http://127.0.0.1:{0}/speaker.xml'.format(self.server_address[1])
+
+
+class DescriptionHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(0.05)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(DESCRIPTION)))
+        self.end_headers()
+        self.wfile.write(DESCRIPTION)
+
+
+@pytest.fixture
+def server():
+    description_server = DescriptionServer()
+    threading.Thread(target=description_server.serve_forever, daemon=True).start()
+    yield description_server
+    description_server.shutdown()
+    description_server.server_close()
+
+
+def test_aio_one_fetch_for_concurrent_requests(server):
+    cache = aio.DescriptionCache()
+
+    async def run():
+        return await asyncio.gather(*(cache.get(server.location) for _ in range(5)))
+    assert [description.udn for description in asyncio.run(run())] == ['uuid:renderer-1'] * 5
+    assert server.requests == 1
+    assert cache._fetches == {}
+
+
+def test_aio_control_urls_from_the_description(server):
+    renderer = aio.Renderer('Speaker', 'uuid:renderer-1', server.location)
+    services = renderer._renderingControl, renderer._avTransport
+    # Rebuilt only if the location changes
+    renderer.reinit('Renamed', 'uuid:renderer-1', server.location)
+    assert (renderer._renderingControl, renderer._avTransport) == services
+    renderer.reinit('Renamed', 'uuid:renderer-1', server.location + '?moved')
+    assert renderer._renderingControl is not services[0]
+
+    async def run():
+        description = await aio.getDescriptionCache().get(server.location)
+        return renderer._avTransport._createService(description)._location
+    assert asyncio.run(run()) == server.location.replace('/speaker.xml', '/described/avt')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Tests of the DIDL-Lite object model and the paged iteration over browse results"""
+
+import types
+
+import pytest
+
+import raumfeld
+from raumfeld.didl import UPNP_NS, DidlContainer, DidlItem, parseDidl, parseDidlObject
+
+DIDL = ('<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">{0}</DIDL-Lite>')
+TRACK = DIDL.format(
+    '<item id="0/My Music/Track/1" parentID="0/My Music/Track" restricted="1">'
+    '<dc:title>Rock &amp; Roll &lt;Live&gt; &#8211; K&#246;ln</dc:title>'
+    '<upnp:class>object.item.audioItem.musicTrack</upnp:class>'
+    '<upnp:artist><![CDATA[AC/DC & Friends]]></upnp:artist>'
+    '<upnp:originalTrackNumber>3</upnp:originalTrackNumber>'
+    '<res protocolInfo="http-get:*:audio/mpeg:*" duration="0:03:25.000" size="4096">'
+    ' http://127.0.0.1:9/track.mp3?a=1&amp;b=2 </res>'
+    '<res protocolInfo="http-get:*:audio/flac:*">http://127.0.0.1:9/track.flac</res></item>')
+
+
+def test_escaped_fields():
+    track = parseDidlObject(TRACK)
+    assert isinstance(track, DidlItem)
+    assert (track.id, track.parent_id, track.restricted) == \
+        ('0/My Music/Track/1', '0/My Music/Track', True)
+    assert track.title == 'Rock & Roll <Live> – Köln'
+    assert track.artist == 'AC/DC & Friends'
+    assert track.upnp_class == 'object.item.audioItem.musicTrack'
+    assert track.get(UPNP_NS, 'originalTrackNumber') == '3'
+    assert track.uri == 'http://127.0.0.1:9/track.mp3?a=1&b=2'
+    assert track.duration == '0:03:25.000'
+    assert [(resource.protocol_info, resource.size) for resource in track.resources] == \
+        [('http-get:*:audio/mpeg:*', '4096'), ('http-get:*:audio/flac:*', None)]
+
+
+def test_missing_fields():
+    item = parseDidlObject(DIDL.format('<item id="1"><dc:title/></item>'))
+    assert item.title == ''
+    assert (item.parent_id, item.restricted, item.ref_id) == (None, False, None)
+    for name in ('upnp_class', 'creator', 'artist', 'album', 'genre', 'album_art_uri', 'uri',
+                 'duration'):
+        assert getattr(item, name) is None
+    assert item.resources == ()
+    container = parseDidlObject(DIDL.format('<container id="0/Radio" searchable="true"/>'))
+    assert isinstance(container, DidlContainer)
+    assert (container.title, container.child_count, container.searchable) == (None, None, True)
+    assert parseDidlObject(DIDL.format(
+        '<container id="0/Radio" childCount="12"/>')).child_count == 12
+
+
+@pytest.mark.parametrize('metadata', ['', None, 'NOT_IMPLEMENTED', '<DIDL-Lite', DIDL.format('')])
+def test_no_objects(metadata):
+    assert parseDidl(metadata) == ()
+    assert parseDidlObject(metadata) is None
+
+
+def test_lazy_and_memoized():
+    objects = parseDidl(DIDL.format('<container id="a"/><desc/><item id="b"/>'))
+    assert [type(didl_object) for didl_object in objects] == [DidlContainer, DidlItem]
+    track = parseDidlObject(TRACK)
+    assert parseDidlObject(TRACK) is track
+    uncached = parseDidl.__wrapped__(TRACK)[0]
+    assert uncached is not track
+    with pytest.raises(AttributeError):
+        uncached._album
+    assert uncached.album is None
+    assert uncached._album is None
+
+
+def test_iter_children_pages():
+    pages = []
+
+    def Browse(ObjectID, BrowseFlag, Filter, StartingIndex, RequestedCount, SortCriteria):
+        pages.append(int(StartingIndex))
+        first = int(StartingIndex)
+        items = ''.join('<item id="{0}"><dc:title>Track {0}</dc:title></item>'.format(index)
+                        for index in range(first, min(first + int(RequestedCount), 5)))
+        return types.SimpleNamespace(Result=DIDL.format(items),
+                                     NumberReturned=str(items.count('<item')), TotalMatches='5')
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    server = raumfeld.MediaServer('uuid:media-server', 'http://127.0.0.1:9/ms.xml', system)
+    server._soapClients = {'ContentDirectory': types.SimpleNamespace(Browse=Browse)}
+    try:
+        titles = [item.title for item in server.iter_children('0/Playlists', page_size=2)]
+    finally:
+        system.close()
+    assert titles == ['Track {0}'.format(index) for index in range(5)]
+    assert pages == [0, 2, 4]
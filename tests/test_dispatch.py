@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Tests of the asynchronous delivery of change notifications to multiple listeners"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import raumfeld
+from raumfeld.dispatch import COALESCE, DROP_OLDEST, Dispatcher, Listener
+from raumfeld.topology import (EMPTY_TOPOLOGY, DeviceRecord, RendererRecord, RoomRecord,
+                               ZoneRecord, buildTopologyState, diffTopology)
+
+
+def waitFor(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=False)
+
+
+class BlockedCallback(object):
+    """Records the events; the first call blocks until release() is called"""
+
+    def __init__(self):
+        self.events = []
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, event):
+        self.started.set()
+        self.released.wait(5)
+        self.events.append(event)
+
+    def release(self):
+        self.released.set()
+
+
+def test_every_listener_gets_all_events_in_order(executor):
+    dispatcher = Dispatcher(executor)
+    received = [[], []]
+    for events in received:
+        dispatcher.add(events.append)
+    for event in range(10):
+        dispatcher.publish(event)
+    assert waitFor(lambda: received == [list(range(10))] * 2)
+
+
+def test_a_slow_listener_delays_no_one(executor):
+    dispatcher = Dispatcher(executor)
+    slow = BlockedCallback()
+    fast = []
+    dispatcher.add(slow)
+    dispatcher.add(fast.append)
+    start = time.monotonic()
+    dispatcher.publish(1)
+    assert slow.started.wait(5)
+    dispatcher.publish(2)
+    # publish never blocks and the other listener is served while the slow one is busy
+    assert time.monotonic() - start < 1
+    assert waitFor(lambda: fast == [1, 2])
+    slow.release()
+    assert waitFor(lambda: slow.events == [1, 2])
+
+
+def test_coalesce(executor):
+    slow = BlockedCallback()
+    listener = Listener(slow, executor, maxsize=3, policy=COALESCE,
+                        merge=lambda old, new: old + new)
+    listener.publish([0])
+    assert slow.started.wait(5)
+    for event in range(1, 6):
+        listener.publish([event])
+    slow.release()
+    # 1-3 fill the queue, 4 merges them, 5 is queued after the merged event
+    assert waitFor(lambda: slow.events == [[0], [1, 2, 3, 4], [5]])
+    assert listener.stats['coalesced'] == 3
+    assert listener.stats['delivered'] == 3
+
+
+def test_drop_oldest(executor):
+    slow = BlockedCallback()
+    listener = Listener(slow, executor, maxsize=2, policy=DROP_OLDEST)
+    listener.publish(0)
+    assert slow.started.wait(5)
+    for event in range(1, 5):
+        listener.publish(event)
+    slow.release()
+    assert waitFor(lambda: slow.events == [0, 3, 4])
+    assert listener.stats['dropped'] == 2
+
+
+def test_failing_callback(executor, caplog):
+    events = []
+
+    def callback(event):
+        if event == 1:
+            raise ValueError('broken')
+        events.append(event)
+    listener = Listener(callback, executor)
+    with caplog.at_level(logging.ERROR, logger='root'):
+        for event in range(3):
+            listener.publish(event)
+        assert waitFor(lambda: events == [0, 2])
+    assert listener.stats['errors'] == 1
+    assert "Change listener" in caplog.text
+
+
+def test_removed_listener_gets_nothing(executor):
+    dispatcher = Dispatcher(executor)
+    slow = BlockedCallback()
+    listener = dispatcher.add(slow)
+    dispatcher.publish(1)
+    assert slow.started.wait(5)
+    dispatcher.publish(2)
+    dispatcher.remove(listener)
+    dispatcher.publish(3)
+    slow.release()
+    assert waitFor(lambda: slow.events == [1])
+    time.sleep(0.05)
+    assert slow.events == [1]
+    assert len(dispatcher) == 0
+
+
+def test_invalid_policy(executor):
+    with pytest.raises(ValueError):
+        Listener(print, executor, policy='newest')
+
+
+def test_coalesced_topology_changes():
+    device = DeviceRecord('zone-1', 'Wohnzimmer', 'http://127.0.0.1:9/zone.xml',
+                          'urn:schemas-upnp-org:device:MediaRenderer:1')
+
+    def state(rooms):
+        devices = {device.udn: device}
+        for room in rooms:
+            devices[room + '-speaker'] = device._replace(udn=room + '-speaker')
+        return buildTopologyState([ZoneRecord('zone-1', tuple(
+            RoomRecord(room, room, (RendererRecord(room + '-speaker', room),)) for room in rooms))],
+            [], devices)
+    states = [state(['room-1']), state(['room-1', 'room-2']), state(['room-2']),
+              state(['room-2', 'room-3'])]
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    slow = BlockedCallback()
+    listener = system.addTopologyListener(slow, maxQueue=1)
+    try:
+        system._publishTopologyState(states[0])
+        assert slow.started.wait(5)
+        for topology_state in states[1:]:
+            system._publishTopologyState(topology_state)
+        slow.release()
+        # The queued changes arrive as one diff from the oldest to the newest state
+        assert waitFor(lambda: len(slow.events) == 2)
+        assert slow.events == [diffTopology(EMPTY_TOPOLOGY, states[0]),
+                               diffTopology(states[0], states[3])]
+        assert system.getListenerStats() == [listener.stats]
+    finally:
+        system.close()
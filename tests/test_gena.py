@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Tests of the EventManager against a fake device answering SUBSCRIBE and UNSUBSCRIBE"""
+
+import http.client
+import http.server
+import threading
+import time
+import urllib.parse
+from xml.sax.saxutils import escape
+
+import pytest
+
+from raumfeld.connectionpool import ConnectionPool
+from raumfeld.gena import EventManager, parseLastChange, parsePropertySet
+
+KEY = ('uuid:renderer-1', 'RenderingControl')
+
+LAST_CHANGE = ('<Event xmlns="urn:schemas-upnp-org:metadata-1-0/RCS/">'
+               '<InstanceID val="0">{0}</InstanceID></Event>')
+
+
+def propertySet(last_change):
+    return ('<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0"><e:property>'
+            '<LastChange>{0}</LastChange></e:property></e:propertyset>').format(
+                escape(LAST_CHANGE.format(last_change))).encode('utf-8')
+
+
+class FakeDevice(http.server.ThreadingHTTPServer):
+    """Event subscription URL of a device; records (method, headers) of every request
+
+    timeout is the TIMEOUT granted, renew_status the answer to renewals and with down set
+    every connection is closed without an answer
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), FakeDeviceHandler)
+        self.requests = []
+        self.timeout = 300
+        self.renew_status = 200
+        self.down = False
+        self.sids = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/RenderingControl/evt'.format(self.server_address[1])
+
+    def subscribes(self):
+        return [headers for method, headers in self.requests if method == 'SUBSCRIBE']
+
+
+class FakeDeviceHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def answer(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_SUBSCRIBE(self):
+        if self.server.down:
+            self.close_connection = True
+            return
+        self.server.requests.append(('SUBSCRIBE', dict(self.headers)))
+        if self.headers.get('SID'):
+            if self.server.renew_status != 200:
+                self.answer(self.server.renew_status)
+                return
+            sid = self.headers['SID']
+        else:
+            self.server.sids += 1
+            sid = 'uuid:sub-{0}'.format(self.server.sids)
+        self.answer(200, [('SID', sid), ('TIMEOUT', 'Second-{0}'.format(self.server.timeout))])
+
+    def do_UNSUBSCRIBE(self):
+        self.server.requests.append(('UNSUBSCRIBE', dict(self.headers)))
+        self.answer(200)
+
+
+def waitFor(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def notify(manager, callback, sid, seq, body):
+    """Send a NOTIFY to the callback URL; returns the HTTP status"""
+    path = urllib.parse.urlparse(callback.strip('<>')).path
+    connection = http.client.HTTPConnection('127.0.0.1', manager.port, timeout=5)
+    try:
+        connection.request('NOTIFY', path, body, {'NT': 'upnp:event', 'NTS': 'upnp:propchange',
+                                                  'SID': sid, 'SEQ': str(seq)})
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def device():
+    server = FakeDevice()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def manager(device):
+    event_manager = EventManager(ConnectionPool(), timeout=300, address='127.0.0.1',
+                                 retry_interval=60.0)
+    event_manager.start()
+    yield event_manager
+    event_manager.stop()
+
+
+def subscribe(manager, device):
+    """Subscribe to the device; returns the headers of the SUBSCRIBE request"""
+    manager.setTargets({KEY: device.url})
+    assert waitFor(lambda: manager.stats['subscriptions'] == 1)
+    return device.subscribes()[-1]
+
+
+def test_parse_last_change_keeps_the_master_channel():
+    variables = parseLastChange(LAST_CHANGE.format(
+        '<Volume channel="Master" val="17"/><Volume channel="LF" val="5"/>'
+        '<Mute channel="Master" val="0"/><TransportState val="PLAYING"/>'))
+    assert variables == {'Volume': '17', 'Mute': '0', 'TransportState': 'PLAYING'}
+    assert parseLastChange('') == {}
+
+
+def test_parse_property_set_expands_last_change():
+    assert parsePropertySet(propertySet('<Volume channel="Master" val="30"/>')) == {'Volume': '30'}
+
+
+def test_subscribe(manager, device):
+    headers = subscribe(manager, device)
+    assert headers['NT'] == 'upnp:event'
+    assert headers['TIMEOUT'] == 'Second-300'
+    assert headers['CALLBACK'].startswith('<http://127.0.0.1:{0}/'.format(manager.port))
+    # No state until the initial event arrived
+    assert manager.getState(*KEY) is None
+
+
+def test_notify_updates_the_state(manager, device):
+    headers = subscribe(manager, device)
+    callback = headers['CALLBACK']
+    body = propertySet('<Volume channel="Master" val="17"/><Mute channel="Master" val="0"/>')
+    assert notify(manager, callback, 'uuid:sub-1', 0, body) == 200
+    assert manager.getState(*KEY) == {'Volume': '17', 'Mute': '0'}
+    assert notify(manager, callback, 'uuid:sub-1', 1,
+                  propertySet('<Volume channel="Master" val="20"/>')) == 200
+    assert manager.getState(*KEY) == {'Volume': '20', 'Mute': '0'}
+    # Events with an unknown SID are rejected
+    assert notify(manager, callback, 'uuid:other', 2,
+                  propertySet('<Volume channel="Master" val="99"/>')) == 412
+    assert manager.getState(*KEY)['Volume'] == '20'
+    assert manager.stats['events'] == 2
+
+
+def test_seq_gap_resubscribes(manager, device):
+    callback = subscribe(manager, device)['CALLBACK']
+    notify(manager, callback, 'uuid:sub-1', 0, propertySet('<Volume channel="Master" val="17"/>'))
+    assert notify(manager, callback, 'uuid:sub-1', 2,
+                  propertySet('<Volume channel="Master" val="18"/>')) == 200
+    # The state is incomplete after a missed event
+    assert manager.getState(*KEY) is None
+    assert waitFor(lambda: len(device.subscribes()) == 2)
+    assert [method for method, _ in device.requests] == ['SUBSCRIBE', 'UNSUBSCRIBE', 'SUBSCRIBE']
+    new_callback = device.subscribes()[-1]['CALLBACK']
+    assert new_callback != callback
+    assert waitFor(lambda: manager.stats['subscriptions'] == 1)
+    # Late events of the cancelled subscription are rejected, the new one starts over
+    assert notify(manager, callback, 'uuid:sub-1', 3, propertySet('<Mute val="1"/>')) == 412
+    notify(manager, new_callback, 'uuid:sub-2', 0,
+           propertySet('<Volume channel="Master" val="18"/>'))
+    assert manager.getState(*KEY) == {'Volume': '18'}
+
+
+def test_renew_before_expiry(manager, device):
+    device.timeout = 2
+    subscribe(manager, device)
+    # Renewed after half of the granted time with the SID and without a CALLBACK
+    assert waitFor(lambda: len(device.subscribes()) == 2, 3.0)
+    renewal = device.subscribes()[-1]
+    assert renewal['SID'] == 'uuid:sub-1'
+    assert 'CALLBACK' not in renewal
+
+
+def test_failed_renewal_subscribes_again(manager, device):
+    device.timeout = 2
+    subscribe(manager, device)
+    device.renew_status = 412
+    assert waitFor(lambda: len(device.subscribes()) == 3, 3.0)
+    assert 'SID' in device.subscribes()[1]
+    assert 'CALLBACK' in device.subscribes()[2]
+    assert manager.stats['failures'] == 1
+
+
+def test_state_expires_without_renewal(manager, device):
+    device.timeout = 1
+    callback = subscribe(manager, device)['CALLBACK']
+    notify(manager, callback, 'uuid:sub-1', 0, propertySet('<Volume channel="Master" val="17"/>'))
+    assert manager.getState(*KEY) == {'Volume': '17'}
+    device.down = True
+    # The renewal fails and is only tried again after retry_interval; the state is not served
+    # beyond the expiry of the subscription
+    assert waitFor(lambda: manager.getState(*KEY) is None, 2.0)
+    assert manager.stats['failures'] >= 1
+
+
+def test_removed_target_and_stop_unsubscribe(manager, device):
+    subscribe(manager, device)
+    manager.setTargets({})
+    assert waitFor(lambda: [method for method, _ in device.requests] == ['SUBSCRIBE',
+                                                                         'UNSUBSCRIBE'])
+    assert device.requests[-1][1]['SID'] == 'uuid:sub-1'
+    manager.setTargets({KEY: device.url})
+    assert waitFor(lambda: manager.stats['subscriptions'] == 1)
+    manager.stop()
+    assert device.requests[-1][0] == 'UNSUBSCRIBE'
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""Tests of the host long-polls: backoff, host health and the updateID against a fake host"""
+
+import asyncio
+import http.client
+import http.server
+import logging
+import socket
+import threading
+import time
+import types
+import urllib.parse
+from urllib.error import URLError
+
+import pytest
+
+import raumfeld
+from raumfeld import aio
+from raumfeld.health import CONNECTED, DEGRADED, DISCONNECTED, HostHealth, ReconnectPolicy
+from raumfeld.topology import diffTopology
+
+DEVICES = ('<?xml version="1.0" encoding="utf-8"?><devices>'
+           '<device location="http://127.0.0.1:9/zone.xml" type="urn:schemas-upnp-org:device:'
+           'MediaRenderer:1" udn="uuid:zone-1">Wohnzimmer</device>'
+           '<device location="http://127.0.0.1:9/speaker.xml" type="urn:schemas-upnp-org:device:'
+           'MediaRenderer:1" udn="uuid:renderer-1">Speaker</device></devices>').encode('utf-8')
+ZONES = ('<?xml version="1.0" encoding="utf-8"?><zoneConfig><zones><zone udn="uuid:zone-1">'
+         '<room name="Wohnzimmer" udn="uuid:room-1"><renderer name="Speaker" '
+         'udn="uuid:renderer-1"/></room></zone></zones></zoneConfig>').encode('utf-8')
+
+
+class FakeHost(http.server.ThreadingHTTPServer):
+    """Web services of a Raumfeld host with one zone, records (service, updateID) of the polls
+
+    A poll with the current updateID is held for poll_timeout seconds. status is the HTTP status
+    of the answers and delay postpones every answer.
+    """
+    daemon_threads = True
+
+    def __init__(self, poll_timeout=0.3):
+        http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), FakeHostHandler)
+        self.poll_timeout = poll_timeout
+        self.update_id = '1'
+        self.status = 200
+        self.delay = 0
+        self.requests = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeHostHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        service = urllib.parse.urlparse(self.path).path.rpartition('/')[2]
+        update_id = self.headers.get('updateID') or ''
+        self.server.requests.append((service, update_id, self.server.status))
+        time.sleep(self.server.delay)
+        if self.server.status != 200:
+            body = b'unavailable'
+        else:
+            if update_id == self.server.update_id:
+                time.sleep(self.server.poll_timeout)
+            body = DEVICES if service == 'listDevices' else ZONES
+        self.send_response(self.server.status)
+        self.send_header('updateID', self.server.update_id)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def waitFor(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def host():
+    server = FakeHost()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class ScriptedFetch(object):
+    """fetch(updateID) for _longPoll: returns or raises the outcomes in their order
+
+    Records the updateID and the host health of every call and closes the system at the end
+    """
+
+    def __init__(self, system, outcomes):
+        self.system = system
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def __call__(self, updateID):
+        self.calls.append((updateID, self.system.getHostHealth()))
+        if not self.outcomes:
+            self.system._closed = True
+            return ''
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """The delays _longPoll sleeps, without sleeping"""
+    delays = []
+    monkeypatch.setattr(raumfeld, 'time', types.SimpleNamespace(
+        sleep=delays.append, time=time.time, monotonic=time.monotonic))
+    return delays
+
+
+def scriptedSystem():
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    system.configureReconnect(initialDelay=1.0, maxDelay=8.0, factor=2.0, jitter=0.0,
+                              failureThreshold=3)
+    return system
+
+
+def test_backoff_schedule():
+    policy = ReconnectPolicy(initial_delay=1.0, max_delay=10.0, factor=2.0, jitter=0.0)
+    assert [policy.delay(failures) for failures in range(1, 7)] == [1, 2, 4, 8, 10, 10]
+    policy.configure(jitter=0.5)
+    assert all(2.0 <= policy.delay(3) <= 4.0 for _ in range(100))
+
+
+def test_host_health_transitions():
+    changes = []
+    health = HostHealth(failure_threshold=2, on_change=changes.append)
+    assert health.state == DISCONNECTED
+    health.success('listDevices')
+    assert health.state == CONNECTED
+    health.failure('getZones')
+    assert health.state == DEGRADED
+    health.failure('getZones')
+    assert health.state == DISCONNECTED
+    # Only the poller which noticed it probes the host while the circuit is open
+    assert health.mayRequest('getZones')
+    assert not health.mayRequest('listDevices')
+    assert not health.waitUntilConnected(0.01)
+    health.success('getZones')
+    assert health.state == CONNECTED
+    assert health.mayRequest('listDevices')
+    assert health.failures('getZones') == 0
+    assert changes == [CONNECTED, DEGRADED, DISCONNECTED, CONNECTED]
+
+
+def test_url_error_timeout_resets_the_update_id(sleeps):
+    system = scriptedSystem()
+    fetch = ScriptedFetch(system, ['5', URLError(socket.timeout('timed out')), '6'])
+    system._longPoll('getZones', fetch)
+    assert [updateID for updateID, _ in fetch.calls] == ['', '5', '', '6']
+    # Not a failure: no delay and the host stays connected
+    assert sleeps == []
+    assert system._hostHealth.failures('getZones') == 0
+    assert system.getHostHealth() == CONNECTED
+
+
+def test_read_timeout_resets_the_update_id(sleeps):
+    # A timeout while waiting for the response is a bare socket.timeout, not a URLError
+    system = scriptedSystem()
+    fetch = ScriptedFetch(system, ['5', socket.timeout('timed out'), '6'])
+    system._longPoll('getZones', fetch)
+    assert [updateID for updateID, _ in fetch.calls] == ['', '5', '', '6']
+    assert [state for _, state in fetch.calls][1:] == [CONNECTED] * 3
+    assert sleeps == []
+    assert system._hostHealth.failures('getZones') == 0
+
+
+def test_host_which_never_answers(sleeps):
+    with socket.socket() as silent:
+        # Connections are accepted by the kernel, but no request is ever answered
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(8)
+        system = raumfeld.RaumfeldSystem('127.0.0.1', silent.getsockname()[1])
+        system._LONG_POLL_TIMEOUT = 0.1
+        system._hostHealth.success('getZones')
+        calls = []
+
+        def fetch(updateID):
+            calls.append(updateID)
+            if len(calls) == 3:
+                system._closed = True
+            return system._getZones(updateID)
+        system._longPoll('getZones', fetch)
+    assert calls == ['', '', '']
+    assert sleeps == []
+    assert system._hostHealth.failures('getZones') == 0
+    assert system.getHostHealth() == CONNECTED
+
+
+def test_backoff_and_health_of_a_failing_host(sleeps):
+    system = scriptedSystem()
+    errors = [OSError('unreachable'), http.client.RemoteDisconnected('closed'),
+              URLError(ConnectionRefusedError()), OSError('unreachable')]
+    fetch = ScriptedFetch(system, ['5'] + errors + ['7'])
+    system._longPoll('listDevices', fetch)
+    assert sleeps == [1.0, 2.0, 4.0, 8.0]
+    assert [state for _, state in fetch.calls] == [DISCONNECTED, CONNECTED, DEGRADED, DEGRADED,
+                                                   DISCONNECTED, DISCONNECTED, CONNECTED]
+    # Every request after a failure is sent without updateID, so the host answers at once
+    assert [updateID for updateID, _ in fetch.calls] == ['', '5', '', '', '', '', '7']
+
+
+def test_reconnect_to_the_fake_host(host):
+    system = raumfeld.RaumfeldSystem('127.0.0.1', host.port)
+    system.configureReconnect(initialDelay=0.05, maxDelay=0.1, jitter=0.0, failureThreshold=2)
+    try:
+        topology = system.init().result(5)
+        assert [zone.Name for zone in topology.zones] == ['Wohnzimmer']
+        assert system.getHostHealth() == CONNECTED
+        # The first poll gets the data at once, the following ones wait with the updateID
+        assert waitFor(lambda: ('getZones', '1', 200) in host.requests)
+        assert host.requests[0][1] == ''
+
+        host.status = 503
+        assert waitFor(lambda: system.getHostHealth() == DISCONNECTED)
+        failed = len(host.requests)
+        host.status = 200
+        assert waitFor(lambda: system.getHostHealth() == CONNECTED)
+        recovered = [request for request in host.requests[failed:] if request[2] == 200]
+        assert recovered[0][1] == ''
+    finally:
+        system.close()
+
+
+def test_aio_start_and_reconnect(host):
+    async def run():
+        raumfeld_host = aio.RaumfeldHost('127.0.0.1', host.port)
+        raumfeld_host.configureReconnect(initialDelay=0.05, maxDelay=0.1, jitter=0.0,
+                                         failureThreshold=2)
+        await raumfeld_host.start(timeout=5)
+        try:
+            assert [zone.Name for zone in raumfeld_host.getZones()] == ['Wohnzimmer']
+            assert raumfeld_host.getHostHealth() == CONNECTED
+            host.status = 503
+            for _ in range(100):
+                if raumfeld_host.getHostHealth() == DISCONNECTED:
+                    break
+                await asyncio.sleep(0.05)
+            assert raumfeld_host.getHostHealth() == DISCONNECTED
+            failed = len(host.requests)
+            host.status = 200
+            for _ in range(100):
+                if raumfeld_host.getHostHealth() == CONNECTED:
+                    break
+                await asyncio.sleep(0.05)
+            assert raumfeld_host.getHostHealth() == CONNECTED
+            assert [request for request in host.requests[failed:] if request[2] == 200][0][1] == ''
+        finally:
+            await raumfeld_host.close()
+    asyncio.run(run())
+
+
+def test_aio_start_fails_if_the_host_does_not_answer():
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+
+    async def run():
+        raumfeld_host = aio.RaumfeldHost('127.0.0.1', port)
+        raumfeld_host.configureReconnect(initialDelay=0.01, maxDelay=0.05, failureThreshold=2)
+        with pytest.raises(ConnectionError):
+            await raumfeld_host.start(timeout=5)
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_aio_start_timeout(host):
+    host.delay = 2
+
+    async def run():
+        raumfeld_host = aio.RaumfeldHost('127.0.0.1', host.port)
+        with pytest.raises(asyncio.TimeoutError):
+            await raumfeld_host.start(timeout=0.2)
+    asyncio.run(run())
+
+
+def test_aio_poll_survives_a_failing_handler(host, caplog):
+    async def run():
+        raumfeld_host = aio.RaumfeldHost('127.0.0.1', host.port)
+        onZones = raumfeld_host._onZones
+        calls = []
+
+        def failOnce(content):
+            calls.append(content)
+            if len(calls) == 1:
+                raise RuntimeError('broken')
+            onZones(content)
+        raumfeld_host._onZones = failOnce
+        await raumfeld_host.start(timeout=5)
+        try:
+            assert [zone.Name for zone in raumfeld_host.getZones()] == ['Wohnzimmer']
+            assert raumfeld_host.getHostHealth() == CONNECTED
+        finally:
+            await raumfeld_host.close()
+        return calls
+    with caplog.at_level(logging.ERROR, logger='root'):
+        assert len(asyncio.run(run())) == 2
+    assert "Handling the getZones response failed" in caplog.text
+
+
+def test_aio_changes_are_merged_if_not_consumed():
+    unassigned = ZONES.replace(b'<zones><zone udn="uuid:zone-1">', b'<zones></zones>'
+                               b'<unassignedRooms>').replace(b'</zone></zones>',
+                                                            b'</unassignedRooms>')
+
+    async def run():
+        raumfeld_host = aio.RaumfeldHost('127.0.0.1')
+        raumfeld_host._ready = asyncio.Event()
+        changes = raumfeld_host.changes(maxPending=2)
+        first = asyncio.ensure_future(changes.__anext__())
+        await asyncio.sleep(0)
+        states = []
+        raumfeld_host._onDevices(DEVICES)
+        for zones in (ZONES, unassigned, ZONES, unassigned):
+            states.append(raumfeld_host.getTopology().state)
+            raumfeld_host._onZones(zones)
+        states.append(raumfeld_host.getTopology().state)
+        diffs = [await first, await changes.__anext__()]
+        assert raumfeld_host._queues.pop().empty()
+        await changes.aclose()
+        return states, diffs
+    states, diffs = asyncio.run(run())
+    # The first three changes are merged: the room is in the zone as after the first one
+    assert diffs == [diffTopology(states[0], states[3]), diffTopology(states[3], states[4])]
+    assert diffs[0] == diffTopology(states[0], states[1])
+    assert diffs[0].rooms_added == ('uuid:room-1',)
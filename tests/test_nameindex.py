@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Tests of the name index used to look up zones and rooms by their names"""
+
+from collections import namedtuple
+
+import pytest
+
+import raumfeld
+from raumfeld.nameindex import NameIndex, normalizeName
+from raumfeld.topology import (DeviceRecord, RendererRecord, RoomRecord, ZoneRecord,
+                               buildTopologyState)
+
+Element = namedtuple('Element', ['Name', 'UDN'])
+
+
+@pytest.mark.parametrize('name, normalized', [
+    ('Küche', 'kueche'),
+    ('  Wohn  Zimmer ', 'wohn zimmer'),
+    ('Straße', 'strasse'),
+    ('Café', 'cafe'),
+    ('Küche', 'kueche'),  # decomposed umlaut
+])
+def test_normalize(name, normalized):
+    assert normalizeName(name) == normalized
+
+
+def test_ranking():
+    elements = [Element('Küche', 'uuid:3'), Element('Küchenzeile', 'uuid:2'),
+                Element('Wohnküche', 'uuid:1'), Element('Bad', 'uuid:4'),
+                Element('Küche', 'uuid:0')]
+    index = NameIndex(elements)
+    # Exact matches first, the same names ordered by UDN, then prefix, then substring matches
+    assert [element.UDN for element in index.find('küche')] == \
+        ['uuid:0', 'uuid:3', 'uuid:2', 'uuid:1']
+    for query in ('Kueche', 'KUCHE', 'kuche', 'Küche'):
+        assert [element.UDN for element in index.find(query)] == \
+            ['uuid:0', 'uuid:3', 'uuid:2', 'uuid:1']
+    assert index.findFirst('küche').UDN == 'uuid:0'
+    assert index.findFirst('küchenz').UDN == 'uuid:2'
+    assert index.findFirst('wohn').UDN == 'uuid:1'
+    assert index.findFirst('zimmer') is None
+    assert index.find('') == sorted(index.find(''), key=lambda element: (
+        len(normalizeName(element.Name)), normalizeName(element.Name), element.UDN))
+
+
+def test_missing_names():
+    index = NameIndex([Element(None, 'uuid:1'), Element('', 'uuid:2'), Element('Bad', 'uuid:3')])
+    assert [element.UDN for element in index.find('bad')] == ['uuid:3']
+    assert index.findFirst('x') is None
+
+
+def test_system_lookups():
+    devices = {}
+    for udn, name in (('uuid:zone-1', 'Wohnzimmer'), ('uuid:zone-2', 'Küche & Bad'),
+                      ('uuid:speaker-1', 'Speaker'), ('uuid:speaker-2', 'Speaker'),
+                      ('uuid:speaker-3', 'Speaker')):
+        devices[udn] = DeviceRecord(udn, name, 'http://127.0.0.1:9/{0}.xml'.format(udn[5:]),
+                                    'urn:schemas-upnp-org:device:MediaRenderer:1')
+
+    def room(udn, name, speaker):
+        return RoomRecord(udn, name, (RendererRecord(speaker, 'Speaker'),))
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    system._publishTopologyState(buildTopologyState(
+        [ZoneRecord('uuid:zone-1', (room('uuid:room-1', 'Wohnzimmer', 'uuid:speaker-1'),)),
+         ZoneRecord('uuid:zone-2', (room('uuid:room-2', 'Küche', 'uuid:speaker-2'),
+                                    room('uuid:room-3', 'Bad', 'uuid:speaker-3')))],
+        [], devices))
+    try:
+        assert system.getRoomByName('kueche').UDN == 'uuid:room-2'
+        assert [room.UDN for room in system.getRoomsByName('z')] == ['uuid:room-1']
+        assert system.getZoneByName('kuche & bad').UDN == 'uuid:zone-2'
+        assert system.getZoneByName('wohn').UDN == 'uuid:zone-1'
+        assert [zone.UDN for zone in system.getZoneWithRoomName('e')] == \
+            ['uuid:zone-2', 'uuid:zone-1']
+        # The index follows a rename
+        system._publishTopologyState(buildTopologyState(
+            [ZoneRecord('uuid:zone-1', (room('uuid:room-1', 'Salon', 'uuid:speaker-1'),))],
+            [room('uuid:room-2', 'Küche', 'uuid:speaker-2')], devices))
+        assert system.getRoomByName('wohnzimmer') is None
+        assert system.getRoomByName('salon').UDN == 'uuid:room-1'
+        assert system.getRoomByName('küche').UDN == 'uuid:room-2'
+    finally:
+        system.close()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Tests of the SSDP discovery against a fake device answering M-SEARCH on localhost"""
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from raumfeld import ssdp
+from raumfeld.ssdp import CONFIG_DEVICE, MEDIA_RENDERER, MEDIA_SERVER, SsdpCache, SsdpResponse
+
+HOST_USN = 'uuid:host::' + CONFIG_DEVICE
+
+
+class FakeResponder(object):
+    """UDP socket on localhost answering every M-SEARCH for the service types of its devices
+
+    devices is a list of (usn, st, max_age); searches records the ST of every M-SEARCH
+    """
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.searches = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def group(self):
+        return self.sock.getsockname()
+
+    def serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except OSError:
+                return
+            headers = dict(line.split(': ', 1) for line in data.decode().split('\r\n')[1:] if line)
+            self.searches.append(headers['ST'])
+            for usn, st, max_age in self.devices:
+                if st == headers['ST']:
+                    self.sock.sendto(self.answer(usn, st, max_age), address)
+
+    @staticmethod
+    def answer(usn, st, max_age):
+        return '\r\n'.join(['HTTP/1.1 200 OK', 'CACHE-CONTROL: max-age={0}'.format(max_age),
+                            'LOCATION: http://127.0.0.1:47365/{0}.xml'.format(usn[5:9]),
+                            'SERVER: Linux UPnP/1.0 Raumfeld', 'ST: ' + st, 'USN: ' + usn,
+                            '', '']).encode('utf-8')
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    ssdp.getDiscoveryCache().clear()
+    yield ssdp.getDiscoveryCache()
+    ssdp.getDiscoveryCache().clear()
+
+
+@pytest.fixture
+def responder():
+    fake = FakeResponder([(HOST_USN, CONFIG_DEVICE, 1800),
+                          ('uuid:rend-1::' + MEDIA_RENDERER, MEDIA_RENDERER, 1800),
+                          ('uuid:rend-2::' + MEDIA_RENDERER, MEDIA_RENDERER, 1800),
+                          ('uuid:serv-1::' + MEDIA_SERVER, MEDIA_SERVER, 1800)])
+    yield fake
+    fake.close()
+
+
+def test_parse_search_response():
+    response = ssdp.parseSearchResponse(FakeResponder.answer(HOST_USN, CONFIG_DEVICE, 60),
+                                        ('192.168.0.10', 1900))
+    assert (response.usn, response.st, response.max_age) == (HOST_USN, CONFIG_DEVICE, 60)
+    assert response.address == '192.168.0.10'
+    assert response.host == '127.0.0.1'
+    assert ssdp.parseSearchResponse(b'NOTIFY * HTTP/1.1\r\n\r\n', ('192.168.0.10', 1900)) is None
+    assert ssdp.parseSearchResponse(b'HTTP/1.1 200 OK\r\nST: x\r\n\r\n', ('::1', 0)) is None
+
+
+def test_answers_are_deduplicated_by_usn(responder):
+    responses = ssdp.discover(timeout=3.0, quiet=0.3, useCache=False, group=responder.group)
+    # Every M-SEARCH is sent twice, so every device answered twice
+    assert len(responder.searches) == 2 * len(ssdp.ALL_TARGETS)
+    assert sorted(response.usn for response in responses) == sorted(
+        usn for usn, _, _ in responder.devices)
+
+
+def test_search_ends_at_the_wanted_answer(responder):
+    start = time.monotonic()
+    responses = ssdp.discover((CONFIG_DEVICE,), timeout=5.0, wanted=CONFIG_DEVICE, quiet=5.0,
+                              useCache=False, group=responder.group)
+    assert time.monotonic() - start < 1.0
+    assert [response.usn for response in responses] == [HOST_USN]
+
+
+def test_search_ends_after_the_quiet_period(responder):
+    start = time.monotonic()
+    responses = ssdp.discover((MEDIA_RENDERER,), timeout=5.0, quiet=0.3, useCache=False,
+                              group=responder.group)
+    assert 0.3 <= time.monotonic() - start < 1.5
+    assert len(responses) == 2
+
+
+def test_search_without_answers_ends_at_the_timeout():
+    silent = FakeResponder([])
+    try:
+        start = time.monotonic()
+        assert ssdp.discover(timeout=0.3, quiet=0.1, useCache=False, group=silent.group) == []
+        assert 0.3 <= time.monotonic() - start < 1.0
+    finally:
+        silent.close()
+
+
+def test_discover_host_uses_the_cache(responder):
+    assert ssdp.discoverHost(group=responder.group) == '127.0.0.1'
+    searches = len(responder.searches)
+    assert ssdp.discoverHost(group=responder.group) == '127.0.0.1'
+    assert len(responder.searches) == searches
+    assert ssdp.discoverHost(useCache=False, group=responder.group) == '127.0.0.1'
+    assert len(responder.searches) > searches
+
+
+def test_expired_answers_are_searched_again(cache):
+    fake = FakeResponder([(HOST_USN, CONFIG_DEVICE, 0)])
+    try:
+        assert ssdp.discoverHost(group=fake.group) == '127.0.0.1'
+        searches = len(fake.searches)
+        assert cache.get((CONFIG_DEVICE,)) == []
+        assert ssdp.discoverHost(group=fake.group) == '127.0.0.1'
+        assert len(fake.searches) > searches
+    finally:
+        fake.close()
+
+
+def test_cache_expiry():
+    cache = SsdpCache()
+    now = time.monotonic()
+    valid = SsdpResponse('uuid:a', MEDIA_RENDERER, 'http://a/', '', 60, '10.0.0.1', now + 60)
+    expired = SsdpResponse('uuid:b', MEDIA_RENDERER, 'http://b/', '', 1, '10.0.0.2', now - 1)
+    cache.add(valid)
+    cache.add(expired)
+    assert cache.get((MEDIA_RENDERER,)) == [valid]
+    assert cache.get((MEDIA_SERVER,)) == []
+    # A newer answer of the same device replaces the old one
+    renewed = valid._replace(location='http://a2/')
+    cache.add(renewed)
+    assert cache.get((MEDIA_RENDERER,)) == [renewed]
+
+
+def test_discover_async(responder):
+    async def run():
+        start = time.monotonic()
+        responses = await ssdp.discoverAsync((CONFIG_DEVICE, MEDIA_RENDERER), timeout=5.0,
+                                             wanted=CONFIG_DEVICE, quiet=5.0, useCache=False,
+                                             group=responder.group)
+        assert time.monotonic() - start < 1.0
+        assert HOST_USN in [response.usn for response in responses]
+        assert await ssdp.discoverHostAsync(group=responder.group) == '127.0.0.1'
+    asyncio.run(run())
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Tests of the topology records, diffTopology and applyTopologyDiff"""
+
+import io
+import threading
+
+import pytest
+
+import raumfeld
+from raumfeld import aio
+from raumfeld.topology import (EMPTY_SNAPSHOT, DeviceRecord, RendererRecord, RoomRecord,
+                               ZoneRecord, applyTopologyDiff, buildTopologyState, diffTopology,
+                               parseDevices, parseZones)
+
+MEDIA_RENDERER = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+
+
+def topologyState(zones, unassigned=(), names=None, locations=None):
+    """TopologyState of a dict zone -> list of rooms; every room has the renderer <room>-speaker
+
+    names and locations map UDNs to other names and locations than the defaults
+    """
+    names = names or {}
+    locations = locations or {}
+
+    def roomRecord(room):
+        speaker = room + '-speaker'
+        return RoomRecord(room, names.get(room, room),
+                          (RendererRecord(speaker, names.get(speaker, speaker)),))
+
+    devices = {}
+    for udn in list(zones) + [room + '-speaker' for rooms in zones.values() for room in rooms] + \
+            [room + '-speaker' for room in unassigned]:
+        devices[udn] = DeviceRecord(udn, names.get(udn, udn),
+                                    locations.get(udn, 'http://127.0.0.1:9/{0}.xml'.format(udn)),
+                                    MEDIA_RENDERER)
+    return buildTopologyState([ZoneRecord(zone, tuple(roomRecord(room) for room in rooms))
+                               for zone, rooms in zones.items()],
+                              [roomRecord(room) for room in unassigned], devices)
+
+
+def apply(snapshot, state):
+    return applyTopologyDiff(snapshot, state, diffTopology(snapshot.state, state), aio.Zone,
+                             aio.Room, aio.Renderer)
+
+
+def describe(snapshot):
+    """The topology of a snapshot as plain data, from its objects and its indexes"""
+    zones = [(zone.UDN, zone.Name, zone.Location,
+              [(room.UDN, room.Name, [(renderer.UDN, renderer.Name, renderer.Location)
+                                      for renderer in room.getRenderers()])
+               for room in zone.getRooms()])
+             for zone in snapshot.zones]
+    unassigned = [room.UDN for room in snapshot.unassigned_rooms]
+    indexes = (sorted(snapshot.zones_by_udn), sorted(snapshot.rooms_by_udn),
+               sorted(snapshot.renderers_by_udn),
+               sorted((room, zone.UDN) for room, zone in snapshot.zone_by_room_udn.items()),
+               sorted((renderer, room.UDN)
+                      for renderer, room in snapshot.room_by_renderer_udn.items()))
+    return zones, unassigned, indexes
+
+
+def test_parse_records():
+    devices = parseDevices(io.BytesIO(
+        b'<?xml version="1.0"?><devices><device location="http://127.0.0.1:9/z.xml" type="'
+        + MEDIA_RENDERER.encode() + b'" udn="uuid:zone-1">K&#252;che &amp; Bad</device></devices>'))
+    assert devices == (DeviceRecord('uuid:zone-1', 'Küche & Bad', 'http://127.0.0.1:9/z.xml',
+                                    MEDIA_RENDERER),)
+    zones, unassigned = parseZones(io.BytesIO(
+        b'<?xml version="1.0"?><zoneConfig><zones><zone udn="uuid:zone-1">'
+        b'<room name="Bad" udn="uuid:room-1"><renderer name="Speaker" udn="uuid:speaker-1"/>'
+        b'</room></zone></zones><unassignedRooms><room name="Flur" udn="uuid:room-2"/>'
+        b'</unassignedRooms></zoneConfig>'))
+    assert zones == (ZoneRecord('uuid:zone-1', (RoomRecord('uuid:room-1', 'Bad', (
+        RendererRecord('uuid:speaker-1', 'Speaker'),)),)),)
+    assert unassigned == (RoomRecord('uuid:room-2', 'Flur', ()),)
+
+
+def test_unresolved_devices():
+    state = buildTopologyState(
+        [ZoneRecord('zone-1', (RoomRecord('room-1', 'Bad', (RendererRecord('speaker-1', 'S'),)),)),
+         ZoneRecord('zone-2', ())], [],
+        {'zone-1': DeviceRecord('zone-1', 'Bad', 'http://127.0.0.1:9/z.xml', MEDIA_RENDERER)})
+    assert state.unresolved == ('speaker-1', 'zone-2')
+    assert list(state.zones) == ['zone-1']
+    assert state.rooms['room-1'].renderers == ()
+
+
+def test_diff():
+    old = topologyState({'zone-1': ['room-1', 'room-2'], 'zone-2': ['room-3']}, ['room-4'])
+    assert not diffTopology(old, old)
+    new = topologyState({'zone-1': ['room-1'], 'zone-3': ['room-2', 'room-4']}, ['room-5'],
+                        names={'room-1': 'Bad'},
+                        locations={'room-1-speaker': 'http://127.0.0.1:9/moved.xml'})
+    diff = diffTopology(old, new)
+    assert diff.zones_added == ('zone-3',)
+    assert diff.zones_removed == ('zone-2',)
+    assert diff.zones_changed == ()
+    assert diff.rooms_added == ('room-5',)
+    assert diff.rooms_removed == ('room-3',)
+    assert sorted(diff.rooms_moved) == [('room-2', 'zone-1', 'zone-3'), ('room-4', None, 'zone-3')]
+    assert diff.rooms_changed == ('room-1',)
+    assert diff.renderers_added == ('room-5-speaker',)
+    assert diff.renderers_removed == ('room-3-speaker',)
+    assert diff.renderers_moved == ()
+    assert diff.renderers_changed == ('room-1-speaker',)
+
+
+def test_apply_round_trips():
+    states = [
+        topologyState({'zone-1': ['room-1', 'room-2'], 'zone-2': ['room-3']}, ['room-4']),
+        topologyState({'zone-1': ['room-2', 'room-1']}, ['room-3', 'room-4']),
+        topologyState({'zone-1': ['room-1'], 'zone-3': ['room-2', 'room-4']}, ['room-5'],
+                      names={'zone-1': 'Wohnzimmer', 'room-2': 'Bad'},
+                      locations={'room-1-speaker': 'http://127.0.0.1:9/moved.xml'}),
+        topologyState({}, ['room-1', 'room-2']),
+        topologyState({'zone-1': ['room-1', 'room-2', 'room-3']}),
+    ]
+    # Applying the diffs one after the other gives the same snapshot as building each state
+    # from scratch, in both directions
+    for sequence in (states, states[::-1]):
+        snapshot = EMPTY_SNAPSHOT
+        for state in sequence:
+            snapshot = apply(snapshot, state)
+            assert snapshot.state is state
+            assert describe(snapshot) == describe(apply(EMPTY_SNAPSHOT, state))
+        assert describe(apply(snapshot, states[0])) == describe(apply(EMPTY_SNAPSHOT, states[0]))
+
+
+def test_topology_listeners_get_the_diff():
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    diffs = []
+    received = threading.Event()
+
+    def onChange(diff):
+        diffs.append(diff)
+        received.set()
+    system.registerTopologyCallback(onChange)
+    old = topologyState({'zone-1': ['room-1']})
+    new = topologyState({'zone-1': ['room-1', 'room-2']})
+    system._publishTopologyState(old)
+    assert received.wait(5)
+    received.clear()
+    system._publishTopologyState(new)
+    assert received.wait(5)
+    assert diffs == [diffTopology(EMPTY_SNAPSHOT.state, old), diffTopology(old, new)]
+    assert system.getZoneWithRoomUDN('room-2').UDN == 'zone-1'
+    system.close()
+
+
+def test_snapshots_are_copy_on_write():
+    old_state = topologyState({'zone-1': ['room-1', 'room-2'], 'zone-2': ['room-3']}, ['room-4'])
+    old = apply(EMPTY_SNAPSHOT, old_state)
+    described = describe(old)
+    zone_1, zone_2 = old.zones
+    new = apply(old, topologyState({'zone-1': ['room-1'], 'zone-2': ['room-3']},
+                                   ['room-2', 'room-4']))
+    # The published snapshot and its objects are left untouched
+    assert describe(old) == described
+    assert [room.UDN for room in zone_1.getRooms()] == ['room-1', 'room-2']
+    # The zone which lost a room is a new object, everything else is shared
+    assert new.zones_by_udn['zone-1'] is not zone_1
+    assert new.zones_by_udn['zone-2'] is zone_2
+    assert all(new.rooms_by_udn[udn] is old.rooms_by_udn[udn] for udn in old.rooms_by_udn)
+    # The new zone at the same location keeps the SOAP services of the old one
+    assert new.zones_by_udn['zone-1']._avTransport is zone_1._avTransport
+    assert new.version == old.version + 1
+
+
+def test_snapshot_indexes_are_read_only():
+    snapshot = apply(EMPTY_SNAPSHOT, topologyState({'zone-1': ['room-1']}))
+    for mapping in (snapshot.zones_by_udn, snapshot.rooms_by_udn, snapshot.renderers_by_udn,
+                    snapshot.zone_by_room_udn, snapshot.room_by_renderer_udn):
+        with pytest.raises(TypeError):
+            mapping['other'] = None
+    assert isinstance(snapshot.zones, tuple)
+    assert isinstance(snapshot.zones[0].getRooms(), tuple)
+
+
+def test_stale_snapshot_and_version():
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    state = topologyState({'zone-1': ['room-1']})
+    system._publishTopologyState(state, stale=True)
+    stale = system.getTopology()
+    assert (stale.stale, stale.version) == (True, 1)
+    # Confirmed by the host: the same objects, no new version
+    system._publishTopologyState(state)
+    confirmed = system.getTopology()
+    assert (confirmed.stale, confirmed.version) == (False, 1)
+    assert confirmed.zones == stale.zones
+    assert system._ready.result(1) is confirmed
+    system.close()
+
+
+def test_readers_see_consistent_snapshots():
+    system = raumfeld.RaumfeldSystem('127.0.0.1')
+    states = [topologyState({'zone-1': ['room-1', 'room-2'], 'zone-2': ['room-3']}),
+              topologyState({'zone-1': ['room-1'], 'zone-2': ['room-3', 'room-2']}),
+              topologyState({'zone-1': ['room-1', 'room-2', 'room-3']})]
+    system._publishTopologyState(states[0])
+    stop = threading.Event()
+
+    def publish():
+        index = 0
+        while not stop.is_set():
+            index += 1
+            system._publishTopologyState(states[index % len(states)])
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    try:
+        for _ in range(2000):
+            snapshot = system.getTopology()
+            rooms = [room for zone in snapshot.zones for room in zone.getRooms()]
+            assert sorted(room.UDN for room in rooms) == ['room-1', 'room-2', 'room-3']
+            for zone in snapshot.zones:
+                for room in zone.getRooms():
+                    assert snapshot.zone_by_room_udn[room.UDN] is zone
+    finally:
+        stop.set()
+        publisher.join()
+        system.close()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Tests of the concurrent WSGI server"""
+
+import http.client
+import logging
+
+import pytest
+
+from raumfeld.wsgiserver import WSGIServer
+
+
+def application(environ, start_response):
+    path = environ['PATH_INFO']
+    if path == '/error':
+        raise ValueError('broken')
+    if path == '/no_start_response':
+        return [b'forgotten']
+    if path == '/head':
+        # Like bottle: the body of the GET response is dropped, its Content-Length kept
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '11')])
+        return []
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '999')])
+    return [b'hello ', environ['QUERY_STRING'].encode('latin-1')]
+
+
+async def asyncRoute(environ, response):
+    await response.send('200 OK', [('Content-Type', 'text/plain')], b'async')
+
+
+@pytest.fixture
+def server():
+    wsgi_server = WSGIServer(application, host='127.0.0.1', port=0, workers=4,
+                             async_routes={'/async': asyncRoute})
+    wsgi_server.start()
+    yield wsgi_server
+    wsgi_server.stop()
+
+
+@pytest.fixture
+def connection(server):
+    client = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    yield client
+    client.close()
+
+
+def get(connection, path):
+    connection.request('GET', path)
+    response = connection.getresponse()
+    return response.status, response.getheader('Content-Length'), response.read()
+
+
+def test_keep_alive(server, connection):
+    assert get(connection, '/hello?world') == (200, '11', b'hello world')
+    assert get(connection, '/async') == (200, '5', b'async')
+    assert get(connection, '/hello?again') == (200, '11', b'hello again')
+    assert server.stats['connections'] == 1
+    assert server.stats['requests'] == 3
+
+
+@pytest.mark.parametrize('path', ['/error', '/no_start_response'])
+def test_application_errors_answer_500(connection, path, caplog):
+    with caplog.at_level(logging.ERROR, logger='root'):
+        status, _, body = get(connection, path)
+    assert (status, body) == (500, b'Internal Server Error')
+    assert "Error in the WSGI application" in caplog.text
+    # The connection stays usable
+    assert get(connection, '/hello?x')[0] == 200
+
+
+def test_head(connection):
+    for path, length in (('/head', '11'), ('/hello?world', '11')):
+        connection.request('HEAD', path)
+        response = connection.getresponse()
+        assert (response.status, response.getheader('Content-Length')) == (200, length)
+        assert response.read() == b''
+    # No body was sent, so the connection can be used for the next request
+    assert get(connection, '/hello?x') == (200, '7', b'hello x')